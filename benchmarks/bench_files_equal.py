@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Compare the size-first, chunked `files_equal` against whole-file reads.
+
+For each size, times three pairs (identical, differing in the first byte, differing
+in size) and reports the peak Python memory each comparison needed.
+
+    python3 benchmarks/bench_files_equal.py
+    python3 benchmarks/bench_files_equal.py --sizes 1K,1M,64M
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BUNDLE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BUNDLE_DIR))
+
+import install_bundle  # noqa: E402
+
+UNITS = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+
+def legacy_files_equal(src: Path, dst: Path) -> bool:
+    try:
+        return src.read_bytes() == dst.read_bytes()
+    except Exception:
+        return False
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def write_file(path: Path, size: int, first_byte: bytes = b"a") -> None:
+    block = os.urandom(min(size, 1024 * 1024)) if size else b""
+    with path.open("wb") as handle:
+        remaining = size
+        first = True
+        while remaining > 0:
+            chunk = block[: min(remaining, len(block))]
+            if first:
+                chunk = first_byte + chunk[1:]
+                first = False
+            handle.write(chunk)
+            remaining -= len(chunk)
+
+
+def measure(func, src: Path, dst: Path, repeat: int) -> tuple[float, int, bool]:
+    best = float("inf")
+    peak = 0
+    result = False
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = func(src, dst)
+        elapsed = time.perf_counter() - started
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = min(best, elapsed)
+    return best, peak, result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1K,1M,500M")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-files-equal-") as tmp:
+        root = Path(tmp)
+        for label in args.sizes.split(","):
+            size = parse_size(label)
+            base = root / f"{label}-base.bin"
+            write_file(base, size)
+            same = root / f"{label}-same.bin"
+            with base.open("rb") as source, same.open("wb") as target:
+                while chunk := source.read(1024 * 1024):
+                    target.write(chunk)
+            first_diff = root / f"{label}-diff.bin"
+            write_file(first_diff, size, first_byte=b"b")
+            other_size = root / f"{label}-size.bin"
+            write_file(other_size, size + 1)
+
+            for case, other in [
+                ("identical", same),
+                ("first byte differs", first_diff),
+                ("size differs", other_size),
+            ]:
+                legacy = measure(legacy_files_equal, base, other, args.repeat)
+                chunked = measure(install_bundle.files_equal, base, other, args.repeat)
+                if legacy[2] != chunked[2]:
+                    print(f"{label} {case}: results disagree")
+                    return 1
+                print(
+                    f"{label:>6} {case:<20} "
+                    f"whole-file {legacy[0] * 1000:>9.2f} ms {legacy[1] / 1048576:>8.1f} MB peak  "
+                    f"chunked {chunked[0] * 1000:>9.2f} ms {chunked[1] / 1048576:>6.1f} MB peak"
+                )
+            for path in (base, same, first_diff, other_size):
+                path.unlink()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
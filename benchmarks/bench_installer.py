@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Time end-to-end installer runs on synthetic payloads and compare them to a baseline.
+
+For each payload size, builds a payload from the real one plus that many synthetic KB
+files (a mix of text and binary, with a share of text files carrying rewrite
+placeholders). It then times these runs in project and global mode: fresh install,
+no-op reinstall, reinstall after changing 1% of the synthetic files, `--uninstall`,
+and `--uninstall-all`.
+
+Each run spawns `install_bundle.py`, so timings include interpreter startup. Results
+are compared against `benchmarks/baseline.json`. A scenario slower than the baseline
+by more than the tolerance is flagged as a regression, and the script exits 1. The
+baseline records the workload it was taken with (`--seed` and the file mix); comparing
+against, or updating, a baseline taken with another workload exits 2. `--repeat` only
+picks the best of N runs of the same workload, so it is not part of that check.
+Baselines are machine-specific; refresh them on the machine you compare on.
+
+    python3 benchmarks/bench_installer.py
+    python3 benchmarks/bench_installer.py --sizes 1k --modes project --repeat 1
+    python3 benchmarks/bench_installer.py --update-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BUNDLE_DIR = Path(__file__).resolve().parent.parent
+INSTALLER = BUNDLE_DIR / "install_bundle.py"
+DEFAULT_BASELINE = BUNDLE_DIR / "benchmarks" / "baseline.json"
+BASELINE_VERSION = 1
+
+WORKLOAD_SETTINGS = ("binary_share", "placeholder_share", "seed")
+SCENARIOS = ["fresh", "noop", "change-1pct", "uninstall", "uninstall-all"]
+MODES = ["project", "global"]
+UNITS = {"K": 1000, "M": 1000 * 1000}
+FILES_PER_DIR = 100
+SYNTHETIC_DIR = "ai-kb/synthetic"
+
+WORDS = [
+    "the", "rule", "applies", "when", "tests", "fail", "review", "module", "layer",
+    "state", "flow", "error", "handling", "retry", "index", "section", "see", "and",
+]
+PLACEHOLDERS = [
+    "~/ai-kb/rules/INDEX.md",
+    "~/.config/opencode/agents/supervisor.md",
+    "__HOME__/ai-kb/AGENTS.md",
+    "~/.cursor/hooks/kb-post-turn-analyzer.py",
+]
+
+
+def parse_count(value: str) -> int:
+    value = value.strip().upper()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def synthetic_text(rng: random.Random, with_placeholders: bool) -> bytes:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(40, 400))]
+    if with_placeholders:
+        for _ in range(rng.randint(1, 4)):
+            words.insert(rng.randrange(len(words)), rng.choice(PLACEHOLDERS))
+    return (" ".join(words) + "\n").encode("utf-8")
+
+
+def synthetic_files(count: int) -> list[str]:
+    return [
+        f"{SYNTHETIC_DIR}/d{index // FILES_PER_DIR:04d}/f{index:06d}" for index in range(count)
+    ]
+
+
+def build_payload(
+    root: Path, count: int, binary_share: float, placeholder_share: float, seed: int
+) -> list[Path]:
+    """Copy the real payload to root and add count synthetic files; return their paths."""
+    shutil.copytree(BUNDLE_DIR / "payload", root, symlinks=True)
+    rng = random.Random(seed)
+    paths: list[Path] = []
+    for stem in synthetic_files(count):
+        if rng.random() < binary_share:
+            path = root / f"{stem}.bin"
+            data = b"\0" + rng.randbytes(rng.randint(256, 4096))
+        else:
+            path = root / f"{stem}.md"
+            data = synthetic_text(rng, rng.random() < placeholder_share)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        paths.append(path)
+    return paths
+
+
+def change_files(paths: list[Path], share: float, seed: int) -> dict[Path, bytes]:
+    """Append to a share of paths; return their original bytes for `restore_files`."""
+    rng = random.Random(seed)
+    originals: dict[Path, bytes] = {}
+    for path in rng.sample(paths, max(1, int(len(paths) * share))):
+        originals[path] = path.read_bytes()
+        with path.open("ab") as handle:
+            handle.write(b"changed\n")
+    return originals
+
+
+def restore_files(originals: dict[Path, bytes]) -> None:
+    for path, data in originals.items():
+        path.write_bytes(data)
+
+
+def run_installer(payload: Path, target_args: list[str], *extra: str) -> float:
+    command = [sys.executable, str(INSTALLER), "--payload", str(payload), *target_args, *extra]
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{result.stderr or result.stdout}")
+    return elapsed
+
+
+def bench_mode(
+    mode: str, payload: Path, synthetic: list[Path], work: Path, repeat: int, seed: int
+) -> dict[str, float]:
+    """Return the best-of-`repeat` seconds for every scenario in one mode."""
+    best = {scenario: float("inf") for scenario in SCENARIOS}
+    for attempt in range(repeat):
+        target = work / f"{mode}-{attempt}"
+        target.mkdir()
+        target_args = (
+            ["--project-dir", str(target)] if mode == "project" else ["--target-home", str(target)]
+        )
+        timings = {"fresh": run_installer(payload, target_args)}
+        timings["noop"] = run_installer(payload, target_args)
+        # Undo the change so later attempts and modes start from the same payload.
+        originals = change_files(synthetic, 0.01, seed + attempt)
+        try:
+            timings["change-1pct"] = run_installer(payload, target_args)
+        finally:
+            restore_files(originals)
+        timings["uninstall"] = run_installer(payload, target_args, "--uninstall")
+        run_installer(payload, target_args)
+        timings["uninstall-all"] = run_installer(
+            payload, target_args, "--uninstall", "--uninstall-all"
+        )
+        shutil.rmtree(target)
+        for scenario, seconds in timings.items():
+            best[scenario] = min(best[scenario], seconds)
+    return best
+
+
+def baseline_settings(args: argparse.Namespace) -> dict[str, object]:
+    return {
+        "binary_share": args.binary_share,
+        "placeholder_share": args.placeholder_share,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+
+def load_baseline(path: Path) -> tuple[dict[str, object] | None, dict[str, float]]:
+    """Return the baseline's settings and results; (None, {}) when there is none yet."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None, {}
+    results = {key: float(value) for key, value in data.get("results", {}).items()}
+    return data.get("settings", {}), results
+
+
+def write_baseline(path: Path, results: dict[str, float], args: argparse.Namespace) -> None:
+    baseline = {
+        "version": BASELINE_VERSION,
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": baseline_settings(args),
+        "results": {key: round(value, 4) for key, value in sorted(results.items())},
+    }
+    path.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1k,10k,100k")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--binary-share",
+        type=float,
+        default=0.2,
+        help="Fraction of synthetic files that are binary. Default: 0.2.",
+    )
+    parser.add_argument(
+        "--placeholder-share",
+        type=float,
+        default=0.3,
+        help="Fraction of synthetic text files containing rewrite placeholders. Default: 0.3.",
+    )
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown over the baseline before flagging, as a fraction. Default: 0.25.",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.1,
+        help="Ignore slowdowns smaller than this many seconds (timer noise). Default: 0.1.",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Merge this run's results into the baseline file instead of comparing.",
+    )
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = sorted(set(modes) - set(MODES))
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+
+    baseline_path = Path(args.baseline)
+    recorded, baseline = load_baseline(baseline_path)
+    wanted = {key: baseline_settings(args)[key] for key in WORKLOAD_SETTINGS}
+    found = {key: (recorded or {}).get(key) for key in WORKLOAD_SETTINGS}
+    if recorded is not None and found != wanted:
+        # Merging would mix workloads in one file, so an update is refused as well.
+        print(
+            f"{baseline_path} was recorded with {found}, not {wanted}; rerun with the "
+            "same settings or pass --baseline PATH for a separate baseline.",
+            file=sys.stderr,
+        )
+        return 2
+    results: dict[str, float] = {}
+    regressions: list[str] = []
+    print(f"{'Case':<30} {'Seconds':>9} {'Baseline':>9} {'Ratio':>7}")
+    for label in args.sizes.split(","):
+        count = parse_count(label)
+        with tempfile.TemporaryDirectory(prefix="bench-installer-") as tmp:
+            work = Path(tmp)
+            payload = work / "payload"
+            synthetic = build_payload(
+                payload, count, args.binary_share, args.placeholder_share, args.seed
+            )
+            for mode in modes:
+                timings = bench_mode(mode, payload, synthetic, work, args.repeat, args.seed)
+                for scenario, seconds in timings.items():
+                    key = f"{mode}/{label.lower()}/{scenario}"
+                    results[key] = seconds
+                    expected = baseline.get(key)
+                    ratio = seconds / expected if expected else None
+                    flag = ""
+                    if (
+                        expected is not None
+                        and seconds > expected * (1 + args.tolerance)
+                        and seconds - expected > args.min_delta
+                    ):
+                        flag = "  REGRESSION"
+                        regressions.append(key)
+                    expected_text = f"{expected:>9.3f}" if expected is not None else f"{'-':>9}"
+                    ratio_text = f"{ratio:>6.2f}x" if ratio is not None else f"{'-':>7}"
+                    print(f"{key:<30} {seconds:>9.3f} {expected_text} {ratio_text}{flag}")
+
+    if args.update_baseline:
+        write_baseline(baseline_path, {**baseline, **results}, args)
+        print(f"Updated {baseline_path} ({len(results)} cases)")
+        return 0
+    if regressions:
+        print(
+            f"{len(regressions)} case(s) slower than the baseline by more than "
+            f"{args.tolerance:.0%}: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
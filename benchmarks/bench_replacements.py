@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Compare the single-pass replacement engine against the legacy per-rule loop.
+
+Runs both implementations over every text file in the real payload (project and global
+rule sets) and over a synthetic KB of configurable size, checks that the outputs agree,
+and prints the timings.
+
+    python3 benchmarks/bench_replacements.py
+    python3 benchmarks/bench_replacements.py --synthetic-mb 50 --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+BUNDLE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BUNDLE_DIR))
+
+import install_bundle  # noqa: E402
+
+SYNTHETIC_WORDS = [
+    "the", "rule", "applies", "when", "tests", "fail", "review", "module", "layer",
+    "coroutine", "state", "flow", "error", "handling", "retry", "index", "section",
+    "`value`", "-", "*", "1.", "see", "for", "and", "with", "x/y", "__init__",
+]
+SYNTHETIC_PLACEHOLDERS = [
+    "~/ai-kb/rules/INDEX.md",
+    "~/.config/opencode/agents/supervisor.md",
+    "__HOME__/ai-kb/AGENTS.md",
+    "~/.cursor/hooks/kb-post-turn-analyzer.py",
+    "__HOME__/.config/opencode/runtime/bootstrap.md",
+]
+
+
+def legacy_apply_replacements(text: str, replacements: list[tuple[str, str]]) -> str:
+    updated = text
+    for old, new in replacements:
+        updated = updated.replace(old, new)
+    return updated
+
+
+def load_payload_texts() -> list[str]:
+    manifest = json.loads((BUNDLE_DIR / "manifest.json").read_text(encoding="utf-8"))
+    exts = set(manifest.get("text_extensions", []))
+    basenames = set(manifest.get("text_basenames", []))
+    texts: list[str] = []
+    for path in install_bundle.iter_payload_files(BUNDLE_DIR / "payload"):
+        if not install_bundle.is_text_file(path, exts, basenames):
+            continue
+        try:
+            texts.append(path.read_text(encoding="utf-8"))
+        except UnicodeDecodeError:
+            continue
+    return texts
+
+
+def synthetic_text(size_bytes: int, density: float, seed: int) -> str:
+    rng = random.Random(seed)
+    words: list[str] = []
+    total = 0
+    while total < size_bytes:
+        if rng.random() < density:
+            word = rng.choice(SYNTHETIC_PLACEHOLDERS)
+        else:
+            word = rng.choice(SYNTHETIC_WORDS)
+        words.append(word)
+        total += len(word) + 1
+    return " ".join(words)
+
+
+def time_best(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_case(
+    label: str,
+    texts: list[str],
+    rules: list[tuple[str, str]],
+    repeat: int,
+) -> bool:
+    install_bundle.compile_replacements.cache_clear()
+    legacy = time_best(
+        lambda: [legacy_apply_replacements(text, rules) for text in texts], repeat
+    )
+    engine = time_best(
+        lambda: [install_bundle.apply_replacements(text, rules) for text in texts],
+        repeat,
+    )
+    mismatches = sum(
+        1
+        for text in texts
+        if legacy_apply_replacements(text, rules)
+        != install_bundle.apply_replacements(text, rules)
+    )
+    size_mb = sum(len(text) for text in texts) / (1024 * 1024)
+    print(
+        f"{label:<28} {len(texts):>6} texts {size_mb:>8.2f} MB  "
+        f"legacy {legacy * 1000:>9.1f} ms  single-pass {engine * 1000:>9.1f} ms  "
+        f"speedup {legacy / engine if engine else float('inf'):>5.2f}x  "
+        f"mismatches {mismatches}"
+    )
+    return mismatches == 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--synthetic-mb", type=float, default=50.0)
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=0.005,
+        help="Fraction of synthetic words that are placeholders. Default: 0.005.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    manifest = json.loads((BUNDLE_DIR / "manifest.json").read_text(encoding="utf-8"))
+    source_home = manifest["source_home"]
+    rule_sets = {
+        "project": install_bundle.dedupe_replacements(
+            install_bundle.project_replacements(
+                source_home, Path("/tmp/project"), Path("/home/bench")
+            )
+        ),
+        "global": install_bundle.dedupe_replacements(
+            install_bundle.global_replacements(source_home, "/home/bench")
+        ),
+    }
+
+    payload_texts = load_payload_texts()
+    synthetic = [
+        synthetic_text(int(args.synthetic_mb * 1024 * 1024), args.density, args.seed)
+    ]
+
+    ok = True
+    for mode, rules in rule_sets.items():
+        ok = bench_case(f"payload ({mode})", payload_texts, rules, args.repeat) and ok
+        ok = (
+            bench_case(
+                f"synthetic {args.synthetic_mb:g} MB ({mode})",
+                synthetic,
+                rules,
+                args.repeat,
+            )
+            and ok
+        )
+    if not ok:
+        print("Single-pass output differs from the legacy loop (see mismatches).")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
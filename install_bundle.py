@@ -3,20 +3,337 @@
 from __future__ import annotations
 
 import argparse
+import collections
+import contextlib
+import cProfile
+import ctypes
+import ctypes.util
+import functools
+import gzip
+import hashlib
+import io
 import json
+import mmap
+import os
+import posixpath
 import re
+import select
 import shutil
 import stat
+import struct
 import subprocess
 import sys
-from dataclasses import dataclass, field
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+from types import MappingProxyType
+from typing import TextIO
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 HOOK_FILE_NAMES = [
     "kb-post-turn-analyzer.py",
 ]
 
+PRIMARY_AGENT_DOCS_ROOT = Path(__file__).resolve().parent / "ai-kb" / "agents"
+PRIMARY_AGENT_NAMES = ["build", "plan", "explore", "summary", "compaction", "title"]
+
+BUNDLE_STATE_DIR = ".ai-bundle"
+LEDGER_FILE_NAME = "ledger.json"
+LEDGER_VERSION = 1
+FINGERPRINT_FILE_NAME = "fingerprint.json"
+FINGERPRINT_VERSION = 1
+METRICS_VERSION = 1
+PLAN_VERSION = 1
+# Flags a saved plan was computed with; --apply-plan restores them.
+PLAN_OPTIONS = [
+    "include_machine_config",
+    "preserve_existing",
+    "project_full",
+    "link_mode",
+    "backups",
+]
+QUIET, NORMAL, VERBOSE = 0, 1, 2
+PROGRESS_INTERVAL = 0.1
+EVENTS_BUFFER_SIZE = 1024 * 1024
+COPY_BATCH_PER_JOB = 64
+COMPARE_CHUNK_SIZE = 1024 * 1024
+WATCH_POLL_INTERVAL = 0.5
+WATCH_DEBOUNCE = 0.2
+# IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# Directory names --discover never descends into (hidden directories are skipped too).
+DISCOVER_SKIP_DIRS = {
+    "node_modules",
+    "__pycache__",
+    "venv",
+    "build",
+    "dist",
+    "target",
+    "vendor",
+}
+LINK_MODES = ["copy", "reflink", "hardlink", "auto"]
+STORE_CURRENT_LINK = "current"
+GENERATIONS_FILE_NAME = "generations.json"
+GENERATIONS_VERSION = 1
+STAGE_DIR_PREFIX = "stage-"
+# Shared directories whose children, not the directories themselves, are staged units.
+STAGED_UNIT_PARENTS = (".cursor", ".config", ".config/opencode")
+BACKUPS_DIR_NAME = "backups"
+BACKUP_SUFFIX_PATTERN = re.compile(r"^(?P<stamp>\d{8}-\d{6})(?:\.(?P<idx>\d+))?$")
+BACKUP_MODES = ["sibling", "store"]
+# Tokens every rewrite rule is built from; the manifest records which ones each payload
+# file contains so files without any can skip rewriting.
+MANIFEST_PLACEHOLDERS = ["__HOME__", "~/ai-kb", "~/.config/opencode", "~/.cursor"]
+GLOBAL_KB_MIRROR = ".config/opencode/ai-kb"
+PROJECT_TEMPLATE_ENTRY = ".config/opencode/memory/templates/project/.opencode"
+
+
+@dataclass
+class InstallLedger:
+    """Digests and stat results of every file the installer wrote under `root`.
+
+    Entries are keyed by destination path relative to `root` (POSIX separators). When a
+    destination still has the recorded size and mtime, its recorded digest stands in for
+    its content, so reinstalls can decide "unchanged?" without reading the destination.
+    """
+
+    root: Path
+    entries: dict[str, dict[str, object]] = field(default_factory=dict)
+
+
+class PackedPayload:
+    """Read-only member access to a zip or uncompressed tar bundle through one mmap.
+
+    Only the archive's directory (zip central directory or tar headers) is read up
+    front; member bytes are sliced out of the mapping when a file is first rendered.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with path.open("rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        # member name -> (data offset, stored size, size, zip method, mode, mtime)
+        self.files: dict[str, tuple[int, int, int, int, int, float]] = {}
+        self.dirs: set[str] = {""}
+
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.compress_type not in {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED}:
+                        raise ValueError(
+                            f"{path}: unsupported compression for {info.filename}"
+                        )
+                    self._add_file(
+                        info.filename,
+                        self._zip_data_offset(info.header_offset),
+                        info.compress_size,
+                        info.file_size,
+                        info.compress_type,
+                        info.external_attr >> 16,
+                        time.mktime(info.date_time + (0, 0, -1)),
+                    )
+            return
+
+        try:
+            with tarfile.open(path, mode="r:") as archive:
+                for member in archive:
+                    if member.isfile():
+                        self._add_file(
+                            member.name,
+                            member.offset_data,
+                            member.size,
+                            member.size,
+                            zipfile.ZIP_STORED,
+                            member.mode,
+                            member.mtime,
+                        )
+        except tarfile.TarError as exc:
+            raise ValueError(
+                f"{path} is not a zip or uncompressed tar archive: {exc}"
+            ) from exc
+
+    def _zip_data_offset(self, header_offset: int) -> int:
+        # Local file header: 30 fixed bytes, then the name and extra field.
+        name_length, extra_length = struct.unpack_from(
+            "<HH", self._map, header_offset + 26
+        )
+        return header_offset + 30 + name_length + extra_length
+
+    def _add_file(self, name: str, *entry) -> None:
+        name = posixpath.normpath(name).lstrip("/")
+        self.files[name] = entry
+        parent = posixpath.dirname(name)
+        while parent not in self.dirs:
+            self.dirs.add(parent)
+            parent = posixpath.dirname(parent)
+
+    def read(self, name: str) -> bytes:
+        entry = self.files.get(name)
+        if entry is None:
+            raise FileNotFoundError(f"{self.path}/{name}")
+        offset, stored_size, _, method, _, _ = entry
+        data = self._map[offset : offset + stored_size]
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        return data
+
+    def root(self) -> ArchivePath:
+        return ArchivePath(self, "")
+
+
+@dataclass(frozen=True)
+class ArchivePath:
+    """The subset of the `Path` API the installer uses on payload files, for packed bundles."""
+
+    archive: PackedPayload
+    member: str
+
+    def __truediv__(self, other: object) -> ArchivePath:
+        joined = posixpath.normpath(
+            posixpath.join(self.member, str(other).replace("\\", "/"))
+        )
+        return ArchivePath(self.archive, "" if joined == "." else joined)
+
+    def __str__(self) -> str:
+        return f"{self.archive.path}/{self.member}" if self.member else str(self.archive.path)
+
+    def __lt__(self, other: ArchivePath) -> bool:
+        return self.member.split("/") < other.member.split("/")
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.member).suffix
+
+    @property
+    def parent(self) -> ArchivePath:
+        return ArchivePath(self.archive, posixpath.dirname(self.member))
+
+    def exists(self) -> bool:
+        return self.member in self.archive.files or self.member in self.archive.dirs
+
+    def is_file(self) -> bool:
+        return self.member in self.archive.files
+
+    def is_dir(self) -> bool:
+        return self.member in self.archive.dirs
+
+    def is_symlink(self) -> bool:
+        return False
+
+    def read_bytes(self) -> bytes:
+        return self.archive.read(self.member)
+
+    def read_text(self, encoding: str = "utf-8") -> str:
+        return self.read_bytes().decode(encoding)
+
+    def relative_to(self, other: ArchivePath) -> PurePosixPath:
+        if other.member and not self.member.startswith(f"{other.member}/"):
+            raise ValueError(f"{self} is not under {other}")
+        return PurePosixPath(self.member[len(other.member) :].lstrip("/"))
+
+    def iter_files(self) -> list[ArchivePath]:
+        prefix = f"{self.member}/" if self.member else ""
+        names = [name for name in self.archive.files if name.startswith(prefix)]
+        return [
+            ArchivePath(self.archive, name)
+            for name in sorted(names, key=lambda name: name.split("/"))
+        ]
+
+    def copy_metadata_to(self, dst: Path, keep_times: bool) -> None:
+        _, _, _, _, mode, mtime = self.archive.files[self.member]
+        if mode:
+            os.chmod(dst, stat.S_IMODE(mode))
+        if keep_times:
+            os.utime(dst, (mtime, mtime))
+
+
+def open_payload(
+    bundle_dir: Path, payload_arg: str | None
+) -> tuple[Path | ArchivePath, Path | ArchivePath]:
+    """Return (payload root, manifest path) for a payload directory or packed bundle.
+
+    A packed bundle holds `payload/...` members and, optionally, its own `manifest.json`;
+    without one the installer's `manifest.json` is used.
+    """
+    manifest_path = bundle_dir / "manifest.json"
+    if payload_arg is None:
+        return bundle_dir / "payload", manifest_path
+    path = Path(payload_arg).expanduser().resolve()
+    if path.is_dir():
+        return path, manifest_path
+    packed = PackedPayload(path).root()
+    if (packed / "manifest.json").is_file():
+        manifest_path = packed / "manifest.json"
+    return packed / "payload", manifest_path
+
+
+@dataclass(frozen=True)
+class PayloadFileInfo:
+    size: int
+    sha256: str
+    text: bool
+    placeholders: frozenset[str]
+
+
+@dataclass
+class PayloadIndex:
+    """The manifest `files` table, keyed by absolute payload path.
+
+    An entry is only trusted while the payload file still has the recorded sha256; files
+    whose content changed or that are missing from the table are classified by sniffing.
+    `scripts/update_manifest.py --check` keeps the table in step with payload/.
+    """
+
+    tokens: list[str]
+    files: dict[Path, PayloadFileInfo] = field(default_factory=dict)
+
+
+@dataclass
+class BackupIndex:
+    """Sibling `<name>.bak.*` backups, found with one `os.scandir` per parent directory.
+
+    `names` holds every entry name seen in a scanned directory (so new backup names
+    can be chosen without probing) and `latest` the newest backup per target name.
+    """
+
+    names: dict[Path, set[str]] = field(default_factory=dict)
+    latest: dict[Path, dict[str, tuple[int, str, int, str, Path]]] = field(
+        default_factory=dict
+    )
+
+
+@dataclass
+class StatCache:
+    """lstat results for destination paths, filled by one `os.scandir` walk per root.
+
+    `entries` maps a path to its lstat result, or None when it is known not to exist.
+    Every existing child of a directory in `listed` is in `entries`, so a lookup under
+    a listed or missing directory needs no syscall. Writers call `forget_stat` for
+    each path they create, replace, or move.
+    """
+
+    entries: dict[Path, os.stat_result | None] = field(default_factory=dict)
+    listed: set[Path] = field(default_factory=set)
+
 
 @dataclass
 class InstallState:
@@ -30,6 +347,20 @@ class InstallState:
     overwritten_files: int = 0
     scanned_text_files: int = 0
     rewritten_text_files: int = 0
+    ledger: InstallLedger | None = None
+    payload_index: PayloadIndex | None = None
+    install_modes: dict[str, int] = field(default_factory=dict)
+    up_to_date: bool = False
+    backup_store: BackupStore | None = None
+    backup_index: BackupIndex = field(default_factory=BackupIndex)
+    stat_cache: StatCache | None = None
+    rendered: dict[Path, RenderedSource] | None = None
+    stamp: str | None = None
+    plan_actions: list[dict[str, object]] | None = None
+    # Payload files changed since the last install; None installs every file.
+    changed_sources: set[Path] | None = None
+    # Watch mode overwrites files that still match their ledger entry without a backup.
+    skip_managed_backups: bool = False
 
 
 @dataclass
@@ -39,19 +370,312 @@ class UninstallState:
     restored_backups: list[tuple[Path, Path]] = field(default_factory=list)
     missing_paths: list[Path] = field(default_factory=list)
     notes: list[str] = field(default_factory=list)
+    restored_from_store: list[StoredBackup] = field(default_factory=list)
+    backup_index: BackupIndex = field(default_factory=BackupIndex)
+    modified_paths: list[Path] = field(default_factory=list)
+
+
+@dataclass
+class InstallMetrics:
+    """Phase timings and I/O counters for one target, collected under `--profile`.
+
+    Phases are exclusive: entering a nested phase pauses the enclosing one, so the
+    phase times add up to the instrumented wall time. Counters may be bumped from
+    `--jobs` worker threads and are guarded by `lock`.
+    """
+
+    phases: dict[str, float] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+    syscalls: dict[str, int] = field(default_factory=dict)
+    stack: list[str] = field(default_factory=list)
+    mark: float = 0.0
+    audit_start: dict[str, int] = field(default_factory=dict)
+    replacement_cache_start: tuple[int, int] = (0, 0)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+# Metrics for the target being installed in this process; None unless profiling.
+_METRICS: InstallMetrics | None = None
+# Filesystem audit events seen by this process since profiling was enabled.
+_AUDIT_COUNTS: collections.Counter[str] | None = None
+_AUDIT_LOCK = threading.Lock()
+
+
+def count_audit_event(event: str, _args: tuple) -> None:
+    if _AUDIT_COUNTS is None:
+        return
+    if event == "open" or event.startswith(("os.", "shutil.")):
+        with _AUDIT_LOCK:
+            _AUDIT_COUNTS[event] += 1
+
+
+def enable_audit_counts() -> None:
+    """Count audited file operations (open, mkdir, rename, ...) for the rest of the process.
+
+    Audit hooks cannot be removed, so this is only called when profiling.
+    """
+    global _AUDIT_COUNTS
+    if _AUDIT_COUNTS is None:
+        _AUDIT_COUNTS = collections.Counter()
+        sys.addaudithook(count_audit_event)
+
+
+def start_metrics() -> InstallMetrics:
+    global _METRICS
+    enable_audit_counts()
+    assert _AUDIT_COUNTS is not None
+    with _AUDIT_LOCK:
+        audit_start = dict(_AUDIT_COUNTS)
+    cache = compile_replacements.cache_info()
+    _METRICS = InstallMetrics(
+        mark=time.perf_counter(),
+        audit_start=audit_start,
+        replacement_cache_start=(cache.hits, cache.misses),
+    )
+    _METRICS.stack.append("other")
+    return _METRICS
+
+
+def finish_metrics(metrics: InstallMetrics) -> InstallMetrics:
+    """Close the open phases, take the syscall and cache deltas, and stop collecting."""
+    global _METRICS
+    now = time.perf_counter()
+    while metrics.stack:
+        name = metrics.stack.pop()
+        metrics.phases[name] = metrics.phases.get(name, 0.0) + now - metrics.mark
+        metrics.mark = now
+    assert _AUDIT_COUNTS is not None
+    with _AUDIT_LOCK:
+        metrics.syscalls = {
+            event: count - metrics.audit_start.get(event, 0)
+            for event, count in sorted(_AUDIT_COUNTS.items())
+            if count > metrics.audit_start.get(event, 0)
+        }
+    cache = compile_replacements.cache_info()
+    hits, misses = metrics.replacement_cache_start
+    count_metric("replacement_cache_hits", cache.hits - hits)
+    count_metric("replacement_cache_misses", cache.misses - misses)
+    _METRICS = None
+    return metrics
+
+
+@contextlib.contextmanager
+def metrics_phase(name: str):
+    """Attribute the enclosed wall time to phase `name` when profiling."""
+    metrics = _METRICS
+    # Phases nest on one stack, so only the installing thread may open them.
+    if metrics is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    now = time.perf_counter()
+    outer = metrics.stack[-1]
+    metrics.phases[outer] = metrics.phases.get(outer, 0.0) + now - metrics.mark
+    metrics.stack.append(name)
+    metrics.mark = now
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        metrics.phases[name] = metrics.phases.get(name, 0.0) + now - metrics.mark
+        metrics.stack.pop()
+        metrics.mark = now
+
+
+def profiled_phase(name: str):
+    """Decorator form of `metrics_phase` for functions that are a phase of their own."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics_phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count_metric(name: str, amount: int = 1) -> None:
+    metrics = _METRICS
+    if metrics is None or not amount:
+        return
+    with metrics.lock:
+        metrics.counters[name] = metrics.counters.get(name, 0) + amount
+
+
+@dataclass
+class Progress:
+    """A single status line for interactive terminals, redrawn at most every
+    `PROGRESS_INTERVAL` seconds."""
+
+    label: str
+    total: int
+    stream: TextIO
+    done: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    drawn_at: float = 0.0
+    width: int = 0
+
+
+@dataclass
+class OutputLog:
+    """Where installer actions are reported.
+
+    Lines are printed by verbosity (`QUIET`, `NORMAL`, `VERBOSE`). With `events`, every
+    action is also written there as one JSON object per line. On an interactive terminal
+    at `NORMAL` verbosity, per-file lines are replaced by `progress`.
+    """
+
+    verbosity: int = NORMAL
+    events: TextIO | list[dict[str, object]] | None = None
+    target: str | None = None
+    interactive: bool = False
+    progress: Progress | None = None
+
+
+# Output settings for the run (or fleet target) in this process.
+_OUTPUT = OutputLog()
+
+
+def record_event(event: str, **fields: object) -> None:
+    log = _OUTPUT
+    if log.events is None:
+        return
+    record: dict[str, object] = {"time": round(time.time(), 6), "event": event}
+    if log.target is not None:
+        record["target"] = log.target
+    record.update(fields)
+    if isinstance(log.events, list):
+        log.events.append(json.loads(json.dumps(record, default=str)))
+    else:
+        log.events.write(json.dumps(record, default=str) + "\n")
+
+
+def emit(
+    event: str, message: str, *, file: bool = False, verbose: bool = False, **fields: object
+) -> None:
+    """Report one action: log it as an event, then print it or advance the progress line.
+
+    `file` marks per-file actions, which the progress line stands in for; `verbose`
+    actions are only printed with `-v`.
+    """
+    record_event(event, **fields)
+    log = _OUTPUT
+    if file and log.progress is not None:
+        advance_progress(log.progress)
+        return
+    if log.verbosity >= (VERBOSE if verbose else NORMAL):
+        clear_progress(log.progress)
+        print(message)
+
+
+def progress_wanted() -> bool:
+    return _OUTPUT.interactive and _OUTPUT.verbosity == NORMAL
+
+
+def start_progress(label: str, total: int) -> None:
+    if progress_wanted():
+        _OUTPUT.progress = Progress(label=label, total=total, stream=sys.stdout)
+
+
+def advance_progress(progress: Progress) -> None:
+    progress.done += 1
+    now = time.perf_counter()
+    if now - progress.drawn_at < PROGRESS_INTERVAL and progress.done < progress.total:
+        return
+    progress.drawn_at = now
+    elapsed = now - progress.started
+    rate = progress.done / elapsed if elapsed > 0 else 0.0
+    line = f"{progress.label}: {progress.done}/{progress.total} files  {rate:.0f} files/s"
+    if rate > 0 and progress.total > progress.done:
+        line += f"  ETA {(progress.total - progress.done) / rate:.0f}s"
+    progress.stream.write("\r" + line.ljust(progress.width))
+    progress.stream.flush()
+    progress.width = len(line)
+
+
+def clear_progress(progress: Progress | None) -> None:
+    if progress is None or not progress.width:
+        return
+    progress.stream.write("\r" + " " * progress.width + "\r")
+    progress.stream.flush()
+    progress.width = 0
+
+
+def finish_progress() -> None:
+    clear_progress(_OUTPUT.progress)
+    _OUTPUT.progress = None
+
+
+def flush_output() -> None:
+    """Push printed lines and buffered events out, for runs that outlive one install."""
+    sys.stdout.flush()
+    if _OUTPUT.events is not None and not isinstance(_OUTPUT.events, list):
+        _OUTPUT.events.flush()
+
+
+def configure_output(
+    args: argparse.Namespace,
+    events: TextIO | list[dict[str, object]] | None,
+    target: Path | None,
+    interactive: bool,
+) -> None:
+    global _OUTPUT
+    verbosity = QUIET if args.quiet else VERBOSE if args.verbose else NORMAL
+    _OUTPUT = OutputLog(
+        verbosity=verbosity,
+        events=events,
+        target=str(target) if target is not None else None,
+        interactive=interactive,
+    )
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Install AI transfer bundle")
     parser.add_argument(
         "--target-home",
+        action="append",
         default=None,
-        help="Install to a home directory (global mode). Default: current HOME.",
+        help=(
+            "Install to a home directory (global mode). Default: current HOME. "
+            "Repeat for a fleet install."
+        ),
     )
     parser.add_argument(
         "--project-dir",
+        action="append",
+        default=None,
+        help=(
+            "Install into a project directory (project mode). Repeat for a fleet "
+            "install."
+        ),
+    )
+    parser.add_argument(
+        "--projects-from",
+        default=None,
+        metavar="FILE",
+        help="Fleet mode: read project directories from FILE, one per line (# comments).",
+    )
+    parser.add_argument(
+        "--discover",
+        action="append",
+        default=None,
+        metavar="ROOT",
+        help="Fleet mode: install into every git repository found under ROOT.",
+    )
+    parser.add_argument(
+        "--discover-depth",
+        type=int,
+        default=4,
+        metavar="N",
+        help="How many directory levels below ROOT --discover searches. Default: 4.",
+    )
+    parser.add_argument(
+        "--fleet-jobs",
+        type=int,
         default=None,
-        help="Install into a project directory (project mode).",
+        metavar="N",
+        help="Fleet mode: install up to N targets at once. Default: CPU count.",
     )
     parser.add_argument(
         "--project-full",
@@ -84,6 +708,104 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Show planned actions without writing files.",
     )
+    parser.add_argument(
+        "--payload",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Install from this payload directory, or from a packed bundle (.zip or "
+            "uncompressed .tar, see scripts/pack_payload.py) read in place without "
+            "extracting. Default: payload/ next to this script."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Read, render, compare and write payload files (or, with --uninstall, "
+            "remove them) on N worker threads. Output, backups and counters stay "
+            "in payload order. Default: 1."
+        ),
+    )
+    parser.add_argument(
+        "--link-mode",
+        choices=LINK_MODES,
+        default="copy",
+        help=(
+            "How to install files that need no path rewriting: copy (default), reflink "
+            "(copy-on-write clone), hardlink (shares the payload file; edits to either "
+            "affect both), or auto (reflink, then in-kernel copy_file_range, then copy). "
+            "Unsupported modes fall back to copy."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=(
+            "Reinstall even when the recorded fingerprint shows nothing changed "
+            "since the last install."
+        ),
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help=(
+            "Render the install into a staging directory next to the target, sync "
+            "it, then swap each managed root (ai-kb, .opencode, .cursor/*) into "
+            "place by rename. An interrupted run leaves the live tree untouched, and "
+            "the next staged run moves back any root it had already set aside."
+        ),
+    )
+    parser.add_argument(
+        "--backups",
+        choices=BACKUP_MODES,
+        default="sibling",
+        help=(
+            "Where overwritten files go: sibling `name.bak.<stamp>` files (default), "
+            "or a compressed content-addressed store under .ai-bundle/backups/ that "
+            "keeps each distinct content once. Uninstall restores from both."
+        ),
+    )
+    parser.add_argument(
+        "--keep-backups",
+        type=int,
+        default=None,
+        metavar="N",
+        help="With --backups store: keep only the newest N install runs' backups.",
+    )
+    parser.add_argument(
+        "--backup-max-bytes",
+        type=int,
+        default=None,
+        metavar="BYTES",
+        help=(
+            "With --backups store: drop the oldest runs' backups until the store "
+            "holds at most BYTES of compressed objects. The newest run is always kept."
+        ),
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help=(
+            "Project mode only: render shared payload directories once into a "
+            "content-addressed store and symlink the project to them."
+        ),
+    )
+    parser.add_argument(
+        "--store-dir",
+        default=None,
+        help="Store location for --store. Default: ~/.cache/ai-config-bundle/store.",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help=(
+            "Project mode only: switch a --store install back to its previous "
+            "store generation."
+        ),
+    )
     parser.add_argument(
         "--uninstall",
         action="store_true",
@@ -100,22 +822,95 @@ def parse_args() -> argparse.Namespace:
             "available, otherwise remove roots recursively). Requires --uninstall."
         ),
     )
-    return parser.parse_args()
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Print only warnings, errors, and the final summary.",
+    )
+    verbosity.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help=(
+            "Also print unchanged files, and print every file on interactive "
+            "terminals instead of a progress line."
+        ),
+    )
+    parser.add_argument(
+        "--events-jsonl",
+        metavar="PATH",
+        default=None,
+        help=(
+            "Write one JSON object per installer action (and a final summary event) "
+            "to PATH, independent of -q/-v."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Print per-phase timings, bytes read and written, audited file "
+            "operations, and cache hit counts after the summary."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-json",
+        metavar="PATH",
+        default=None,
+        help=(
+            "Write the profile as JSON to PATH, one entry per target plus totals. "
+            "Collects metrics even without --profile."
+        ),
+    )
+    parser.add_argument(
+        "--profile-dump",
+        metavar="PATH",
+        default=None,
+        help=(
+            "Write a cProfile dump of the install to PATH (read it with "
+            "python3 -m pstats). Single target only."
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Install once, then keep running and copy payload files into the target "
+            "as they change (inotify on Linux, mtime polling elsewhere). Single target only."
+        ),
+    )
+    parser.add_argument(
+        "--plan-out",
+        metavar="PATH",
+        default=None,
+        help=(
+            "Dry-run the install and save every file action (rendered digest, backup "
+            "path, destination fingerprint) to PATH as JSON. Single target only."
+        ),
+    )
+    parser.add_argument(
+        "--apply-plan",
+        metavar="PATH",
+        default=None,
+        help=(
+            "Install a plan saved with --plan-out, after checking that the payload "
+            "and the destination still match it. Uses the plan's target and options."
+        ),
+    )
+    return parser.parse_args(argv)
 
 
-def is_text_file(path: Path, exts: set[str], basenames: set[str]) -> bool:
-    if path.suffix.lower() in exts:
-        return True
-    if path.name in basenames:
-        return True
-    if path.name.endswith(".mdc"):
-        return True
+def has_text_name(path: Path, exts: set[str], basenames: set[str]) -> bool:
+    return (
+        path.suffix.lower() in exts
+        or path.name in basenames
+        or path.name.endswith(".mdc")
+    )
 
-    try:
-        data = path.read_bytes()
-    except Exception:
-        return False
 
+def is_text_data(data: bytes) -> bool:
     if b"\x00" in data:
         return False
 
@@ -126,11 +921,85 @@ def is_text_file(path: Path, exts: set[str], basenames: set[str]) -> bool:
     return True
 
 
-def install_missing_deps(missing: list[str]) -> None:
-    if not missing:
-        return
+def is_text_file(path: Path, exts: set[str], basenames: set[str]) -> bool:
+    if has_text_name(path, exts, basenames):
+        return True
 
-    print("Missing tools:", ", ".join(missing))
+    try:
+        data = path.read_bytes()
+    except Exception:
+        return False
+    return is_text_data(data)
+
+
+def placeholder_tokens(source_home: str) -> list[str]:
+    tokens = list(MANIFEST_PLACEHOLDERS)
+    if source_home not in tokens:
+        tokens.append(source_home)
+    return tokens
+
+
+def describe_payload_file(
+    path: Path,
+    data: bytes,
+    exts: set[str],
+    basenames: set[str],
+    tokens: list[str],
+) -> dict[str, object]:
+    """Build the manifest `files` entry for one payload file (scripts/update_manifest.py)."""
+    text = has_text_name(path, exts, basenames) or is_text_data(data)
+    decoded = ""
+    if text:
+        try:
+            decoded = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = False
+    return {
+        "size": len(data),
+        "sha256": bytes_digest(data),
+        "text": text,
+        "placeholders": [token for token in tokens if token in decoded],
+    }
+
+
+def load_payload_index(manifest: dict, payload: Path) -> PayloadIndex | None:
+    files = manifest.get("files")
+    tokens = manifest.get("placeholder_tokens")
+    if not isinstance(files, list) or not isinstance(tokens, list):
+        return None
+    index = PayloadIndex(tokens=[token for token in tokens if isinstance(token, str)])
+    for item in files:
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+            continue
+        try:
+            index.files[payload / item["path"]] = PayloadFileInfo(
+                size=int(item["size"]),
+                sha256=str(item["sha256"]),
+                text=bool(item["text"]),
+                placeholders=frozenset(item.get("placeholders", [])),
+            )
+        except (KeyError, TypeError, ValueError):
+            continue
+    return index
+
+
+def rules_may_match(
+    replacements: list[tuple[str, str]], tokens: list[str], present: frozenset[str]
+) -> bool:
+    """Return False only when every rule contains a token the file is known to lack."""
+    for old, _ in replacements:
+        needed = [token for token in tokens if token in old]
+        if not needed or all(token in present for token in needed):
+            return True
+    return False
+
+
+@profiled_phase("install-deps")
+def install_missing_deps(missing: list[str]) -> None:
+    if not missing:
+        return
+
+    print("Missing tools:", ", ".join(missing))
 
     # ck-search is installed via cargo (no official brew/apt package documented yet).
     if "ck" in missing:
@@ -179,20 +1048,61 @@ def install_missing_deps(missing: list[str]) -> None:
     print("No supported package manager found. Install missing tools manually.")
 
 
-def unique_backup_path(path: Path, stamp: str) -> Path:
-    candidate = path.with_name(f"{path.name}.bak.{stamp}")
-    index = 1
-    while candidate.exists() or candidate.is_symlink():
-        candidate = path.with_name(f"{path.name}.bak.{stamp}.{index}")
-        index += 1
-    return candidate
+def backup_rank(name: str, suffix: str, path: Path) -> tuple[int, str, int, str, Path]:
+    match = BACKUP_SUFFIX_PATTERN.match(suffix)
+    if match:
+        return (1, match.group("stamp"), int(match.group("idx") or 0), name, path)
+    return (0, "", 0, name, path)
 
 
+def note_backup_name(index: BackupIndex, parent: Path, name: str) -> None:
+    """Record name as a directory entry and, if it is a backup, as a candidate."""
+    index.names[parent].add(name)
+    latest = index.latest[parent]
+    start = name.find(".bak.")
+    while start > 0:
+        target_name = name[:start]
+        rank = backup_rank(name, name[start + len(".bak."):], parent / name)
+        if target_name not in latest or rank > latest[target_name]:
+            latest[target_name] = rank
+        start = name.find(".bak.", start + 1)
+
+
+def scan_backup_parent(index: BackupIndex, parent: Path) -> None:
+    if parent in index.names:
+        return
+    index.names[parent] = set()
+    index.latest[parent] = {}
+    try:
+        with os.scandir(parent) as entries:
+            for entry in entries:
+                note_backup_name(index, parent, entry.name)
+    except OSError:
+        pass
+
+
+def unique_backup_path(path: Path, stamp: str, index: BackupIndex) -> Path:
+    scan_backup_parent(index, path.parent)
+    names = index.names[path.parent]
+    candidate = f"{path.name}.bak.{stamp}"
+    suffix = 1
+    while candidate in names:
+        candidate = f"{path.name}.bak.{stamp}.{suffix}"
+        suffix += 1
+    note_backup_name(index, path.parent, candidate)
+    return path.with_name(candidate)
+
+
+@profiled_phase("backup")
 def backup_existing_path(
     existing: Path, state: InstallState, stamp: str, dry_run: bool
 ) -> Path:
-    backup = unique_backup_path(existing, stamp)
-    print(f"Backup: {existing} -> {backup}")
+    if not dry_run:
+        forget_stat(state.stat_cache, existing)
+    if state.backup_store is not None:
+        return store_backup(existing, state, dry_run)
+    backup = unique_backup_path(existing, stamp, state.backup_index)
+    emit("backup", f"Backup: {existing} -> {backup}", path=existing, backup=backup)
     state.backups.append((existing, backup))
     if dry_run:
         return backup
@@ -201,1782 +1111,5470 @@ def backup_existing_path(
     return backup
 
 
+@dataclass
+class BackupStore:
+    """Per-target backup store: gzip objects named by content digest, one index per run.
+
+    `.ai-bundle/backups/objects/<aa>/<sha256>.gz` holds each distinct content once, and
+    `.ai-bundle/backups/runs/<run>.jsonl` gets one line per backed-up path as it is
+    moved aside, so an interrupted run still records what it removed. Paths are
+    recorded relative to `target_root`.
+    """
+
+    root: Path
+    target_root: Path
+    run_id: str
+
+
+def backup_store_dir(destination_root: Path) -> Path:
+    return destination_root / BUNDLE_STATE_DIR / BACKUPS_DIR_NAME
+
+
+def open_backup_store(destination_root: Path, stamp: str) -> BackupStore:
+    return BackupStore(
+        root=backup_store_dir(destination_root),
+        target_root=destination_root,
+        run_id=f"{stamp}-{os.getpid()}",
+    )
+
+
+def backup_object_path(store_root: Path, digest: str) -> Path:
+    return store_root / "objects" / digest[:2] / f"{digest}.gz"
+
+
+def store_backup_object(store_root: Path, data: bytes) -> str:
+    digest = bytes_digest(data)
+    path = backup_object_path(store_root, digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+        compressed = gzip.compress(data, mtime=0)
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, path)
+        count_metric("backup_bytes_stored", len(compressed))
+    return digest
+
+
+def describe_backup_entry(store_root: Path, path: Path, rel: str) -> dict[str, object]:
+    info = path.lstat()
+    record: dict[str, object] = {"path": rel, "mode": stat.S_IMODE(info.st_mode)}
+    if stat.S_ISLNK(info.st_mode):
+        record.update(kind="symlink", target=os.readlink(path))
+    elif stat.S_ISDIR(info.st_mode):
+        record["kind"] = "dir"
+    else:
+        record.update(
+            kind="file",
+            sha256=store_backup_object(store_root, path.read_bytes()),
+            size=info.st_size,
+            mtime_ns=info.st_mtime_ns,
+        )
+    return record
+
+
+def describe_backup_path(store_root: Path, path: Path, rel: str) -> dict[str, object]:
+    """Record path for the store; a directory lists every descendant in sorted order."""
+    record = describe_backup_entry(store_root, path, rel)
+    if record["kind"] == "dir":
+        record["entries"] = [
+            describe_backup_entry(store_root, child, child.relative_to(path).as_posix())
+            for child in sorted(path.rglob("*"))
+        ]
+    return record
+
+
+def store_backup(existing: Path, state: InstallState, dry_run: bool) -> Path:
+    """Back up existing into the backup store and remove it; return the run index."""
+    store = state.backup_store
+    assert store is not None
+    index = store.root / "runs" / f"{store.run_id}.jsonl"
+    emit("backup", f"Backup: {existing} -> {index}", path=existing, backup=index)
+    state.backups.append((existing, index))
+    if dry_run:
+        return index
+
+    rel = existing.relative_to(store.target_root).as_posix()
+    record = describe_backup_path(store.root, existing, rel)
+    index.parent.mkdir(parents=True, exist_ok=True)
+    with index.open("a", encoding="utf-8") as handle:
+        handle.write(json.dumps(record, sort_keys=True) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+    if existing.is_dir() and not existing.is_symlink():
+        shutil.rmtree(existing)
+    else:
+        existing.unlink()
+    return index
+
+
+@dataclass
+class StoredBackup:
+    run_id: str
+    stamp: str
+    record: dict[str, object]
+
+
+def load_backup_runs(destination_root: Path) -> dict[str, list[dict[str, object]]]:
+    runs: dict[str, list[dict[str, object]]] = {}
+    runs_dir = backup_store_dir(destination_root) / "runs"
+    if not runs_dir.is_dir():
+        return runs
+    for index in sorted(runs_dir.glob("*.jsonl")):
+        records: list[dict[str, object]] = []
+        for line in index.read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and isinstance(record.get("path"), str):
+                records.append(record)
+        runs[index.stem] = records
+    return runs
+
+
+def latest_stored_backups(destination_root: Path) -> dict[str, StoredBackup]:
+    """Map each backed-up relative path to its newest backup in the store."""
+    latest: dict[str, StoredBackup] = {}
+    for run_id, records in sorted(load_backup_runs(destination_root).items()):
+        stamp = run_id.rsplit("-", 1)[0]
+        for record in records:
+            latest[str(record["path"])] = StoredBackup(run_id, stamp, record)
+    return latest
+
+
+def restore_backup_entry(store_root: Path, target: Path, record: dict[str, object]) -> None:
+    kind = record.get("kind")
+    if kind == "symlink":
+        os.symlink(str(record["target"]), target)
+    elif kind == "dir":
+        target.mkdir(exist_ok=True)
+    else:
+        object_path = backup_object_path(store_root, str(record["sha256"]))
+        target.write_bytes(gzip.decompress(object_path.read_bytes()))
+        os.chmod(target, int(record["mode"]))
+        mtime_ns = int(record["mtime_ns"])
+        os.utime(target, ns=(mtime_ns, mtime_ns))
+
+
+def restore_backup_record(
+    store_root: Path, target: Path, record: dict[str, object]
+) -> None:
+    restore_backup_entry(store_root, target, record)
+    if record.get("kind") != "dir":
+        return
+    entries = record.get("entries", [])
+    # Sorted paths list every directory before its contents.
+    for entry in entries:
+        restore_backup_entry(store_root, target / str(entry["path"]), entry)
+    # Directory modes last, deepest first, so read-only directories can be filled.
+    for entry in reversed(entries):
+        if entry.get("kind") == "dir":
+            os.chmod(target / str(entry["path"]), int(entry["mode"]))
+    os.chmod(target, int(record["mode"]))
+
+
+def forget_stored_backups(destination_root: Path, restored: list[StoredBackup]) -> None:
+    """Drop restored records from their run indexes, then collect unused objects."""
+    if not restored:
+        return
+    runs_dir = backup_store_dir(destination_root) / "runs"
+    runs = load_backup_runs(destination_root)
+    for run_id in {backup.run_id for backup in restored}:
+        consumed = {
+            str(backup.record["path"]) for backup in restored if backup.run_id == run_id
+        }
+        remaining = [record for record in runs.get(run_id, []) if record["path"] not in consumed]
+        index = runs_dir / f"{run_id}.jsonl"
+        if remaining:
+            index.write_text(
+                "".join(json.dumps(record, sort_keys=True) + "\n" for record in remaining),
+                encoding="utf-8",
+            )
+        else:
+            index.unlink()
+    collect_backup_objects(destination_root)
+    store_root = backup_store_dir(destination_root)
+    leftovers = [*(store_root / "objects").glob("*"), store_root / "objects"]
+    for directory in [*leftovers, runs_dir, store_root, store_root.parent]:
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+
+def record_object_digests(record: dict[str, object]) -> set[str]:
+    if record.get("kind") == "file":
+        return {str(record["sha256"])}
+    digests: set[str] = set()
+    for entry in record.get("entries", []):
+        digests |= record_object_digests(entry)
+    return digests
+
+
+def collect_backup_objects(destination_root: Path) -> int:
+    """Remove objects no run index references; return the bytes freed."""
+    objects_dir = backup_store_dir(destination_root) / "objects"
+    if not objects_dir.is_dir():
+        return 0
+    referenced: set[str] = set()
+    for records in load_backup_runs(destination_root).values():
+        for record in records:
+            referenced |= record_object_digests(record)
+    freed = 0
+    for path in objects_dir.glob("*/*.gz"):
+        if path.name[: -len(".gz")] not in referenced:
+            freed += path.stat().st_size
+            path.unlink()
+    return freed
+
+
+@profiled_phase("prune-backups")
+def prune_backup_store(
+    destination_root: Path, keep_runs: int | None, max_bytes: int | None
+) -> list[str]:
+    """Apply `--keep-backups` and `--backup-max-bytes`; the newest run is always kept."""
+    runs = load_backup_runs(destination_root)
+    store_root = backup_store_dir(destination_root)
+    kept_bytes = 0
+    seen: set[str] = set()
+    dropped: list[str] = []
+    for position, run_id in enumerate(sorted(runs, reverse=True)):
+        digests: set[str] = set()
+        for record in runs[run_id]:
+            digests |= record_object_digests(record)
+        new_bytes = 0
+        for digest in digests - seen:
+            try:
+                new_bytes += backup_object_path(store_root, digest).stat().st_size
+            except OSError:
+                pass
+        over_count = keep_runs is not None and position >= keep_runs
+        over_bytes = max_bytes is not None and kept_bytes + new_bytes > max_bytes
+        if position > 0 and (over_count or over_bytes or dropped):
+            dropped.append(run_id)
+            continue
+        seen |= digests
+        kept_bytes += new_bytes
+
+    for run_id in dropped:
+        (store_root / "runs" / f"{run_id}.jsonl").unlink()
+    freed = collect_backup_objects(destination_root)
+    if not dropped and not freed:
+        return []
+    return [
+        f"Backup retention: dropped {len(dropped)} runs, freed {freed} bytes; "
+        f"{len(runs) - len(dropped)} runs kept ({kept_bytes} bytes)."
+    ]
+
+
 def files_equal(src: Path, dst: Path) -> bool:
+    """Compare two files by size first, then chunk by chunk, stopping at the first difference.
+
+    Memory stays at two chunks regardless of file size, so large binary KB assets do not
+    have to be loaded whole just to learn that they match.
+    """
     try:
-        return src.read_bytes() == dst.read_bytes()
-    except Exception:
+        src_info = src.stat()
+        dst_info = dst.stat()
+    except OSError:
+        return False
+    if not stat.S_ISREG(src_info.st_mode) or not stat.S_ISREG(dst_info.st_mode):
         return False
+    if src_info.st_size != dst_info.st_size:
+        return False
+    if os.path.samestat(src_info, dst_info):
+        return True
 
+    chunk_size = max(1, min(COMPARE_CHUNK_SIZE, src_info.st_size))
+    try:
+        with src.open("rb") as src_handle, dst.open("rb") as dst_handle:
+            while True:
+                src_chunk = src_handle.read(chunk_size)
+                if src_chunk != dst_handle.read(chunk_size):
+                    return False
+                if not src_chunk:
+                    return True
+    except OSError:
+        return False
 
-def render_text_with_replacements(
-    src: Path,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-    state: InstallState,
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        while chunk := handle.read(COMPARE_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return bytes_digest(text.encode("utf-8"))
+
+
+def ledger_path(destination_root: Path) -> Path:
+    return destination_root / BUNDLE_STATE_DIR / LEDGER_FILE_NAME
+
+
+def load_install_ledger(destination_root: Path) -> InstallLedger:
+    ledger = InstallLedger(root=destination_root)
+    path = ledger_path(destination_root)
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return ledger
+
+    if not isinstance(raw, dict) or raw.get("version") != LEDGER_VERSION:
+        return ledger
+    files = raw.get("files")
+    if not isinstance(files, dict):
+        return ledger
+    for key, entry in files.items():
+        if isinstance(key, str) and isinstance(entry, dict):
+            ledger.entries[key] = entry
+    return ledger
+
+
+def ledger_key(ledger: InstallLedger, path: Path) -> str | None:
+    try:
+        return path.relative_to(ledger.root).as_posix()
+    except ValueError:
+        return None
+
+
+def ledger_recorded_digest(
+    ledger: InstallLedger | None,
+    path: Path,
+    info: os.stat_result | None = None,
 ) -> str | None:
-    """Render src as text with replacements applied, or return None for binary files.
+    """Return the recorded digest for path when its stat still matches the ledger.
 
-    We apply replacements at copy-time so repeated installs are idempotent: the destination
-    file bytes match what we'd render from the payload, avoiding endless `.bak.*` churn.
+    `info` is path's lstat result when the caller already has it.
     """
-    if not replacements:
+    if ledger is None:
+        return None
+    key = ledger_key(ledger, path)
+    entry = ledger.entries.get(key) if key is not None else None
+    if entry is None:
         return None
-    if not is_text_file(src, exts, basenames):
+    if info is None:
+        try:
+            info = path.lstat()
+        except OSError:
+            return None
+    if not stat.S_ISREG(info.st_mode):
+        return None
+    if info.st_size != entry.get("size") or info.st_mtime_ns != entry.get("mtime_ns"):
         return None
+    digest = entry.get("sha256")
+    return digest if isinstance(digest, str) else None
 
-    state.scanned_text_files += 1
+
+def ledger_entry_for(path: Path, digest: str) -> dict[str, object] | None:
     try:
-        original = src.read_text(encoding="utf-8")
-    except Exception:
+        info = path.lstat()
+    except OSError:
         return None
+    return {"sha256": digest, "size": info.st_size, "mtime_ns": info.st_mtime_ns}
 
-    updated = apply_replacements(original, replacements)
-    if updated != original:
-        state.rewritten_text_files += 1
-    return updated
 
-
-def copy_file(
-    src: Path,
-    dst: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
+def store_ledger_entry(
+    ledger: InstallLedger | None, path: Path, entry: dict[str, object] | None
 ) -> None:
-    if dst.exists() and dst.is_dir():
-        state.notes.append(f"Skip file copy; destination is a directory: {dst}")
+    if ledger is None:
         return
-
-    rendered_text = render_text_with_replacements(
-        src=src,
-        replacements=replacements,
-        exts=exts,
-        basenames=basenames,
-        state=state,
-    )
-
-    if dst.exists() or dst.is_symlink():
-        if dst.exists():
-            if rendered_text is not None:
-                try:
-                    if dst.read_text(encoding="utf-8") == rendered_text:
-                        return
-                except Exception:
-                    pass
-            else:
-                if files_equal(src, dst):
-                    return
-        if args.preserve_existing:
-            print(f"Preserve existing: {dst}")
-            state.skipped_existing.append(dst)
-            return
-        backup_existing_path(dst, state, stamp, args.dry_run)
-        state.overwritten_files += 1
-    else:
-        state.created_files += 1
-        state.created_paths.add(dst)
-
-    print(f"Install file: {src} -> {dst}")
-    state.planned_files.append((src, dst))
-    if args.dry_run:
+    key = ledger_key(ledger, path)
+    if key is None:
         return
-
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    if rendered_text is not None:
-        dst.write_text(rendered_text, encoding="utf-8")
-        # Keep permission bits consistent with the payload file.
-        try:
-            shutil.copymode(src, dst)
-        except Exception:
-            pass
+    if entry is None:
+        ledger.entries.pop(key, None)
         return
+    ledger.entries[key] = entry
 
-    shutil.copy2(src, dst)
 
+def record_ledger_file(ledger: InstallLedger | None, path: Path, digest: str) -> None:
+    if ledger is None:
+        return
+    store_ledger_entry(ledger, path, ledger_entry_for(path, digest))
 
-def copy_tree(
-    src_dir: Path,
-    dst_dir: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-) -> None:
-    if dst_dir.exists() and not dst_dir.is_dir():
-        if args.preserve_existing:
-            print(f"Preserve existing non-directory: {dst_dir}")
-            state.skipped_existing.append(dst_dir)
-            return
-        backup_existing_path(dst_dir, state, stamp, args.dry_run)
 
-    if not args.dry_run:
-        dst_dir.mkdir(parents=True, exist_ok=True)
+def record_written_text(state: InstallState, path: Path, text: str) -> None:
+    forget_stat(state.stat_cache, path)
+    record_ledger_file(state.ledger, path, text_digest(text))
+
 
-    for src_file in sorted(src_dir.rglob("*")):
-        if not src_file.is_file():
+def scan_stat_tree(cache: StatCache, root: Path) -> None:
+    """lstat root and, when it is a real directory, everything below it."""
+    try:
+        info = os.lstat(root)
+    except OSError:
+        cache.entries[root] = None
+        return
+    cache.entries[root] = info
+    pending = [root] if stat.S_ISDIR(info.st_mode) else []
+    while pending:
+        directory = pending.pop()
+        if directory in cache.listed:
             continue
-        if src_file.name in {".DS_Store"}:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = directory / entry.name
+                    child = entry.stat(follow_symlinks=False)
+                    cache.entries[path] = child
+                    if stat.S_ISDIR(child.st_mode):
+                        pending.append(path)
+        except OSError:
             continue
-        rel = src_file.relative_to(src_dir)
-        copy_file(
-            src_file,
-            dst_dir / rel,
-            args,
-            state,
-            stamp,
-            replacements,
-            exts,
-            basenames,
-        )
+        cache.listed.add(directory)
 
 
-def scaffold_file_if_missing(
-    src: Path,
-    dst: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-) -> None:
-    if dst.exists() or dst.is_symlink():
-        return
+@profiled_phase("scan")
+def scan_destination(destination_root: Path, relative_roots: list[str]) -> StatCache:
+    cache = StatCache()
+    for rel in relative_roots:
+        scan_stat_tree(cache, destination_root / rel)
+    count_metric("stat_cache_scanned", len(cache.entries))
+    return cache
 
-    rendered_text = render_text_with_replacements(
-        src=src,
-        replacements=replacements,
-        exts=exts,
-        basenames=basenames,
-        state=state,
-    )
 
-    print(f"Scaffold file: {src} -> {dst}")
-    state.planned_files.append((src, dst))
-    state.created_files += 1
-    state.created_paths.add(dst)
-    if args.dry_run:
-        return
+def stat_scan_roots(plan: list[tuple[str, str]], project_mode: bool) -> list[str]:
+    """Destination roots an install reads: plan targets plus the OpenCode compat dirs."""
+    opencode_rel = ".opencode" if project_mode else ".config/opencode"
+    compat = [f"{opencode_rel}/{name}" for name in ("agent", "command", "plugin")]
+    return [dst_rel for _, dst_rel in plan] + compat
 
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    if rendered_text is not None:
-        dst.write_text(rendered_text, encoding="utf-8")
+
+def cached_lstat(cache: StatCache | None, path: Path) -> os.stat_result | None:
+    if cache is None:
         try:
-            shutil.copymode(src, dst)
-        except Exception:
-            pass
+            return os.lstat(path)
+        except OSError:
+            return None
+    if path in cache.entries:
+        count_metric("stat_cache_hits")
+        return cache.entries[path]
+    parent = path.parent
+    if parent in cache.listed or (
+        parent in cache.entries and cache.entries[parent] is None
+    ):
+        count_metric("stat_cache_hits")
+        cache.entries[path] = None
+        return None
+    count_metric("stat_cache_misses")
+    try:
+        info: os.stat_result | None = os.lstat(path)
+    except OSError:
+        info = None
+    cache.entries[path] = info
+    return info
+
+
+def cached_stat(cache: StatCache | None, path: Path) -> os.stat_result | None:
+    """Like `cached_lstat`, but follows a final symlink (uncached) the way stat does."""
+    info = cached_lstat(cache, path)
+    if info is None or not stat.S_ISLNK(info.st_mode):
+        return info
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def forget_stat(cache: StatCache | None, path: Path) -> None:
+    """Drop cached knowledge invalidated by creating, replacing, or moving path."""
+    if cache is None:
         return
+    if path in cache.listed:
+        for key in [key for key in cache.entries if key.is_relative_to(path)]:
+            del cache.entries[key]
+        cache.listed = {key for key in cache.listed if not key.is_relative_to(path)}
+    cache.entries.pop(path, None)
+    cache.listed.discard(path.parent)
+    # Ancestors cached as missing exist now if path was created inside them.
+    parent = path.parent
+    while parent in cache.entries and cache.entries[parent] is None:
+        del cache.entries[parent]
+        cache.listed.discard(parent.parent)
+        parent = parent.parent
+
+
+@profiled_phase("ledger")
+def write_install_ledger(ledger: InstallLedger | None, dry_run: bool) -> None:
+    if ledger is None or dry_run:
+        return
+    path = ledger_path(ledger.root)
+    payload = {
+        "version": LEDGER_VERSION,
+        "files": {key: ledger.entries[key] for key in sorted(ledger.entries)},
+    }
+    write_json_atomic(path, payload)
 
-    shutil.copy2(src, dst)
 
+def write_json_atomic(path: Path, payload: object) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+    os.replace(tmp_path, path)
 
-def ensure_project_checkpoint_ignore(
-    project_root: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-) -> None:
-    ignore_line = ".opencode/checkpoints/"
-    gitignore_path = project_root / ".gitignore"
-    existing = ""
-    if gitignore_path.exists():
-        try:
-            existing = gitignore_path.read_text(encoding="utf-8")
-        except Exception as exc:
-            state.notes.append(
-                f"Could not read .gitignore for checkpoint ignore merge: {exc}"
-            )
-            return
 
-    if ignore_line in existing:
-        return
+def fingerprint_path(destination_root: Path) -> Path:
+    return destination_root / BUNDLE_STATE_DIR / FINGERPRINT_FILE_NAME
 
-    if gitignore_path.exists() and args.preserve_existing:
-        state.notes.append(
-            "Skipped .gitignore checkpoint ignore merge because preserve-existing is set."
-        )
-        return
 
-    next_text = existing
-    if next_text and not next_text.endswith("\n"):
-        next_text += "\n"
-    next_text += f"{ignore_line}\n"
+def stat_token(path: Path) -> str:
+    try:
+        info = path.lstat()
+    except OSError:
+        return "missing"
+    if stat.S_ISLNK(info.st_mode):
+        try:
+            return f"link:{os.readlink(path)}"
+        except OSError:
+            return "link"
+    kind = "dir" if stat.S_ISDIR(info.st_mode) else "file"
+    return f"{kind}:{info.st_size}:{info.st_mtime_ns}"
+
+
+def payload_stat_digest(payload: Path) -> str:
+    """Digest the payload's file names, sizes and mtimes without opening any file."""
+    hasher = hashlib.sha256()
+    if isinstance(payload, ArchivePath):
+        hasher.update(stat_token(payload.archive.path).encode("utf-8"))
+        return hasher.hexdigest()
+
+    files, _ = scan_payload_stats(str(payload))
+    for rel in sorted(files):
+        size, mtime_ns = files[rel]
+        hasher.update(f"{rel}\0{size}\0{mtime_ns}".encode("utf-8") + b"\n")
+    return hasher.hexdigest()
+
+
+def scan_payload_stats(root: str) -> tuple[dict[str, tuple[int, int]], list[str]]:
+    """Return each payload file's (size, mtime_ns) by relative path, and every directory."""
+    files: dict[str, tuple[int, int]] = {}
+    dirs = [root]
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    dirs.append(entry.path)
+                    continue
+                info = entry.stat(follow_symlinks=False)
+                files[entry.path[len(root) + 1 :]] = (info.st_size, info.st_mtime_ns)
+    return files, dirs
 
-    print(f"Ensure checkpoint ignore: {gitignore_path}")
-    state.planned_files.append((project_root / ".opencode", gitignore_path))
-    if args.dry_run:
-        return
 
-    if existing:
-        backup_existing_path(
-            gitignore_path,
-            state,
-            datetime.now().strftime("%Y%m%d-%H%M%S"),
-            args.dry_run,
-        )
-    gitignore_path.write_text(next_text, encoding="utf-8")
-    if gitignore_path.exists():
-        state.overwritten_files += 1 if existing else 0
-        if not existing:
-            state.created_files += 1
-            state.created_paths.add(gitignore_path)
-
-
-def scaffold_project_runtime_state(
+@profiled_phase("fingerprint")
+def install_inputs_digest(
     payload: Path,
-    project_root: Path,
-    args: argparse.Namespace,
-    state: InstallState,
+    manifest_text: str,
+    plan: list[tuple[str, str]],
     replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-) -> None:
-    template_root = payload / ".config/opencode/memory/templates/project/.opencode"
-    scaffold_paths = [
-        "README.md",
-        "checkpoints/latest.json",
-        "memory/current.md",
-        "memory/decisions.md",
-        "memory/handoff.md",
-        "overlays.jsonc",
-    ]
+    args: argparse.Namespace,
+) -> str:
+    """Digest everything besides the destination that decides what an install writes."""
+    inputs = install_settings(plan, replacements, args)
+    inputs["manifest"] = text_digest(manifest_text)
+    inputs["payload"] = payload_stat_digest(payload)
+    return text_digest(json.dumps(inputs, sort_keys=True))
 
-    for relative_path in scaffold_paths:
-        scaffold_file_if_missing(
-            template_root / relative_path,
-            project_root / ".opencode" / relative_path,
-            args,
-            state,
-            replacements,
-            exts,
-            basenames,
-        )
 
-    ensure_project_checkpoint_ignore(project_root, args, state)
+def install_settings(
+    plan: list[tuple[str, str]],
+    replacements: list[tuple[str, str]],
+    args: argparse.Namespace,
+) -> dict[str, object]:
+    return {
+        "installer": stat_token(Path(__file__).resolve()),
+        # Primary lane prompts are merged into opencode.json from the bundle's own KB.
+        "agent_specs": list(primary_agent_doc_tokens()),
+        "plan": plan,
+        "rules": replacements,
+        "flags": {
+            "include_machine_config": args.include_machine_config,
+            "preserve_existing": args.preserve_existing,
+            "link_mode": args.link_mode,
+            "store": args.store,
+            "store_dir": args.store_dir,
+        },
+    }
 
 
-def copy_entry(
-    src: Path,
-    dst: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
+def install_base_digest(
+    manifest_text: str,
+    plan: list[tuple[str, str]],
     replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-) -> None:
-    if not src.exists():
-        print(f"Missing source: {src}")
-        state.missing_sources.append(src)
-        return
-    if src.is_dir():
-        print(f"Install dir: {src} -> {dst}")
-        copy_tree(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
-    copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+    args: argparse.Namespace,
+) -> str:
+    """Digest the inputs of `install_inputs_digest` that a payload commit does not cover.
 
+    The manifest's per-file table changes with the payload, so only its settings count.
+    """
+    inputs = install_settings(plan, replacements, args)
+    manifest = json.loads(manifest_text)
+    manifest.pop("files", None)
+    inputs["manifest"] = manifest
+    return text_digest(json.dumps(inputs, sort_keys=True))
+
+
+def destination_roots_digest(
+    destination_root: Path, plan: list[tuple[str, str]]
+) -> str:
+    # Top-level managed paths: catches deleted roots and moved store/KB links that
+    # the per-file ledger cannot see.
+    paths = [dst_rel for _, dst_rel in plan]
+    paths.append(f"{BUNDLE_STATE_DIR}/{STORE_CURRENT_LINK}")
+    records = [f"{rel}\0{stat_token(destination_root / rel)}" for rel in sorted(set(paths))]
+    return text_digest("\n".join(records))
+
+
+@profiled_phase("fingerprint")
+def install_up_to_date(
+    destination_root: Path,
+    inputs_digest: str,
+    plan: list[tuple[str, str]],
+    ledger: InstallLedger,
+) -> bool:
+    """Return True when the last recorded install used the same inputs and nothing moved."""
+    raw = load_install_fingerprint(destination_root)
+    if raw is None or raw.get("inputs") != inputs_digest:
+        return False
+    return install_intact(destination_root, raw, plan, ledger)
 
-def dedupe_replacements(replacements: list[tuple[str, str]]) -> list[tuple[str, str]]:
-    unique: list[tuple[str, str]] = []
-    seen = set()
-    for old, new in replacements:
-        if not old:
-            continue
-        key = (old, new)
-        if key in seen:
-            continue
-        seen.add(key)
-        unique.append(key)
-    unique.sort(key=lambda pair: len(pair[0]), reverse=True)
-    return unique
 
+def load_install_fingerprint(destination_root: Path) -> dict[str, object] | None:
+    try:
+        raw = json.loads(fingerprint_path(destination_root).read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if not isinstance(raw, dict) or raw.get("version") != FINGERPRINT_VERSION:
+        return None
+    return raw
 
-def apply_replacements(text: str, replacements: list[tuple[str, str]]) -> str:
-    updated = text
-    for old, new in replacements:
-        updated = updated.replace(old, new)
-    return updated
 
+def install_intact(
+    destination_root: Path,
+    fingerprint: dict[str, object],
+    plan: list[tuple[str, str]],
+    ledger: InstallLedger,
+) -> bool:
+    """Return True when nothing the recorded install wrote has changed since.
 
-def has_backup_for(path: Path, state: InstallState) -> bool:
-    return any(original == path for original, _ in state.backups)
+    Only stat calls are made: every ledger entry must still have its recorded size and
+    mtime, and the managed roots and the ledger file must match the recorded snapshot.
+    """
+    if fingerprint.get("ledger") != stat_token(ledger_path(destination_root)):
+        return False
+    if fingerprint.get("roots") != destination_roots_digest(destination_root, plan):
+        return False
+    return all(
+        ledger_recorded_digest(ledger, destination_root / key) is not None
+        for key in ledger.entries
+    )
 
 
-def write_json_file_with_backup(
-    path: Path,
-    data: dict,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
-    source_for_plan: Path | None = None,
+@profiled_phase("ledger")
+def write_install_fingerprint(
+    destination_root: Path,
+    inputs_digest: str,
+    plan: list[tuple[str, str]],
+    dry_run: bool,
+    base_digest: str | None = None,
+    commit: str | None = None,
 ) -> None:
-    is_existing = path.exists() or path.is_symlink()
-    was_created_this_run = path in state.created_paths
-    if is_existing and args.preserve_existing:
-        state.skipped_existing.append(path)
-        print(f"Preserve existing: {path}")
+    if dry_run:
         return
+    fingerprint = {
+        "version": FINGERPRINT_VERSION,
+        "inputs": inputs_digest,
+        "ledger": stat_token(ledger_path(destination_root)),
+        "roots": destination_roots_digest(destination_root, plan),
+    }
+    if commit is not None:
+        # The payload commit this install matches; the next run can diff from it.
+        fingerprint.update(base=base_digest, commit=commit)
+    write_json_atomic(fingerprint_path(destination_root), fingerprint)
 
-    if is_existing:
-        if not was_created_this_run:
-            state.overwritten_files += 1
-        if (
-            not args.dry_run
-            and not has_backup_for(path, state)
-            and not was_created_this_run
-        ):
-            backup_existing_path(path, state, stamp, args.dry_run)
-    else:
-        if not was_created_this_run:
-            state.created_files += 1
-            state.created_paths.add(path)
 
-    if source_for_plan is not None:
-        state.planned_files.append((source_for_plan, path))
+def run_git(cwd: Path, *git_args: str) -> str | None:
+    """Run git in cwd; return its stdout, or None when git or the repository is unusable."""
+    try:
+        result = subprocess.run(
+            ["git", *git_args], cwd=cwd, capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return None
+    return result.stdout if result.returncode == 0 else None
 
-    print(f"Write JSON: {path}")
-    if args.dry_run:
-        return
 
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+def payload_commit(payload: Path) -> str | None:
+    """Return the HEAD commit of a directory payload's git checkout, if the payload is clean.
 
+    Untracked and ignored files count as dirty, since a full pass would install them.
+    """
+    if isinstance(payload, ArchivePath) or not payload.is_dir():
+        return None
+    head = run_git(payload, "rev-parse", "--verify", "HEAD")
+    if head is None:
+        return None
+    status = run_git(
+        payload, "status", "--porcelain", "--untracked-files=all", "--ignored", "--", "."
+    )
+    if status is None or status.strip():
+        return None
+    return head.strip()
 
-def normalize_project_cursor_hook_command(command: str) -> str:
-    normalized = command.replace("./hooks/", ".cursor/hooks/")
-    if normalized.startswith("hooks/"):
-        normalized = f".cursor/{normalized}"
-    return normalized
 
+def payload_changes(payload: Path, old: str, new: str) -> list[str] | None:
+    """List payload-relative paths that differ between two commits; None without history."""
+    if old == new:
+        return []
+    output = run_git(
+        payload, "diff", "--name-only", "--no-renames", "--relative", "-z", old, new, "--", "."
+    )
+    if output is None:
+        return None
+    return [path for path in output.split("\0") if path]
 
-def normalize_project_cursor_hooks_config(raw: dict) -> dict:
-    hooks = raw.get("hooks")
-    if not isinstance(hooks, dict):
-        return raw
 
-    normalized_config = dict(raw)
-    normalized_hooks: dict[str, object] = {}
-    for event, entries in hooks.items():
-        if not isinstance(entries, list):
-            normalized_hooks[event] = entries
-            continue
+@profiled_phase("fingerprint")
+def incremental_sources(
+    payload: Path,
+    destination_root: Path,
+    base_digest: str,
+    commit: str | None,
+    plan: list[tuple[str, str]],
+    ledger: InstallLedger,
+) -> set[Path] | None:
+    """Return the payload files changed since the last install, or None for a full pass.
+
+    Needs a clean payload checkout, a fingerprint recording the commit the last install
+    came from and the same non-payload inputs, an untouched install, and git history
+    that still reaches that commit. Deleted paths are dropped: an install never removes
+    files that left the payload (`--uninstall` does).
+    """
+    if commit is None:
+        return None
+    raw = load_install_fingerprint(destination_root)
+    if raw is None or raw.get("base") != base_digest or not isinstance(raw.get("commit"), str):
+        return None
+    if not install_intact(destination_root, raw, plan, ledger):
+        return None
+    changed = payload_changes(payload, str(raw["commit"]), commit)
+    if changed is None:
+        return None
+    sources = {payload / rel for rel in changed}
+    return {src for src in sources if src.is_file() and src.name != ".DS_Store"}
 
-        updated_entries: list[object] = []
-        for entry in entries:
-            if not isinstance(entry, dict):
-                updated_entries.append(entry)
-                continue
-            rewritten = dict(entry)
-            command = rewritten.get("command")
-            if isinstance(command, str):
-                rewritten["command"] = normalize_project_cursor_hook_command(command)
-            updated_entries.append(rewritten)
-        normalized_hooks[event] = updated_entries
 
-    normalized_config["hooks"] = normalized_hooks
-    return normalized_config
+def can_skip_install(args: argparse.Namespace) -> bool:
+    return not (args.force or args.dry_run or args.install_deps)
 
 
-def merge_cursor_hooks_file(
+def print_up_to_date(mode: str, target: Path) -> None:
+    record_event("summary", mode=mode, up_to_date=True)
+    print("Done")
+    print("Mode:", mode)
+    print("Target:", target)
+    print("Up to date: yes (no changes since the last install; use --force to reinstall)")
+
+
+@dataclass
+class RenderedSource:
+    """Installable bytes for one payload file, produced from a single read of the source.
+
+    `rendered` marks text that went through path rewriting; such files only inherit the
+    payload's permission bits, while untouched files also keep its timestamps.
+    """
+
+    data: bytes
+    digest: str
+    rendered: bool = False
+    scanned_text: bool = False
+    rewritten_text: bool = False
+
+
+def render_source(
     src: Path,
-    dst: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
     replacements: list[tuple[str, str]],
     exts: set[str],
     basenames: set[str],
-) -> None:
+    index: PayloadIndex | None = None,
+) -> RenderedSource:
+    """Read src once and use that buffer for classification, rendering and digesting.
+
+    A manifest `index` entry whose sha256 matches the bytes read settles text-vs-binary
+    without sniffing and lets text files that contain none of the rules' placeholders
+    skip rewriting.
+
+    We apply replacements at copy-time so repeated installs are idempotent: the destination
+    file bytes match what we'd render from the payload, avoiding endless `.bak.*` churn.
+    """
+    data = src.read_bytes()
+    count_metric("payload_files_read")
+    count_metric("payload_bytes_read", len(data))
+    digest = bytes_digest(data)
+    if not replacements:
+        return RenderedSource(data=data, digest=digest)
+
+    info = index.files.get(src) if index is not None else None
+    if info is not None and info.size == len(data) and info.sha256 == digest:
+        if not info.text:
+            return RenderedSource(data=data, digest=digest)
+        if not rules_may_match(replacements, index.tokens, info.placeholders):
+            return RenderedSource(data=data, digest=digest, rendered=True, scanned_text=True)
+    elif not has_text_name(src, exts, basenames) and not is_text_data(data):
+        return RenderedSource(data=data, digest=digest)
+
     try:
-        src_data = json.loads(src.read_text(encoding="utf-8"))
-    except Exception:
-        state.notes.append(
-            f"Could not parse hooks JSON for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
+        original = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return RenderedSource(data=data, digest=digest, scanned_text=True)
 
-    if not isinstance(src_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
-    src_data = normalize_project_cursor_hooks_config(src_data)
+    started = time.perf_counter_ns() if _METRICS is not None else 0
+    updated = apply_replacements(original, replacements)
+    if started:
+        count_metric("rewrite_ns", time.perf_counter_ns() - started)
+    if updated == original:
+        return RenderedSource(data=data, digest=digest, rendered=True, scanned_text=True)
+    rendered = updated.encode("utf-8")
+    return RenderedSource(
+        data=rendered,
+        digest=bytes_digest(rendered),
+        rendered=True,
+        scanned_text=True,
+        rewritten_text=True,
+    )
 
-    if not dst.exists():
-        write_json_file_with_backup(
-            path=dst,
-            data=src_data,
-            args=args,
-            state=state,
-            stamp=stamp,
-            source_for_plan=src,
-        )
-        return
 
+def destination_matches(
+    dst: Path,
+    source: RenderedSource,
+    ledger: InstallLedger | None,
+    cache: StatCache | None = None,
+) -> bool:
+    """Return True when dst already holds source's bytes.
+
+    A size mismatch settles the answer from `stat` alone, and a ledger entry whose stat
+    still matches dst stands in for dst's content; only otherwise is dst read.
+    """
+    info = cached_stat(cache, dst)
+    if info is None:
+        return False
+    if not stat.S_ISREG(info.st_mode) or info.st_size != len(source.data):
+        return False
+
+    # Only a regular file (not a link to one) can match its ledger entry.
+    lstat_info = cached_lstat(cache, dst)
+    recorded = ledger_recorded_digest(ledger, dst, lstat_info)
+    if recorded is not None:
+        count_metric("ledger_digest_hits")
+        return recorded == source.digest
     try:
-        dst_data = json.loads(dst.read_text(encoding="utf-8"))
-    except Exception:
-        state.notes.append(
-            f"Could not parse hooks JSON for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
+        existing = dst.read_bytes()
+    except OSError:
+        return False
+    count_metric("destination_bytes_read", len(existing))
+    return existing == source.data
 
-    if not isinstance(dst_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
 
-    merged = dst_data
-    src_hooks = src_data.get("hooks")
-    merged_hooks = merged.setdefault("hooks", {})
-    if not isinstance(src_hooks, dict) or not isinstance(merged_hooks, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
+@dataclass
+class FileCopyPlan:
+    """Outcome of the read/render/compare step for one payload file.
 
-    changed = False
-    for event, entries in src_hooks.items():
-        if not isinstance(entries, list):
-            continue
-        existing_entries = merged_hooks.setdefault(event, [])
-        if not isinstance(existing_entries, list):
-            merged_hooks[event] = []
-            existing_entries = merged_hooks[event]
-        for entry in entries:
-            if entry not in existing_entries:
-                existing_entries.append(entry)
-                changed = True
-
-    if not changed:
-        return
-
-    if args.preserve_existing:
-        print(f"Preserve existing hooks file: {dst}")
-        state.skipped_existing.append(dst)
-        return
-
-    if not args.dry_run:
-        backup_existing_path(dst, state, stamp, args.dry_run)
-        dst.write_text(json.dumps(merged, indent=2) + "\n", encoding="utf-8")
-    else:
-        print(f"Merge hooks file: {src} + {dst}")
+    Computing a plan never mutates install state or prints, so plans can be built on
+    worker threads; `apply_file_copy` then records them in a stable order.
+    """
 
-    state.overwritten_files += 1
-    state.planned_files.append((src, dst))
+    src: Path
+    dst: Path
+    action: str
+    source: RenderedSource | None = None
+    parent_exists: bool = False
 
 
-def merge_cursor_mcp_file(
+def plan_file_copy(
     src: Path,
     dst: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
     replacements: list[tuple[str, str]],
     exts: set[str],
     basenames: set[str],
-) -> None:
-    """Merge Cursor `.cursor/mcp.json` by adding missing MCP servers.
-
-    We only add servers that do not already exist in the destination to avoid
-    clobbering user customizations.
-    """
-    try:
-        src_text = apply_replacements(src.read_text(encoding="utf-8"), replacements)
-        src_data = json.loads(src_text)
-    except Exception:
-        state.notes.append(
-            f"Could not parse mcp JSON for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
+    ledger: InstallLedger | None,
+    index: PayloadIndex | None = None,
+    cache: StatCache | None = None,
+    rendered: dict[Path, RenderedSource] | None = None,
+) -> FileCopyPlan:
+    dst_info = cached_stat(cache, dst)
+    if dst_info is not None and stat.S_ISDIR(dst_info.st_mode):
+        return FileCopyPlan(src=src, dst=dst, action="destination-is-dir")
+
+    source = rendered.get(src) if rendered is not None else None
+    if source is None:
+        try:
+            source = render_source(src, replacements, exts, basenames, index)
+        except OSError:
+            return FileCopyPlan(src=src, dst=dst, action="unreadable-source")
+
+    plan = FileCopyPlan(src=src, dst=dst, action="create", source=source)
+    if cache is not None:
+        parent_info = cache.entries.get(dst.parent)
+        plan.parent_exists = parent_info is not None and stat.S_ISDIR(parent_info.st_mode)
+    if cached_lstat(cache, dst) is not None:
+        plan.action = "replace"
+        if destination_matches(dst, source, ledger, cache):
+            plan.action = "unchanged"
+    return plan
 
-    if not isinstance(src_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
 
-    if not dst.exists():
-        write_json_file_with_backup(
-            path=dst,
-            data=src_data,
-            args=args,
-            state=state,
-            stamp=stamp,
-            source_for_plan=src,
-        )
-        return
+def plan_stat_token(info: os.stat_result | None) -> str:
+    """Fingerprint a destination by kind and size; no mtime, so plans carry across machines."""
+    if info is None:
+        return "missing"
+    if stat.S_ISLNK(info.st_mode):
+        return "link"
+    if stat.S_ISDIR(info.st_mode):
+        return "dir"
+    return f"file:{info.st_size}"
 
-    try:
-        dst_data = json.loads(dst.read_text(encoding="utf-8"))
-    except Exception:
-        state.notes.append(
-            f"Could not parse mcp JSON for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
 
-    if not isinstance(dst_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+def note_planned_file(
+    state: InstallState, plan: FileCopyPlan, action: str, backup: Path | None = None
+) -> None:
+    """Record one file decision for `--plan-out`; a no-op otherwise."""
+    if state.plan_actions is None:
         return
+    source = plan.source
+    state.plan_actions.append(
+        {
+            "action": action,
+            "src": plan.src,
+            "dst": plan.dst,
+            "size": len(source.data) if source is not None else None,
+            "sha256": source.digest if source is not None else None,
+            "dest_stat": plan_stat_token(cached_lstat(state.stat_cache, plan.dst)),
+            "backup": backup,
+        }
+    )
 
-    src_servers = src_data.get("mcpServers")
-    merged_servers = dst_data.setdefault("mcpServers", {})
-    if not isinstance(src_servers, dict) or not isinstance(merged_servers, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
 
-    changed = False
-    for name, server in src_servers.items():
-        if name in merged_servers:
-            if name == "ck" and merged_servers[name] != portable_cursor_ck_mcp_entry():
-                merged_servers[name] = portable_cursor_ck_mcp_entry()
-                changed = True
-            continue
-        merged_servers[name] = server
-        changed = True
+def apply_file_copy(
+    plan: FileCopyPlan,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+) -> bool:
+    """Record a planned copy in state; return True when the file still has to be written."""
+    src, dst = plan.src, plan.dst
+    if plan.action == "destination-is-dir":
+        state.notes.append(f"Skip file copy; destination is a directory: {dst}")
+        note_planned_file(state, plan, "skip")
+        return False
+    if plan.source is None:
+        state.notes.append(f"Skip file copy; could not read source: {src}")
+        note_planned_file(state, plan, "skip")
+        return False
 
-    if not changed:
-        return
+    if plan.source.scanned_text:
+        state.scanned_text_files += 1
+    if plan.source.rewritten_text:
+        state.rewritten_text_files += 1
 
-    if args.preserve_existing:
-        print(f"Preserve existing mcp file: {dst}")
-        state.skipped_existing.append(dst)
-        return
+    if plan.action == "unchanged":
+        emit("unchanged-file", f"Unchanged: {dst}", file=True, verbose=True, path=dst)
+        note_planned_file(state, plan, "unchanged")
+        if not args.dry_run:
+            record_ledger_file(state.ledger, dst, plan.source.digest)
+        return False
 
-    if not args.dry_run:
-        backup_existing_path(dst, state, stamp, args.dry_run)
-        dst.write_text(json.dumps(dst_data, indent=2) + "\n", encoding="utf-8")
+    if plan.action == "replace":
+        if args.preserve_existing:
+            emit("preserve-existing", f"Preserve existing: {dst}", file=True, path=dst)
+            state.skipped_existing.append(dst)
+            note_planned_file(state, plan, "preserve")
+            return False
+        backup = None
+        if not (
+            state.skip_managed_backups
+            and ledger_recorded_digest(state.ledger, dst) is not None
+        ):
+            backup = backup_existing_path(dst, state, stamp, args.dry_run)
+        note_planned_file(state, plan, "replace", backup)
+        state.overwritten_files += 1
     else:
-        print(f"Merge mcp file: {src} + {dst}")
+        note_planned_file(state, plan, "create")
+        state.created_files += 1
+        state.created_paths.add(dst)
 
-    state.overwritten_files += 1
+    emit("install-file", f"Install file: {src} -> {dst}", file=True, src=src, dst=dst)
     state.planned_files.append((src, dst))
+    return not args.dry_run
 
 
-def forward_slash(path_str: str) -> str:
-    """Normalize Windows backslashes to forward slashes for JSON-safe paths."""
-    return str(path_str).replace("\\", "/")
-
+def reflink_file(src: Path, dst: Path) -> bool:
+    """Clone src into dst with the Linux FICLONE ioctl (btrfs, xfs, and other CoW filesystems)."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with src.open("rb") as src_handle, dst.open("wb") as dst_handle:
+            fcntl.ioctl(dst_handle.fileno(), FICLONE, src_handle.fileno())
+        return True
+    except OSError:
+        discard_partial_file(dst)
+        return False
 
-def portable_ck_command() -> str:
-    return (
-        'dir="$PWD"; '
-        'while [ -n "$dir" ] && [ "$dir" != "/" ]; do '
-        'if [ -d "$dir/ai-kb" ]; then cd "$dir/ai-kb" 2>/dev/null && exec ck --serve; fi; '
-        'next="$(dirname "$dir")"; [ "$next" = "$dir" ] && break; dir="$next"; '
-        'done; '
-        'cd "$HOME/.config/opencode/ai-kb" 2>/dev/null && exec ck --serve; '
-        'cd "$HOME/ai-kb" 2>/dev/null && exec ck --serve; '
-        'echo "ck MCP: unable to locate ai-kb" >&2; exit 1'
-    )
 
+def copy_file_range_file(src: Path, dst: Path, size: int) -> bool:
+    """Copy src into dst in the kernel with `os.copy_file_range` where the platform has it."""
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range is None:
+        return False
+    try:
+        with src.open("rb") as src_handle, dst.open("wb") as dst_handle:
+            remaining = size
+            while remaining > 0:
+                copied = copy_range(src_handle.fileno(), dst_handle.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        if remaining == 0:
+            return True
+    except OSError:
+        pass
+    discard_partial_file(dst)
+    return False
+
+
+def hardlink_file(src: Path, dst: Path) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
 
-def portable_ck_mcp_entry() -> dict[str, object]:
-    return {
-        "type": "local",
-        "command": ["bash", "-lc", portable_ck_command()],
-        "enabled": True,
-        "timeout": 15000,
-    }
 
+def discard_partial_file(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
 
-def portable_cursor_ck_mcp_entry() -> dict[str, object]:
-    return {
-        "type": "stdio",
-        "command": "bash",
-        "args": ["-lc", portable_ck_command()],
-    }
 
+def link_attempts(link_mode: str) -> list[str]:
+    if link_mode == "auto":
+        return ["reflink", "copy_file_range"]
+    if link_mode in {"reflink", "hardlink"}:
+        return [link_mode]
+    return []
 
-def runtime_instruction_paths(
-    opencode_root: str, project_root: Path | None = None
-) -> list[str]:
-    instructions: list[str] = []
-    if project_root is not None and (project_root / "AGENTS.md").exists():
-        instructions.append("AGENTS.md")
-    instructions.extend(
-        [
-            f"{opencode_root}/AGENTS.md",
-            f"{opencode_root}/prime-directive.md",
-            f"{opencode_root}/runtime/bootstrap.md",
-        ]
-    )
-    return instructions
 
+def write_file_copy(plan: FileCopyPlan, link_mode: str = "copy") -> str:
+    """Write a planned copy to its destination and return the install mode that was used.
 
-def runtime_plugin_paths(
-    opencode_root: str, project_root: Path | None = None
-) -> list[str]:
-    if project_root is not None:
-        plugin_root = (project_root / opencode_root / "plugins").resolve()
-        return [
-            (plugin_root / "autonomy-runtime.js").as_uri(),
-            (plugin_root / "kb-post-turn-analyzer.js").as_uri(),
-        ]
-    return [
-        f"{opencode_root}/plugins/autonomy-runtime.js",
-        f"{opencode_root}/plugins/kb-post-turn-analyzer.js",
-    ]
+    Files whose installed bytes equal the payload bytes can be reflinked, copied in the
+    kernel, or hardlinked per `link_mode`; anything else, or any attempt the filesystem
+    rejects, falls back to writing the rendered buffer.
+    """
+    src, dst, source = plan.src, plan.dst, plan.source
+    assert source is not None
+    if not plan.parent_exists:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+
+    # Packed payload members have no file of their own to link or clone.
+    if not source.rewritten_text and not isinstance(src, ArchivePath):
+        for mode in link_attempts(link_mode):
+            if mode == "hardlink":
+                if hardlink_file(src, dst):
+                    return mode
+                continue
+            if mode == "reflink":
+                linked = reflink_file(src, dst)
+            else:
+                linked = copy_file_range_file(src, dst, len(source.data))
+                if linked:
+                    count_metric("bytes_written", len(source.data))
+            if linked:
+                copy_source_metadata(src, dst, source)
+                return mode
 
+    dst.write_bytes(source.data)
+    count_metric("bytes_written", len(source.data))
+    copy_source_metadata(src, dst, source)
+    return "copy"
 
-def parse_markdown_frontmatter(text: str) -> tuple[dict[str, object], str]:
-    if not text.startswith("---\n"):
-        return {}, text.strip()
-    end = text.find("\n---\n", 4)
-    if end == -1:
-        return {}, text.strip()
 
-    frontmatter_text = text[4:end]
-    body = text[end + 5 :].strip()
-    frontmatter: dict[str, object] = {}
-    for raw_line in frontmatter_text.splitlines():
-        line = raw_line.strip()
-        if not line or line.startswith("#") or ":" not in line:
-            continue
-        key, value = line.split(":", 1)
-        key = key.strip()
-        value = value.strip()
-        if value.startswith(('"', "'")) and value.endswith(('"', "'")) and len(value) >= 2:
-            value = value[1:-1]
-        if key == "steps":
-            frontmatter[key] = int(value)
+def copy_source_metadata(src: Path, dst: Path, source: RenderedSource) -> None:
+    try:
+        if isinstance(src, ArchivePath):
+            src.copy_metadata_to(dst, keep_times=not source.rendered)
+        elif source.rendered:
+            # Keep permission bits consistent with the payload file.
+            shutil.copymode(src, dst)
         else:
-            frontmatter[key] = value
-    return frontmatter, body
+            shutil.copystat(src, dst)
+    except Exception:
+        pass
 
 
-def load_primary_agent_specs() -> dict[str, dict[str, object]]:
-    docs_root = Path(__file__).resolve().parent / "ai-kb" / "agents"
-    specs: dict[str, dict[str, object]] = {}
-    for name in ["build", "plan", "explore", "summary", "compaction", "title"]:
-        path = docs_root / f"{name}.md"
-        frontmatter, body = parse_markdown_frontmatter(path.read_text(encoding="utf-8"))
-        entry: dict[str, object] = {}
-        for key in ["mode", "description", "steps"]:
-            if key in frontmatter:
-                entry[key] = frontmatter[key]
-        if body:
-            entry["prompt"] = body
-        specs[name] = entry
-    return specs
+def write_file_copy_with_entry(
+    plan: FileCopyPlan, link_mode: str = "copy"
+) -> tuple[dict[str, object] | None, str]:
+    mode = write_file_copy(plan, link_mode)
+    assert plan.source is not None
+    return ledger_entry_for(plan.dst, plan.source.digest), mode
 
 
-def runtime_agent_defaults() -> dict[str, dict[str, object]]:
-    return load_primary_agent_specs()
+def record_file_write(
+    state: InstallState,
+    dst: Path,
+    result: tuple[dict[str, object] | None, str],
+) -> None:
+    entry, mode = result
+    forget_stat(state.stat_cache, dst)
+    store_ledger_entry(state.ledger, dst, entry)
+    state.install_modes[mode] = state.install_modes.get(mode, 0) + 1
 
 
-def normalize_runtime_agents(parsed: dict[str, object], defaults: dict[str, object]) -> bool:
-    agents = parsed.get("agent")
-    default_agents = defaults.get("agent")
-    if not isinstance(agents, dict) or not isinstance(default_agents, dict):
-        return False
+def run_jobs(func, items: list, jobs: int) -> list:
+    """Map func over items, on a thread pool when jobs > 1, preserving input order."""
+    if jobs <= 1 or len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        return list(executor.map(func, items))
 
-    changed = False
-    if "plan" not in agents:
-        if isinstance(agents.get("orchestrator"), dict):
-            agents["plan"] = json.loads(json.dumps(agents["orchestrator"]))
-            changed = True
-        elif isinstance(agents.get("general"), dict):
-            agents["plan"] = json.loads(json.dumps(agents["general"]))
-            changed = True
-    if parsed.get("default_agent") in {None, "general", "orchestrator"}:
-        if parsed.get("default_agent") != "plan":
-            parsed["default_agent"] = "plan"
-            changed = True
-    if "general" in agents:
-        del agents["general"]
-        changed = True
-    if "orchestrator" in agents:
-        del agents["orchestrator"]
-        changed = True
 
-    for agent_name, agent_defaults in default_agents.items():
-        if not isinstance(agent_defaults, dict):
-            continue
-        current = agents.get(agent_name)
-        if not isinstance(current, dict):
-            agents[agent_name] = json.loads(json.dumps(agent_defaults))
-            changed = True
-            continue
+def copy_file(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    plan = plan_file_copy(
+        src,
+        dst,
+        replacements,
+        exts,
+        basenames,
+        state.ledger,
+        state.payload_index,
+        state.stat_cache,
+        state.rendered,
+    )
+    if not apply_file_copy(plan, args, state, stamp):
+        return
+    record_file_write(state, dst, write_file_copy_with_entry(plan, args.link_mode))
 
-        for key, value in agent_defaults.items():
-            if key not in current or current.get(key) != value:
-                current[key] = value
-                changed = True
-    return changed
 
+def copy_files(
+    pairs: list[tuple[Path, Path]],
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    """Copy many files, running read/render/compare and writes on `--jobs` threads.
 
-def normalize_runtime_compaction(parsed: dict[str, object], defaults: dict[str, object]) -> bool:
-    compaction = parsed.get("compaction")
-    default_compaction = defaults.get("compaction")
-    if not isinstance(compaction, dict) or not isinstance(default_compaction, dict):
-        return False
+    Backups, counters and printed output are produced on the calling thread in the order
+    of `pairs`, so results are identical to a sequential run; only the per-file I/O
+    overlaps. Work is batched to bound the rendered text held in memory at once.
+    """
+    jobs = max(1, getattr(args, "jobs", 1) or 1)
+    batch_size = max(1, jobs * COPY_BATCH_PER_JOB)
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start : start + batch_size]
+        plans = run_jobs(
+            lambda pair: plan_file_copy(
+                pair[0],
+                pair[1],
+                replacements,
+                exts,
+                basenames,
+                state.ledger,
+                state.payload_index,
+                state.stat_cache,
+                state.rendered,
+            ),
+            batch,
+            jobs,
+        )
+        pending = [plan for plan in plans if apply_file_copy(plan, args, state, stamp)]
+        results = run_jobs(
+            lambda plan: write_file_copy_with_entry(plan, args.link_mode),
+            pending,
+            jobs,
+        )
+        for plan, result in zip(pending, results):
+            record_file_write(state, plan.dst, result)
 
-    changed = False
-    for key, value in default_compaction.items():
-        if compaction.get(key) != value:
-            compaction[key] = value
-            changed = True
-    return changed
 
+def copy_tree(
+    src_dir: Path,
+    dst_dir: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    dst_info = cached_stat(state.stat_cache, dst_dir)
+    if dst_info is not None and not stat.S_ISDIR(dst_info.st_mode):
+        if args.preserve_existing:
+            emit(
+                "preserve-existing",
+                f"Preserve existing non-directory: {dst_dir}",
+                path=dst_dir,
+            )
+            state.skipped_existing.append(dst_dir)
+            note_planned_file(state, FileCopyPlan(src_dir, dst_dir, "preserve"), "preserve")
+            return
+        backup_existing_path(dst_dir, state, stamp, args.dry_run)
+        dst_info = None
 
-def normalize_runtime_permissions(parsed: dict[str, object]) -> bool:
-    permission = parsed.get("permission")
-    if not isinstance(permission, dict):
-        return False
+    if not args.dry_run and dst_info is None:
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        forget_stat(state.stat_cache, dst_dir)
+        if state.stat_cache is not None:
+            # Just created, so it is known to be empty.
+            state.stat_cache.entries[dst_dir] = os.lstat(dst_dir)
+            state.stat_cache.listed.add(dst_dir)
+
+    if state.changed_sources is None:
+        src_files = iter_payload_files(src_dir)
+    else:
+        src_files = sorted(src for src in state.changed_sources if src.is_relative_to(src_dir))
+    pairs: list[tuple[Path, Path]] = []
+    for src_file in src_files:
+        rel = src_file.relative_to(src_dir)
+        pairs.append((src_file, dst_dir / rel))
+    copy_files(pairs, args, state, stamp, replacements, exts, basenames)
 
-    changed = False
-    required_scalars = {
-        "edit": "allow",
-        "bash": "allow",
-        "webfetch": "allow",
-        "question": "allow",
-        "skill": "allow",
-        "task": "allow",
-        "doom_loop": "allow",
-    }
-    for key, value in required_scalars.items():
-        if permission.get(key) != value:
-            permission[key] = value
-            changed = True
 
-    if permission.get("external_directory") != "allow":
-        permission["external_directory"] = "allow"
-        changed = True
-    return changed
+def scaffold_file_if_missing(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    if dst.exists() or dst.is_symlink():
+        return
 
+    try:
+        source = render_source(src, replacements, exts, basenames, state.payload_index)
+    except OSError:
+        emit("missing-source", f"Missing source: {src}", path=src)
+        state.missing_sources.append(src)
+        return
+    if source.scanned_text:
+        state.scanned_text_files += 1
+    if source.rewritten_text:
+        state.rewritten_text_files += 1
 
-def normalize_runtime_tools(parsed: dict[str, object]) -> bool:
-    tools = parsed.get("tools")
-    if not isinstance(tools, dict):
-        return False
+    emit("scaffold-file", f"Scaffold file: {src} -> {dst}", file=True, src=src, dst=dst)
+    state.planned_files.append((src, dst))
+    state.created_files += 1
+    state.created_paths.add(dst)
+    if args.dry_run:
+        return
 
-    desired = runtime_tool_merge_defaults()
-    if tools == desired:
-        return False
-    parsed["tools"] = json.loads(json.dumps(desired))
-    return True
+    plan = FileCopyPlan(src=src, dst=dst, action="create", source=source)
+    record_file_write(state, dst, write_file_copy_with_entry(plan, args.link_mode))
 
 
-def runtime_permission_defaults() -> dict[str, object]:
-    return {
-        "edit": "allow",
-        "bash": "allow",
-        "webfetch": "allow",
-        "doom_loop": "allow",
-        "question": "allow",
-        "skill": "allow",
-        "task": "allow",
-        "external_directory": "allow",
-    }
+def ensure_project_checkpoint_ignore(
+    project_root: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+) -> None:
+    ignore_lines = [".opencode/checkpoints/", f"{BUNDLE_STATE_DIR}/"]
+    gitignore_path = project_root / ".gitignore"
+    existing = ""
+    if gitignore_path.exists():
+        try:
+            existing = gitignore_path.read_text(encoding="utf-8")
+        except Exception as exc:
+            state.notes.append(
+                f"Could not read .gitignore for runtime ignore merge: {exc}"
+            )
+            return
 
+    missing_lines = [line for line in ignore_lines if line not in existing]
+    if not missing_lines:
+        return
 
-def runtime_permission_merge_defaults() -> dict[str, object]:
-    return {
-        "edit": "allow",
-        "bash": "allow",
-        "webfetch": "allow",
-        "doom_loop": "allow",
-        "question": "allow",
-        "skill": "allow",
-        "task": "allow",
-        "external_directory": "allow",
-    }
+    if gitignore_path.exists() and args.preserve_existing:
+        state.notes.append(
+            "Skipped .gitignore runtime ignore merge because preserve-existing is set."
+        )
+        return
 
+    next_text = existing
+    if next_text and not next_text.endswith("\n"):
+        next_text += "\n"
+    next_text += "".join(f"{line}\n" for line in missing_lines)
 
-def runtime_tool_defaults() -> dict[str, object]:
-    return {
-        "*": True,
-    }
+    emit(
+        "ensure-ignores",
+        f"Ensure runtime ignores: {gitignore_path}",
+        path=gitignore_path,
+    )
+    state.planned_files.append((project_root / ".opencode", gitignore_path))
+    if args.dry_run:
+        return
 
+    if existing:
+        backup_existing_path(
+            gitignore_path,
+            state,
+            datetime.now().strftime("%Y%m%d-%H%M%S"),
+            args.dry_run,
+        )
+    gitignore_path.write_text(next_text, encoding="utf-8")
+    record_written_text(state, gitignore_path, next_text)
+    if gitignore_path.exists():
+        state.overwritten_files += 1 if existing else 0
+        if not existing:
+            state.created_files += 1
+            state.created_paths.add(gitignore_path)
 
-def runtime_tool_merge_defaults() -> dict[str, object]:
-    return {
-        "*": True,
-    }
 
+def scaffold_project_runtime_state(
+    payload: Path,
+    project_root: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    template_root = payload / ".config/opencode/memory/templates/project/.opencode"
+    scaffold_paths = [
+        "README.md",
+        "checkpoints/latest.json",
+        "memory/current.md",
+        "memory/decisions.md",
+        "memory/handoff.md",
+        "overlays.jsonc",
+    ]
 
-def default_runtime_opencode_config(
-    opencode_root: str, project_root: Path | None = None
-) -> dict[str, object]:
-    return {
-        "$schema": "https://opencode.ai/config.json",
-        "formatter": False,
-        "lsp": False,
-        "instructions": runtime_instruction_paths(opencode_root, project_root),
-        "plugin": runtime_plugin_paths(opencode_root, project_root),
-        "default_agent": "plan",
-        "agent": runtime_agent_defaults(),
-        "permission": runtime_permission_defaults(),
-        "tools": runtime_tool_defaults(),
-        "mcp": {"ck": portable_ck_mcp_entry()},
-        "compaction": {
-            "auto": True,
-            "prune": True,
-            "reserved": 256000,
-        },
-        "experimental": {
-            "disable_paste_summary": True,
-            "continue_loop_on_deny": True,
-            "mcp_timeout": 45000,
-        },
-    }
+    for relative_path in scaffold_paths:
+        scaffold_file_if_missing(
+            template_root / relative_path,
+            project_root / ".opencode" / relative_path,
+            args,
+            state,
+            replacements,
+            exts,
+            basenames,
+        )
 
+    ensure_project_checkpoint_ignore(project_root, args, state)
 
-def merge_string_list(target: dict, key: str, values: list[str]) -> bool:
-    existing = target.get(key)
-    if existing is None:
-        target[key] = list(values)
-        return True
-    if not isinstance(existing, list):
-        return False
 
-    changed = False
-    for value in values:
-        if value not in existing:
-            existing.append(value)
-            changed = True
-    return changed
+def copy_entry(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    if not src.exists():
+        emit("missing-source", f"Missing source: {src}", path=src)
+        state.missing_sources.append(src)
+        return
+    if src.is_dir():
+        emit("install-dir", f"Install dir: {src} -> {dst}", src=src, dst=dst)
+        copy_tree(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+    if state.changed_sources is not None and src not in state.changed_sources:
+        return
+    copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
 
 
-def merge_dict_missing(target: dict, key: str, defaults: dict[str, object]) -> bool:
-    existing = target.get(key)
-    if existing is None:
-        target[key] = json.loads(json.dumps(defaults))
-        return True
-    if not isinstance(existing, dict):
-        return False
+@dataclass
+class StoreGeneration:
+    """Rendered store entries for one bundle payload and rewrite-rule set.
 
-    changed = False
-    for sub_key, value in defaults.items():
-        if sub_key not in existing:
-            existing[sub_key] = json.loads(json.dumps(value))
-            changed = True
-    return changed
+    `digest` covers every rendered file's destination path and content, so projects that
+    render identical bytes share one directory under the store.
+    """
 
+    digest: str
+    path: Path
+    entries: list[tuple[str, str]]
+    files: list[tuple[str, Path, RenderedSource]]
 
-def remove_stale_instruction_globs(
-    existing: list[str], project_root: Path | None
-) -> bool:
-    stale_rules_globs = [
-        ".opencode/rules/**/*.md",
-        "ai-kb/rules/**/*.md",
-        ".cursor/rules/*.md",
-        ".cursor/rules/*.mdc",
-    ]
-    changed = False
-    for stale_rules_glob in stale_rules_globs:
-        if stale_rules_glob not in existing:
-            continue
-        if stale_rules_glob == ".opencode/rules/**/*.md" and project_root is not None:
-            rules_dir = project_root / ".opencode" / "rules"
-            if rules_dir.exists():
-                continue
-        existing[:] = [item for item in existing if item != stale_rules_glob]
-        changed = True
-    return changed
 
+def default_store_dir() -> Path:
+    return Path.home() / ".cache" / "ai-config-bundle" / "store"
 
-def merge_runtime_opencode_config(
-    parsed: dict[str, object], opencode_root: str, project_root: Path | None = None
-) -> tuple[bool, list[str]]:
-    changed = False
-    notes: list[str] = []
-    defaults = default_runtime_opencode_config(opencode_root, project_root)
-    desired_plugins = defaults["plugin"]
 
-    if "formatter" not in parsed:
-        parsed["formatter"] = defaults["formatter"]
-        changed = True
-    if "lsp" not in parsed:
-        parsed["lsp"] = defaults["lsp"]
-        changed = True
-    if "compaction" not in parsed:
-        parsed["compaction"] = defaults["compaction"]
-        changed = True
+def store_current_link(project_root: Path) -> Path:
+    return project_root / BUNDLE_STATE_DIR / STORE_CURRENT_LINK
 
-    instructions = parsed.get("instructions")
-    if instructions is None:
-        parsed["instructions"] = list(defaults["instructions"])
-        changed = True
-    elif isinstance(instructions, list):
-        changed = remove_stale_instruction_globs(instructions, project_root) or changed
-        changed = (
-            merge_string_list(parsed, "instructions", defaults["instructions"])
-            or changed
-        )
-    else:
-        notes.append(
-            "Skipped opencode.json instruction merge; `instructions` is not an array."
-        )
 
-    plugins = parsed.get("plugin")
-    if plugins is None:
-        parsed["plugin"] = list(desired_plugins)
-        changed = True
-    elif isinstance(plugins, list):
-        stale_suffixes = (
-            "/plugins/autonomy-runtime.js",
-            "/plugins/kb-post-turn-analyzer.js",
-        )
-        normalized_plugins = []
-        for value in plugins:
-            string_value = str(value)
-            if string_value in desired_plugins:
-                normalized_plugins.append(string_value)
-                continue
-            if any(string_value.endswith(suffix) for suffix in stale_suffixes):
-                changed = True
-                continue
-            normalized_plugins.append(string_value)
-        if normalized_plugins != plugins:
-            plugins[:] = normalized_plugins
-        changed = merge_string_list(parsed, "plugin", desired_plugins) or changed
-    else:
-        notes.append("Skipped opencode.json plugin merge; `plugin` is not an array.")
+def generations_path(project_root: Path) -> Path:
+    return project_root / BUNDLE_STATE_DIR / GENERATIONS_FILE_NAME
 
-    if "default_agent" not in parsed:
-        parsed["default_agent"] = defaults["default_agent"]
-        changed = True
 
-    if merge_dict_missing(parsed, "agent", defaults["agent"]):
-        changed = True
-    if parsed.get("agent") is not None and not isinstance(parsed.get("agent"), dict):
-        notes.append("Skipped opencode.json agent merge; `agent` is not an object.")
-    elif isinstance(parsed.get("agent"), dict):
-        changed = normalize_runtime_agents(parsed, defaults) or changed
+def is_store_link(path: Path) -> bool:
+    if not path.is_symlink():
+        return False
+    try:
+        target = os.readlink(path).replace("\\", "/")
+    except OSError:
+        return False
+    return f"{BUNDLE_STATE_DIR}/{STORE_CURRENT_LINK}" in target
 
-    if merge_dict_missing(parsed, "permission", runtime_permission_merge_defaults()):
-        changed = True
-    if parsed.get("permission") is not None and not isinstance(
-        parsed.get("permission"), dict
-    ):
-        notes.append(
-            "Skipped opencode.json permission merge; `permission` is not an object."
-        )
-    elif isinstance(parsed.get("permission"), dict):
-        changed = normalize_runtime_permissions(parsed) or changed
 
-    tools = parsed.get("tools")
-    if tools is None:
-        parsed["tools"] = json.loads(json.dumps(runtime_tool_merge_defaults()))
-        changed = True
-    elif isinstance(tools, dict):
-        for tool_name, enabled in runtime_tool_merge_defaults().items():
-            if tool_name not in tools:
-                tools[tool_name] = enabled
-                changed = True
-        changed = normalize_runtime_tools(parsed) or changed
-    else:
-        notes.append("Skipped opencode.json tools merge; `tools` is not an object.")
+def store_entries(payload: Path, plan: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    # Only whole payload directories are shared; merged configs and scaffolded
+    # runtime state stay per-project.
+    return [
+        (src_rel, dst_rel)
+        for src_rel, dst_rel in plan
+        if src_rel != PROJECT_TEMPLATE_ENTRY and (payload / src_rel).is_dir()
+    ]
 
-    if merge_dict_missing(parsed, "compaction", defaults["compaction"]):
-        changed = True
-    elif parsed.get("compaction") is not None and not isinstance(
-        parsed.get("compaction"), dict
-    ):
-        notes.append("Skipped opencode.json compaction merge; `compaction` is not an object.")
-    else:
-        changed = normalize_runtime_compaction(parsed, defaults) or changed
 
-    if merge_dict_missing(parsed, "mcp", defaults["mcp"]):
-        changed = True
-    elif parsed.get("mcp") is not None and not isinstance(parsed.get("mcp"), dict):
-        notes.append("Skipped opencode.json MCP merge; `mcp` is not an object.")
-    else:
-        mcp = parsed.get("mcp")
-        if isinstance(mcp, dict):
-            desired_ck = portable_ck_mcp_entry()
-            if mcp.get("ck") != desired_ck:
-                mcp["ck"] = desired_ck
-                changed = True
+def render_store_generation(
+    payload: Path,
+    store_dir: Path,
+    entries: list[tuple[str, str]],
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+    jobs: int,
+    index: PayloadIndex | None = None,
+) -> StoreGeneration:
+    pairs: list[tuple[str, Path]] = []
+    for src_rel, dst_rel in entries:
+        src_root = payload / src_rel
+        for src_file in iter_payload_files(src_root):
+            rel = src_file.relative_to(src_root).as_posix()
+            pairs.append((f"{dst_rel}/{rel}", src_file))
+
+    sources = run_jobs(
+        lambda pair: render_source(pair[1], replacements, exts, basenames, index),
+        pairs,
+        jobs,
+    )
+    hasher = hashlib.sha256()
+    files: list[tuple[str, Path, RenderedSource]] = []
+    for (rel, src_file), source in zip(pairs, sources):
+        hasher.update(f"{rel}\0{source.digest}\n".encode("utf-8"))
+        files.append((rel, src_file, source))
+    digest = hasher.hexdigest()
+    return StoreGeneration(
+        digest=digest, path=store_dir / digest, entries=entries, files=files
+    )
 
-    if merge_dict_missing(parsed, "experimental", defaults["experimental"]):
-        changed = True
-    elif parsed.get("experimental") is not None and not isinstance(
-        parsed.get("experimental"), dict
-    ):
-        notes.append(
-            "Skipped opencode.json experimental merge; `experimental` is not an object."
-        )
 
-    return changed, notes
+def build_store_generation(generation: StoreGeneration, dry_run: bool) -> bool:
+    """Materialize generation in the store unless it is already there.
+
+    The tree is written under a temporary name and renamed into place, so concurrent
+    installs never see a half-written generation; the loser of a race discards its copy.
+    """
+    if generation.path.is_dir():
+        return False
+    emit(
+        "store-build",
+        f"Build store generation: {generation.path}",
+        path=generation.path,
+    )
+    if dry_run:
+        return True
+
+    tmp_root = generation.path.with_name(f".tmp-{generation.digest}-{os.getpid()}")
+    if tmp_root.exists():
+        shutil.rmtree(tmp_root)
+    for rel, src_file, source in generation.files:
+        dst = tmp_root / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(source.data)
+        copy_source_metadata(src_file, dst, source)
+    ensure_hook_executable_bits(tmp_root / ".cursor" / "hooks", dry_run)
+    try:
+        os.rename(tmp_root, generation.path)
+    except OSError:
+        if not generation.path.is_dir():
+            raise
+        shutil.rmtree(tmp_root, ignore_errors=True)
+    return True
 
 
-def merge_opencode_json_file(
-    src: Path,
-    dst: Path,
+def point_store_current(project_root: Path, target: Path, dry_run: bool) -> None:
+    """Repoint `.ai-bundle/current` at target with one atomic rename."""
+    link = store_current_link(project_root)
+    emit(
+        "store-switch",
+        f"Switch store generation: {link} -> {target}",
+        path=link,
+        target=target,
+    )
+    if dry_run:
+        return
+    link.parent.mkdir(parents=True, exist_ok=True)
+    tmp_link = link.with_name(f".{link.name}.{os.getpid()}")
+    if tmp_link.is_symlink() or tmp_link.exists():
+        tmp_link.unlink()
+    os.symlink(str(target), tmp_link, target_is_directory=True)
+    os.replace(tmp_link, link)
+
+
+def link_store_entry(
+    project_root: Path,
+    dst_rel: str,
     args: argparse.Namespace,
     state: InstallState,
     stamp: str,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-    project_mode: bool,
 ) -> None:
-    """Merge OpenCode `opencode.json` with missing autonomy-runtime defaults."""
-    try:
-        src_text = apply_replacements(src.read_text(encoding="utf-8"), replacements)
-        src_data = json.loads(src_text)
-    except Exception:
-        state.notes.append(
-            f"Could not parse opencode.json for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
-        return
-
-    if not isinstance(src_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+    dst = project_root / dst_rel
+    target = os.path.relpath(store_current_link(project_root) / dst_rel, dst.parent)
+    if dst.is_symlink() and os.readlink(dst) == target:
         return
 
-    if not dst.exists():
-        write_json_file_with_backup(
+    if is_store_link(dst):
+        emit("link", f"Relink: {dst} -> {target}", path=dst, target=target)
+        if not args.dry_run:
+            dst.unlink()
+    elif managed_tree_unchanged(dst, state.ledger):
+        # A tree the installer wrote and nobody has edited since needs no backup.
+        emit(
+            "replace-managed-dir",
+            f"Replace managed dir: {dst} -> {target}",
             path=dst,
-            data=src_data,
-            args=args,
-            state=state,
-            stamp=stamp,
-            source_for_plan=src,
+            target=target,
         )
+        if not args.dry_run:
+            shutil.rmtree(dst)
+    elif dst.exists() or dst.is_symlink():
+        if args.preserve_existing:
+            emit("preserve-existing", f"Skip existing (preserve): {dst}", path=dst)
+            state.skipped_existing.append(dst)
+            return
+        backup_existing_path(dst, state, stamp, args.dry_run)
+        emit("link", f"Link: {dst} -> {target}", path=dst, target=target)
+    else:
+        emit("link", f"Link: {dst} -> {target}", path=dst, target=target)
+
+    state.created_files += 1
+    if args.dry_run:
         return
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    os.symlink(target, dst, target_is_directory=True)
+    if state.ledger is not None:
+        prefix = f"{dst_rel}/"
+        for key in [key for key in state.ledger.entries if key.startswith(prefix)]:
+            del state.ledger.entries[key]
+
+
+def managed_tree_unchanged(path: Path, ledger: InstallLedger | None) -> bool:
+    if ledger is None or path.is_symlink() or not path.is_dir():
+        return False
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if ledger_recorded_digest(ledger, Path(root) / name) is None:
+                return False
+        for name in dirs:
+            if (Path(root) / name).is_symlink():
+                return False
+    return True
+
 
+def load_generations(project_root: Path) -> list[dict[str, object]]:
     try:
-        dst_data = json.loads(dst.read_text(encoding="utf-8"))
+        raw = json.loads(generations_path(project_root).read_text(encoding="utf-8"))
     except Exception:
-        state.notes.append(
-            f"Could not parse opencode.json for merge; fallback to regular copy: {dst}"
-        )
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return []
+    if not isinstance(raw, dict) or raw.get("version") != GENERATIONS_VERSION:
+        return []
+    generations = raw.get("generations")
+    if not isinstance(generations, list):
+        return []
+    return [item for item in generations if isinstance(item, dict)]
+
+
+def record_generation(project_root: Path, target: Path, dry_run: bool) -> None:
+    generations = load_generations(project_root)
+    if generations and generations[-1].get("path") == str(target):
         return
-
-    if not isinstance(dst_data, dict):
-        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+    if dry_run:
         return
-
-    opencode_root = ".opencode" if project_mode else "~/.config/opencode"
-    changed, notes = merge_runtime_opencode_config(
-        dst_data,
-        opencode_root=opencode_root,
-        project_root=dst.parent if project_mode else None,
+    generations.append(
+        {
+            "digest": target.name,
+            "path": str(target),
+            "installed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+    )
+    write_json_atomic(
+        generations_path(project_root),
+        {"version": GENERATIONS_VERSION, "generations": generations},
     )
-    state.notes.extend(notes)
 
-    if not changed:
-        return
 
-    if args.preserve_existing:
-        print(f"Preserve existing opencode.json: {dst}")
-        state.skipped_existing.append(dst)
-        return
+@profiled_phase("store")
+def install_store_generation(
+    payload: Path,
+    project_root: Path,
+    plan: list[tuple[str, str]],
+    store_dir: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> list[tuple[str, str]]:
+    """Render shared entries into the store and link the project to them.
 
-    if not args.dry_run:
-        backup_existing_path(dst, state, stamp, args.dry_run)
-        dst.write_text(json.dumps(dst_data, indent=2) + "\n", encoding="utf-8")
-    else:
-        print(f"Merge opencode.json: {src} + {dst}")
+    Returns the plan entries now served from the store; the caller installs the rest.
+    """
+    entries = store_entries(payload, plan)
+    generation = render_store_generation(
+        payload,
+        store_dir,
+        entries,
+        replacements,
+        exts,
+        basenames,
+        args.jobs,
+        state.payload_index,
+    )
+    if build_store_generation(generation, args.dry_run):
+        state.notes.append(f"Built store generation: {generation.path}")
+    state.scanned_text_files += sum(
+        1 for _, _, source in generation.files if source.scanned_text
+    )
+    state.rewritten_text_files += sum(
+        1 for _, _, source in generation.files if source.rewritten_text
+    )
 
-    state.overwritten_files += 1
-    state.planned_files.append((src, dst))
+    current = store_current_link(project_root)
+    if not (current.is_symlink() and os.readlink(current) == str(generation.path)):
+        point_store_current(project_root, generation.path, args.dry_run)
+    for _, dst_rel in entries:
+        link_store_entry(project_root, dst_rel, args, state, stamp)
+    record_generation(project_root, generation.path, args.dry_run)
+    state.notes.append(f"Store generation: {generation.digest}")
+    return entries
+
+
+def rollback_store_generation(project_root: Path, dry_run: bool) -> int:
+    """Point the project back at the generation it used before the current one."""
+    current = store_current_link(project_root)
+    if not current.is_symlink():
+        print(f"No store generation is linked in {project_root}", file=sys.stderr)
+        return 2
+    current_target = os.readlink(current)
+    for generation in reversed(load_generations(project_root)):
+        target = generation.get("path")
+        if not isinstance(target, str) or target == current_target:
+            continue
+        if not Path(target).is_dir():
+            emit(
+                "store-skip-pruned",
+                f"Skip pruned store generation: {target}",
+                path=target,
+            )
+            continue
+        point_store_current(project_root, Path(target), dry_run)
+        record_generation(project_root, Path(target), dry_run)
+        print("Done")
+        print("Mode: rollback")
+        print("Target:", project_root)
+        print("Dry run:", "yes" if dry_run else "no")
+        print("Store generation:", Path(target).name)
+        return 0
+    print("No earlier store generation to roll back to.", file=sys.stderr)
+    return 2
 
 
-def ensure_hook_executable_bits(cursor_hooks_root: Path, dry_run: bool) -> None:
-    for hook_name in HOOK_FILE_NAMES:
-        hook_path = cursor_hooks_root / hook_name
-        if not hook_path.exists():
+def dedupe_replacements(replacements: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    unique: list[tuple[str, str]] = []
+    seen = set()
+    for old, new in replacements:
+        if not old:
             continue
-        if dry_run:
-            print(f"Set executable bit: {hook_path}")
+        key = (old, new)
+        if key in seen:
             continue
-        mode = hook_path.stat().st_mode
-        hook_path.chmod(mode | stat.S_IXUSR)
+        seen.add(key)
+        unique.append(key)
+    unique.sort(key=lambda pair: len(pair[0]), reverse=True)
+    return unique
 
 
-def default_project_opencode_instructions(project_root: Path) -> list[str]:
-    return runtime_instruction_paths(".opencode", project_root)
+@dataclass(frozen=True)
+class ReplacementEngine:
+    """Rewrite rules compiled for a single leftmost-longest pass over a text.
 
+    Rules are grouped by first character; each group is located with `str.find` on the
+    group's common prefix (its anchor) and resolved with one anchored alternation that
+    lists the group's keys longest first. Text produced by a rule is never rescanned, so
+    a later rule cannot rewrite the output of an earlier one.
+    """
 
-def default_project_opencode_config(
-    project_root: Path,
-    required_instructions: list[str],
-) -> dict[str, object]:
-    config = default_runtime_opencode_config(".opencode", project_root)
-    config["instructions"] = list(required_instructions)
-    return config
+    mapping: dict[str, str]
+    anchors: tuple[tuple[str, re.Pattern[str]], ...]
 
 
-def ensure_project_opencode_json(
-    project_root: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
-) -> None:
-    config_path = project_root / "opencode.json"
-    required_instructions = default_project_opencode_instructions(project_root)
+@functools.lru_cache(maxsize=16)
+def compile_replacements(
+    replacements: tuple[tuple[str, str], ...],
+) -> ReplacementEngine:
+    mapping: dict[str, str] = {}
+    for old, new in replacements:
+        if old and old not in mapping:
+            mapping[old] = new
+
+    groups: dict[str, list[str]] = {}
+    for old in mapping:
+        groups.setdefault(old[0], []).append(old)
+
+    anchors: list[tuple[str, re.Pattern[str]]] = []
+    for keys in groups.values():
+        keys.sort(key=len, reverse=True)
+        matcher = re.compile("|".join(re.escape(key) for key in keys))
+        anchors.append((os.path.commonprefix(keys), matcher))
+    return ReplacementEngine(mapping=mapping, anchors=tuple(anchors))
+
+
+def apply_compiled_replacements(text: str, engine: ReplacementEngine) -> str:
+    anchors = engine.anchors
+    next_hits = [text.find(anchor) for anchor, _ in anchors]
+    if max(next_hits, default=-1) < 0:
+        return text
+
+    pieces: list[str] = []
+    position = 0
+    while True:
+        index = -1
+        hit = -1
+        for candidate_index, candidate in enumerate(next_hits):
+            if candidate >= 0 and (hit < 0 or candidate < hit):
+                hit = candidate
+                index = candidate_index
+        if index < 0:
+            break
+
+        anchor, matcher = anchors[index]
+        match = matcher.match(text, hit)
+        if match is None:
+            next_hits[index] = text.find(anchor, hit + 1)
+            continue
 
-    planned_config_copy = any(dst == config_path for _, dst in state.planned_files)
-    if not config_path.exists():
-        if args.dry_run and planned_config_copy:
-            state.notes.append(
-                "opencode.json is part of this dry-run install plan; "
-                "instruction merge runs after real file copy."
-            )
-            return
-        generated = default_project_opencode_config(project_root, required_instructions)
-        print(f"Create project opencode.json: {config_path}")
-        if not args.dry_run:
-            config_path.write_text(
-                json.dumps(generated, indent=2) + "\n", encoding="utf-8"
-            )
-        state.created_files += 1
-        state.created_paths.add(config_path)
+        end = match.end()
+        pieces.append(text[position:hit])
+        pieces.append(engine.mapping[match.group()])
+        position = end
+        for other, (other_anchor, _) in enumerate(anchors):
+            if 0 <= next_hits[other] < end:
+                next_hits[other] = text.find(other_anchor, end)
+
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+
+def apply_replacements(text: str, replacements: list[tuple[str, str]]) -> str:
+    if not replacements:
+        return text
+    return apply_compiled_replacements(text, compile_replacements(tuple(replacements)))
+
+
+def has_backup_for(path: Path, state: InstallState) -> bool:
+    return any(original == path for original, _ in state.backups)
+
+
+def write_json_file_with_backup(
+    path: Path,
+    data: dict,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    source_for_plan: Path | None = None,
+) -> None:
+    is_existing = path.exists() or path.is_symlink()
+    was_created_this_run = path in state.created_paths
+    if is_existing and args.preserve_existing:
+        state.skipped_existing.append(path)
+        emit("preserve-existing", f"Preserve existing: {path}", path=path)
+        return
+
+    if is_existing:
+        if not was_created_this_run:
+            state.overwritten_files += 1
+        if (
+            not args.dry_run
+            and not has_backup_for(path, state)
+            and not was_created_this_run
+        ):
+            backup_existing_path(path, state, stamp, args.dry_run)
+    else:
+        if not was_created_this_run:
+            state.created_files += 1
+            state.created_paths.add(path)
+
+    if source_for_plan is not None:
+        state.planned_files.append((source_for_plan, path))
+
+    emit("write-json", f"Write JSON: {path}", path=path)
+    if args.dry_run:
         return
 
+    path.parent.mkdir(parents=True, exist_ok=True)
+    text = json.dumps(data, indent=2) + "\n"
+    path.write_text(text, encoding="utf-8")
+    count_metric("json_files_written")
+    record_written_text(state, path, text)
+
+
+def normalize_project_cursor_hook_command(command: str) -> str:
+    normalized = command.replace("./hooks/", ".cursor/hooks/")
+    if normalized.startswith("hooks/"):
+        normalized = f".cursor/{normalized}"
+    return normalized
+
+
+def normalize_project_cursor_hooks_config(raw: dict) -> dict:
+    hooks = raw.get("hooks")
+    if not isinstance(hooks, dict):
+        return raw
+
+    normalized_config = dict(raw)
+    normalized_hooks: dict[str, object] = {}
+    for event, entries in hooks.items():
+        if not isinstance(entries, list):
+            normalized_hooks[event] = entries
+            continue
+
+        updated_entries: list[object] = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                updated_entries.append(entry)
+                continue
+            rewritten = dict(entry)
+            command = rewritten.get("command")
+            if isinstance(command, str):
+                rewritten["command"] = normalize_project_cursor_hook_command(command)
+            updated_entries.append(rewritten)
+        normalized_hooks[event] = updated_entries
+
+    normalized_config["hooks"] = normalized_hooks
+    return normalized_config
+
+
+@profiled_phase("json-merge")
+def merge_cursor_hooks_file(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
     try:
-        parsed = json.loads(config_path.read_text(encoding="utf-8"))
+        src_data = json.loads(src.read_text(encoding="utf-8"))
     except Exception:
-        if args.preserve_existing:
-            state.notes.append(
-                "Skipped opencode.json merge because file is not strict JSON "
-                "(likely JSONC) and preserve-existing is set."
-            )
-            return
-
-        replacement = default_project_opencode_config(
-            project_root, required_instructions
-        )
         state.notes.append(
-            "Existing opencode.json was not strict JSON; backed it up and replaced "
-            "with a project-compatible config."
+            f"Could not parse hooks JSON for merge; fallback to regular copy: {dst}"
         )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not isinstance(src_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+    src_data = normalize_project_cursor_hooks_config(src_data)
+
+    if not dst.exists():
         write_json_file_with_backup(
-            path=config_path,
-            data=replacement,
+            path=dst,
+            data=src_data,
             args=args,
             state=state,
             stamp=stamp,
+            source_for_plan=src,
         )
         return
 
-    if not isinstance(parsed, dict):
-        if args.preserve_existing:
-            state.notes.append(
-                "Skipped opencode.json merge because root is not a JSON object "
-                "and preserve-existing is set."
-            )
-            return
-
-        replacement = default_project_opencode_config(
-            project_root, required_instructions
+    try:
+        dst_data = json.loads(dst.read_text(encoding="utf-8"))
+    except Exception:
+        state.notes.append(
+            f"Could not parse hooks JSON for merge; fallback to regular copy: {dst}"
         )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not isinstance(dst_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    merged = dst_data
+    src_hooks = src_data.get("hooks")
+    merged_hooks = merged.setdefault("hooks", {})
+    if not isinstance(src_hooks, dict) or not isinstance(merged_hooks, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    changed = False
+    for event, entries in src_hooks.items():
+        if not isinstance(entries, list):
+            continue
+        existing_entries = merged_hooks.setdefault(event, [])
+        if not isinstance(existing_entries, list):
+            merged_hooks[event] = []
+            existing_entries = merged_hooks[event]
+        for entry in entries:
+            if entry not in existing_entries:
+                existing_entries.append(entry)
+                changed = True
+
+    if not changed:
+        return
+
+    if args.preserve_existing:
+        emit("preserve-existing", f"Preserve existing hooks file: {dst}", path=dst)
+        state.skipped_existing.append(dst)
+        return
+
+    if not args.dry_run:
+        backup_existing_path(dst, state, stamp, args.dry_run)
+        text = json.dumps(merged, indent=2) + "\n"
+        dst.write_text(text, encoding="utf-8")
+        record_written_text(state, dst, text)
+    else:
+        emit("merge-json", f"Merge hooks file: {src} + {dst}", src=src, dst=dst)
+
+    state.overwritten_files += 1
+    state.planned_files.append((src, dst))
+
+
+@profiled_phase("json-merge")
+def merge_cursor_mcp_file(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    """Merge Cursor `.cursor/mcp.json` by adding missing MCP servers.
+
+    We only add servers that do not already exist in the destination to avoid
+    clobbering user customizations.
+    """
+    try:
+        src_text = apply_replacements(src.read_text(encoding="utf-8"), replacements)
+        src_data = json.loads(src_text)
+    except Exception:
         state.notes.append(
-            "Existing opencode.json root was not an object; backed it up and replaced "
-            "with a project-compatible config."
+            f"Could not parse mcp JSON for merge; fallback to regular copy: {dst}"
         )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not isinstance(src_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not dst.exists():
         write_json_file_with_backup(
-            path=config_path,
-            data=replacement,
+            path=dst,
+            data=src_data,
             args=args,
             state=state,
             stamp=stamp,
+            source_for_plan=src,
         )
         return
 
-    changed, notes = merge_runtime_opencode_config(
-        parsed,
-        opencode_root=".opencode",
-        project_root=project_root,
-    )
-    state.notes.extend(notes)
-
-    if not changed:
-        return
-    if args.preserve_existing:
+    try:
+        dst_data = json.loads(dst.read_text(encoding="utf-8"))
+    except Exception:
         state.notes.append(
-            "Skipped opencode.json merge because preserve-existing is set."
+            f"Could not parse mcp JSON for merge; fallback to regular copy: {dst}"
         )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
         return
 
-    print(f"Merge instructions into: {config_path}")
-    if args.dry_run:
+    if not isinstance(dst_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
         return
-    backup_existing_path(config_path, state, stamp, args.dry_run)
-    config_path.write_text(json.dumps(parsed, indent=2) + "\n", encoding="utf-8")
-    state.overwritten_files += 1
 
+    src_servers = src_data.get("mcpServers")
+    merged_servers = dst_data.setdefault("mcpServers", {})
+    if not isinstance(src_servers, dict) or not isinstance(merged_servers, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
 
-def global_copy_plan(copied_items: list[str]) -> list[tuple[str, str]]:
-    # OpenCode uses plural subdirectories (`agents/`, `commands/`, `plugins/`) as canonical.
-    # Singular names are supported for backwards compatibility, but we avoid installing both.
-    plan: list[tuple[str, str]] = []
-    for rel in copied_items:
+    changed = False
+    for name, server in src_servers.items():
+        if name in merged_servers:
+            if name == "ck" and merged_servers[name] != portable_cursor_ck_mcp_entry():
+                merged_servers[name] = portable_cursor_ck_mcp_entry()
+                changed = True
+            continue
+        merged_servers[name] = server
+        changed = True
+
+    if not changed:
+        return
+
+    if args.preserve_existing:
+        emit("preserve-existing", f"Preserve existing mcp file: {dst}", path=dst)
+        state.skipped_existing.append(dst)
+        return
+
+    if not args.dry_run:
+        backup_existing_path(dst, state, stamp, args.dry_run)
+        text = json.dumps(dst_data, indent=2) + "\n"
+        dst.write_text(text, encoding="utf-8")
+        record_written_text(state, dst, text)
+    else:
+        emit("merge-json", f"Merge mcp file: {src} + {dst}", src=src, dst=dst)
+
+    state.overwritten_files += 1
+    state.planned_files.append((src, dst))
+
+
+def forward_slash(path_str: str) -> str:
+    """Normalize Windows backslashes to forward slashes for JSON-safe paths."""
+    return str(path_str).replace("\\", "/")
+
+
+def portable_ck_command() -> str:
+    return (
+        'dir="$PWD"; '
+        'while [ -n "$dir" ] && [ "$dir" != "/" ]; do '
+        'if [ -d "$dir/ai-kb" ]; then cd "$dir/ai-kb" 2>/dev/null && exec ck --serve; fi; '
+        'next="$(dirname "$dir")"; [ "$next" = "$dir" ] && break; dir="$next"; '
+        'done; '
+        'cd "$HOME/.config/opencode/ai-kb" 2>/dev/null && exec ck --serve; '
+        'cd "$HOME/ai-kb" 2>/dev/null && exec ck --serve; '
+        'echo "ck MCP: unable to locate ai-kb" >&2; exit 1'
+    )
+
+
+def portable_ck_mcp_entry() -> dict[str, object]:
+    return {
+        "type": "local",
+        "command": ["bash", "-lc", portable_ck_command()],
+        "enabled": True,
+        "timeout": 15000,
+    }
+
+
+def portable_cursor_ck_mcp_entry() -> dict[str, object]:
+    return {
+        "type": "stdio",
+        "command": "bash",
+        "args": ["-lc", portable_ck_command()],
+    }
+
+
+def runtime_instruction_paths(
+    opencode_root: str, project_root: Path | None = None
+) -> list[str]:
+    instructions: list[str] = []
+    if project_root is not None and (project_root / "AGENTS.md").exists():
+        instructions.append("AGENTS.md")
+    instructions.extend(
+        [
+            f"{opencode_root}/AGENTS.md",
+            f"{opencode_root}/prime-directive.md",
+            f"{opencode_root}/runtime/bootstrap.md",
+        ]
+    )
+    return instructions
+
+
+def runtime_plugin_paths(
+    opencode_root: str, project_root: Path | None = None
+) -> list[str]:
+    if project_root is not None:
+        # abspath, not resolve(): with --store the plugins dir is a link that must
+        # keep following the project's current generation.
+        plugin_root = Path(os.path.abspath(project_root / opencode_root / "plugins"))
+        return [
+            (plugin_root / "autonomy-runtime.js").as_uri(),
+            (plugin_root / "kb-post-turn-analyzer.js").as_uri(),
+        ]
+    return [
+        f"{opencode_root}/plugins/autonomy-runtime.js",
+        f"{opencode_root}/plugins/kb-post-turn-analyzer.js",
+    ]
+
+
+def parse_markdown_frontmatter(text: str) -> tuple[dict[str, object], str]:
+    if not text.startswith("---\n"):
+        return {}, text.strip()
+    end = text.find("\n---\n", 4)
+    if end == -1:
+        return {}, text.strip()
+
+    frontmatter_text = text[4:end]
+    body = text[end + 5 :].strip()
+    frontmatter: dict[str, object] = {}
+    for raw_line in frontmatter_text.splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith("#") or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        key = key.strip()
+        value = value.strip()
+        if value.startswith(('"', "'")) and value.endswith(('"', "'")) and len(value) >= 2:
+            value = value[1:-1]
+        if key == "steps":
+            frontmatter[key] = int(value)
+        else:
+            frontmatter[key] = value
+    return frontmatter, body
+
+
+def freeze_json(value: object) -> object:
+    """Return a read-only copy of JSON data: objects become mapping proxies, arrays tuples."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze_json(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_json(item) for item in value)
+    return value
+
+
+def thaw_json(value: object) -> object:
+    """Return a mutable deep copy of (possibly frozen) JSON data for insertion into a config."""
+    if isinstance(value, Mapping):
+        return {key: thaw_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw_json(item) for item in value]
+    return value
+
+
+def primary_agent_doc_tokens() -> tuple[str, ...]:
+    return tuple(
+        stat_token(PRIMARY_AGENT_DOCS_ROOT / f"{name}.md") for name in PRIMARY_AGENT_NAMES
+    )
+
+
+def load_primary_agent_specs() -> Mapping[str, Mapping[str, object]]:
+    """Parsed primary agent docs, re-read only when one of them changes on disk."""
+    return parse_primary_agent_specs(primary_agent_doc_tokens())
+
+
+@functools.lru_cache(maxsize=4)
+def parse_primary_agent_specs(
+    doc_tokens: tuple[str, ...],
+) -> Mapping[str, Mapping[str, object]]:
+    """Parse the primary agent docs with the given stat tokens; frozen and shared."""
+    specs: dict[str, dict[str, object]] = {}
+    for name in PRIMARY_AGENT_NAMES:
+        path = PRIMARY_AGENT_DOCS_ROOT / f"{name}.md"
+        frontmatter, body = parse_markdown_frontmatter(path.read_text(encoding="utf-8"))
+        entry: dict[str, object] = {}
+        for key in ["mode", "description", "steps"]:
+            if key in frontmatter:
+                entry[key] = frontmatter[key]
+        if body:
+            entry["prompt"] = body
+        specs[name] = entry
+    return freeze_json(specs)
+
+
+def runtime_agent_defaults() -> Mapping[str, Mapping[str, object]]:
+    return load_primary_agent_specs()
+
+
+def normalize_runtime_agents(parsed: dict[str, object], defaults: Mapping[str, object]) -> bool:
+    agents = parsed.get("agent")
+    default_agents = defaults.get("agent")
+    if not isinstance(agents, dict) or not isinstance(default_agents, Mapping):
+        return False
+
+    changed = False
+    if "plan" not in agents:
+        if isinstance(agents.get("orchestrator"), dict):
+            agents["plan"] = agents["orchestrator"]
+            changed = True
+        elif isinstance(agents.get("general"), dict):
+            agents["plan"] = agents["general"]
+            changed = True
+    if parsed.get("default_agent") in {None, "general", "orchestrator"}:
+        if parsed.get("default_agent") != "plan":
+            parsed["default_agent"] = "plan"
+            changed = True
+    if "general" in agents:
+        del agents["general"]
+        changed = True
+    if "orchestrator" in agents:
+        del agents["orchestrator"]
+        changed = True
+
+    for agent_name, agent_defaults in default_agents.items():
+        if not isinstance(agent_defaults, Mapping):
+            continue
+        current = agents.get(agent_name)
+        if not isinstance(current, dict):
+            agents[agent_name] = thaw_json(agent_defaults)
+            changed = True
+            continue
+
+        for key, value in agent_defaults.items():
+            if key not in current or current.get(key) != value:
+                current[key] = value
+                changed = True
+    return changed
+
+
+def normalize_runtime_compaction(
+    parsed: dict[str, object], defaults: Mapping[str, object]
+) -> bool:
+    compaction = parsed.get("compaction")
+    default_compaction = defaults.get("compaction")
+    if not isinstance(compaction, dict) or not isinstance(default_compaction, Mapping):
+        return False
+
+    changed = False
+    for key, value in default_compaction.items():
+        if compaction.get(key) != value:
+            compaction[key] = value
+            changed = True
+    return changed
+
+
+def normalize_runtime_permissions(parsed: dict[str, object]) -> bool:
+    permission = parsed.get("permission")
+    if not isinstance(permission, dict):
+        return False
+
+    changed = False
+    required_scalars = {
+        "edit": "allow",
+        "bash": "allow",
+        "webfetch": "allow",
+        "question": "allow",
+        "skill": "allow",
+        "task": "allow",
+        "doom_loop": "allow",
+    }
+    for key, value in required_scalars.items():
+        if permission.get(key) != value:
+            permission[key] = value
+            changed = True
+
+    if permission.get("external_directory") != "allow":
+        permission["external_directory"] = "allow"
+        changed = True
+    return changed
+
+
+def normalize_runtime_tools(parsed: dict[str, object]) -> bool:
+    tools = parsed.get("tools")
+    if not isinstance(tools, dict):
+        return False
+
+    desired = runtime_tool_merge_defaults()
+    if tools == desired:
+        return False
+    parsed["tools"] = thaw_json(desired)
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def runtime_permission_defaults() -> Mapping[str, object]:
+    return MappingProxyType(
+        {
+            "edit": "allow",
+            "bash": "allow",
+            "webfetch": "allow",
+            "doom_loop": "allow",
+            "question": "allow",
+            "skill": "allow",
+            "task": "allow",
+            "external_directory": "allow",
+        }
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def runtime_permission_merge_defaults() -> Mapping[str, object]:
+    return MappingProxyType(
+        {
+            "edit": "allow",
+            "bash": "allow",
+            "webfetch": "allow",
+            "doom_loop": "allow",
+            "question": "allow",
+            "skill": "allow",
+            "task": "allow",
+            "external_directory": "allow",
+        }
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def runtime_tool_defaults() -> Mapping[str, object]:
+    return MappingProxyType(
+        {
+            "*": True,
+        }
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def runtime_tool_merge_defaults() -> Mapping[str, object]:
+    return MappingProxyType(
+        {
+            "*": True,
+        }
+    )
+
+
+def shared_runtime_opencode_defaults() -> Mapping[str, object]:
+    return build_shared_runtime_opencode_defaults(primary_agent_doc_tokens())
+
+
+@functools.lru_cache(maxsize=4)
+def build_shared_runtime_opencode_defaults(
+    agent_doc_tokens: tuple[str, ...],
+) -> Mapping[str, object]:
+    """Frozen target-independent `opencode.json` defaults, rebuilt when an agent doc changes.
+
+    `instructions` and `plugin` depend on the target and are filled in by
+    `runtime_opencode_defaults`; the empty entries only fix the key order.
+    """
+    return freeze_json(
+        {
+            "$schema": "https://opencode.ai/config.json",
+            "formatter": False,
+            "lsp": False,
+            "instructions": [],
+            "plugin": [],
+            "default_agent": "plan",
+            "agent": parse_primary_agent_specs(agent_doc_tokens),
+            "permission": runtime_permission_defaults(),
+            "tools": runtime_tool_defaults(),
+            "mcp": {"ck": portable_ck_mcp_entry()},
+            "compaction": {
+                "auto": True,
+                "prune": True,
+                "reserved": 256000,
+            },
+            "experimental": {
+                "disable_paste_summary": True,
+                "continue_loop_on_deny": True,
+                "mcp_timeout": 45000,
+            },
+        }
+    )
+
+
+def runtime_opencode_defaults(
+    opencode_root: str, project_root: Path | None = None
+) -> Mapping[str, object]:
+    defaults = dict(shared_runtime_opencode_defaults())
+    defaults["instructions"] = tuple(runtime_instruction_paths(opencode_root, project_root))
+    defaults["plugin"] = tuple(runtime_plugin_paths(opencode_root, project_root))
+    return MappingProxyType(defaults)
+
+
+def default_runtime_opencode_config(
+    opencode_root: str, project_root: Path | None = None
+) -> dict[str, object]:
+    return thaw_json(runtime_opencode_defaults(opencode_root, project_root))
+
+
+def merge_string_list(target: dict, key: str, values: Sequence[str]) -> bool:
+    existing = target.get(key)
+    if existing is None:
+        target[key] = list(values)
+        return True
+    if not isinstance(existing, list):
+        return False
+
+    changed = False
+    for value in values:
+        if value not in existing:
+            existing.append(value)
+            changed = True
+    return changed
+
+
+def merge_dict_missing(target: dict, key: str, defaults: Mapping[str, object]) -> bool:
+    existing = target.get(key)
+    if existing is None:
+        target[key] = thaw_json(defaults)
+        return True
+    if not isinstance(existing, dict):
+        return False
+
+    changed = False
+    for sub_key, value in defaults.items():
+        if sub_key not in existing:
+            existing[sub_key] = thaw_json(value)
+            changed = True
+    return changed
+
+
+def remove_stale_instruction_globs(
+    existing: list[str], project_root: Path | None
+) -> bool:
+    stale_rules_globs = [
+        ".opencode/rules/**/*.md",
+        "ai-kb/rules/**/*.md",
+        ".cursor/rules/*.md",
+        ".cursor/rules/*.mdc",
+    ]
+    changed = False
+    for stale_rules_glob in stale_rules_globs:
+        if stale_rules_glob not in existing:
+            continue
+        if stale_rules_glob == ".opencode/rules/**/*.md" and project_root is not None:
+            rules_dir = project_root / ".opencode" / "rules"
+            if rules_dir.exists():
+                continue
+        existing[:] = [item for item in existing if item != stale_rules_glob]
+        changed = True
+    return changed
+
+
+def merge_runtime_opencode_config(
+    parsed: dict[str, object], opencode_root: str, project_root: Path | None = None
+) -> tuple[bool, list[str]]:
+    changed = False
+    notes: list[str] = []
+    defaults = runtime_opencode_defaults(opencode_root, project_root)
+    desired_plugins = defaults["plugin"]
+
+    if "formatter" not in parsed:
+        parsed["formatter"] = defaults["formatter"]
+        changed = True
+    if "lsp" not in parsed:
+        parsed["lsp"] = defaults["lsp"]
+        changed = True
+    if "compaction" not in parsed:
+        parsed["compaction"] = thaw_json(defaults["compaction"])
+        changed = True
+
+    instructions = parsed.get("instructions")
+    if instructions is None:
+        parsed["instructions"] = list(defaults["instructions"])
+        changed = True
+    elif isinstance(instructions, list):
+        changed = remove_stale_instruction_globs(instructions, project_root) or changed
+        changed = (
+            merge_string_list(parsed, "instructions", defaults["instructions"])
+            or changed
+        )
+    else:
+        notes.append(
+            "Skipped opencode.json instruction merge; `instructions` is not an array."
+        )
+
+    plugins = parsed.get("plugin")
+    if plugins is None:
+        parsed["plugin"] = list(desired_plugins)
+        changed = True
+    elif isinstance(plugins, list):
+        stale_suffixes = (
+            "/plugins/autonomy-runtime.js",
+            "/plugins/kb-post-turn-analyzer.js",
+        )
+        normalized_plugins = []
+        for value in plugins:
+            string_value = str(value)
+            if string_value in desired_plugins:
+                normalized_plugins.append(string_value)
+                continue
+            if any(string_value.endswith(suffix) for suffix in stale_suffixes):
+                changed = True
+                continue
+            normalized_plugins.append(string_value)
+        if normalized_plugins != plugins:
+            plugins[:] = normalized_plugins
+        changed = merge_string_list(parsed, "plugin", desired_plugins) or changed
+    else:
+        notes.append("Skipped opencode.json plugin merge; `plugin` is not an array.")
+
+    if "default_agent" not in parsed:
+        parsed["default_agent"] = defaults["default_agent"]
+        changed = True
+
+    if merge_dict_missing(parsed, "agent", defaults["agent"]):
+        changed = True
+    if parsed.get("agent") is not None and not isinstance(parsed.get("agent"), dict):
+        notes.append("Skipped opencode.json agent merge; `agent` is not an object.")
+    elif isinstance(parsed.get("agent"), dict):
+        changed = normalize_runtime_agents(parsed, defaults) or changed
+
+    if merge_dict_missing(parsed, "permission", runtime_permission_merge_defaults()):
+        changed = True
+    if parsed.get("permission") is not None and not isinstance(
+        parsed.get("permission"), dict
+    ):
+        notes.append(
+            "Skipped opencode.json permission merge; `permission` is not an object."
+        )
+    elif isinstance(parsed.get("permission"), dict):
+        changed = normalize_runtime_permissions(parsed) or changed
+
+    tools = parsed.get("tools")
+    if tools is None:
+        parsed["tools"] = thaw_json(runtime_tool_merge_defaults())
+        changed = True
+    elif isinstance(tools, dict):
+        for tool_name, enabled in runtime_tool_merge_defaults().items():
+            if tool_name not in tools:
+                tools[tool_name] = enabled
+                changed = True
+        changed = normalize_runtime_tools(parsed) or changed
+    else:
+        notes.append("Skipped opencode.json tools merge; `tools` is not an object.")
+
+    if merge_dict_missing(parsed, "compaction", defaults["compaction"]):
+        changed = True
+    elif parsed.get("compaction") is not None and not isinstance(
+        parsed.get("compaction"), dict
+    ):
+        notes.append("Skipped opencode.json compaction merge; `compaction` is not an object.")
+    else:
+        changed = normalize_runtime_compaction(parsed, defaults) or changed
+
+    if merge_dict_missing(parsed, "mcp", defaults["mcp"]):
+        changed = True
+    elif parsed.get("mcp") is not None and not isinstance(parsed.get("mcp"), dict):
+        notes.append("Skipped opencode.json MCP merge; `mcp` is not an object.")
+    else:
+        mcp = parsed.get("mcp")
+        if isinstance(mcp, dict):
+            desired_ck = portable_ck_mcp_entry()
+            if mcp.get("ck") != desired_ck:
+                mcp["ck"] = desired_ck
+                changed = True
+
+    if merge_dict_missing(parsed, "experimental", defaults["experimental"]):
+        changed = True
+    elif parsed.get("experimental") is not None and not isinstance(
+        parsed.get("experimental"), dict
+    ):
+        notes.append(
+            "Skipped opencode.json experimental merge; `experimental` is not an object."
+        )
+
+    return changed, notes
+
+
+@profiled_phase("json-merge")
+def merge_opencode_json_file(
+    src: Path,
+    dst: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+    project_mode: bool,
+) -> None:
+    """Merge OpenCode `opencode.json` with missing autonomy-runtime defaults."""
+    try:
+        src_text = apply_replacements(src.read_text(encoding="utf-8"), replacements)
+        src_data = json.loads(src_text)
+    except Exception:
+        state.notes.append(
+            f"Could not parse opencode.json for merge; fallback to regular copy: {dst}"
+        )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not isinstance(src_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not dst.exists():
+        write_json_file_with_backup(
+            path=dst,
+            data=src_data,
+            args=args,
+            state=state,
+            stamp=stamp,
+            source_for_plan=src,
+        )
+        return
+
+    try:
+        dst_data = json.loads(dst.read_text(encoding="utf-8"))
+    except Exception:
+        state.notes.append(
+            f"Could not parse opencode.json for merge; fallback to regular copy: {dst}"
+        )
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    if not isinstance(dst_data, dict):
+        copy_file(src, dst, args, state, stamp, replacements, exts, basenames)
+        return
+
+    opencode_root = ".opencode" if project_mode else "~/.config/opencode"
+    changed, notes = merge_runtime_opencode_config(
+        dst_data,
+        opencode_root=opencode_root,
+        project_root=dst.parent if project_mode else None,
+    )
+    state.notes.extend(notes)
+
+    if not changed:
+        return
+
+    if args.preserve_existing:
+        emit("preserve-existing", f"Preserve existing opencode.json: {dst}", path=dst)
+        state.skipped_existing.append(dst)
+        return
+
+    if not args.dry_run:
+        backup_existing_path(dst, state, stamp, args.dry_run)
+        text = json.dumps(dst_data, indent=2) + "\n"
+        dst.write_text(text, encoding="utf-8")
+        record_written_text(state, dst, text)
+    else:
+        emit("merge-json", f"Merge opencode.json: {src} + {dst}", src=src, dst=dst)
+
+    state.overwritten_files += 1
+    state.planned_files.append((src, dst))
+
+
+def ensure_hook_executable_bits(
+    cursor_hooks_root: Path, dry_run: bool, detach_links: bool = False
+) -> None:
+    """Make the Cursor hooks executable; `detach_links` copies hardlinked hooks first.
+
+    Staged hooks are hardlinks to the live files, and a mode change on a shared inode
+    would reach the live tree before the swap.
+    """
+    for hook_name in HOOK_FILE_NAMES:
+        hook_path = cursor_hooks_root / hook_name
+        if not hook_path.exists():
+            continue
+        if dry_run:
+            emit("chmod", f"Set executable bit: {hook_path}", path=hook_path)
+            continue
+        info = hook_path.stat()
+        if info.st_mode & stat.S_IXUSR:
+            continue
+        if detach_links and info.st_nlink > 1:
+            detached = hook_path.with_name(f"{hook_path.name}.detach")
+            shutil.copy2(hook_path, detached)
+            os.replace(detached, hook_path)
+        hook_path.chmod(info.st_mode | stat.S_IXUSR)
+
+
+def default_project_opencode_instructions(project_root: Path) -> list[str]:
+    return runtime_instruction_paths(".opencode", project_root)
+
+
+def default_project_opencode_config(
+    project_root: Path,
+    required_instructions: list[str],
+) -> dict[str, object]:
+    config = default_runtime_opencode_config(".opencode", project_root)
+    config["instructions"] = list(required_instructions)
+    return config
+
+
+@profiled_phase("json-merge")
+def ensure_project_opencode_json(
+    project_root: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+) -> None:
+    config_path = project_root / "opencode.json"
+    required_instructions = default_project_opencode_instructions(project_root)
+
+    planned_config_copy = any(dst == config_path for _, dst in state.planned_files)
+    if not config_path.exists():
+        if args.dry_run and planned_config_copy:
+            state.notes.append(
+                "opencode.json is part of this dry-run install plan; "
+                "instruction merge runs after real file copy."
+            )
+            return
+        generated = default_project_opencode_config(project_root, required_instructions)
+        emit(
+            "write-json",
+            f"Create project opencode.json: {config_path}",
+            path=config_path,
+        )
+        if not args.dry_run:
+            text = json.dumps(generated, indent=2) + "\n"
+            config_path.write_text(text, encoding="utf-8")
+            record_written_text(state, config_path, text)
+        state.created_files += 1
+        state.created_paths.add(config_path)
+        return
+
+    try:
+        parsed = json.loads(config_path.read_text(encoding="utf-8"))
+    except Exception:
+        if args.preserve_existing:
+            state.notes.append(
+                "Skipped opencode.json merge because file is not strict JSON "
+                "(likely JSONC) and preserve-existing is set."
+            )
+            return
+
+        replacement = default_project_opencode_config(
+            project_root, required_instructions
+        )
+        state.notes.append(
+            "Existing opencode.json was not strict JSON; backed it up and replaced "
+            "with a project-compatible config."
+        )
+        write_json_file_with_backup(
+            path=config_path,
+            data=replacement,
+            args=args,
+            state=state,
+            stamp=stamp,
+        )
+        return
+
+    if not isinstance(parsed, dict):
+        if args.preserve_existing:
+            state.notes.append(
+                "Skipped opencode.json merge because root is not a JSON object "
+                "and preserve-existing is set."
+            )
+            return
+
+        replacement = default_project_opencode_config(
+            project_root, required_instructions
+        )
+        state.notes.append(
+            "Existing opencode.json root was not an object; backed it up and replaced "
+            "with a project-compatible config."
+        )
+        write_json_file_with_backup(
+            path=config_path,
+            data=replacement,
+            args=args,
+            state=state,
+            stamp=stamp,
+        )
+        return
+
+    changed, notes = merge_runtime_opencode_config(
+        parsed,
+        opencode_root=".opencode",
+        project_root=project_root,
+    )
+    state.notes.extend(notes)
+
+    if not changed:
+        return
+    if args.preserve_existing:
+        state.notes.append(
+            "Skipped opencode.json merge because preserve-existing is set."
+        )
+        return
+
+    emit("merge-json", f"Merge instructions into: {config_path}", path=config_path)
+    if args.dry_run:
+        return
+    backup_existing_path(config_path, state, stamp, args.dry_run)
+    text = json.dumps(parsed, indent=2) + "\n"
+    config_path.write_text(text, encoding="utf-8")
+    record_written_text(state, config_path, text)
+    state.overwritten_files += 1
+
+
+def global_copy_plan(copied_items: list[str]) -> list[tuple[str, str]]:
+    # OpenCode uses plural subdirectories (`agents/`, `commands/`, `plugins/`) as canonical.
+    # Singular names are supported for backwards compatibility, but we avoid installing both.
+    plan: list[tuple[str, str]] = []
+    for rel in copied_items:
         if rel == ".cursor/cli-config.json":
             continue
-        if rel == "ai-kb":
-            plan.append((rel, rel))
-            plan.append((rel, ".config/opencode/ai-kb"))
+        if rel == "ai-kb":
+            plan.append((rel, rel))
+            plan.append((rel, ".config/opencode/ai-kb"))
+            continue
+        dst = rel
+        if rel == ".config/opencode/agent":
+            dst = ".config/opencode/agents"
+        elif rel == ".config/opencode/command":
+            dst = ".config/opencode/commands"
+        plan.append((rel, dst))
+    return plan
+
+
+def kb_mirror_target(primary: Path, mirror: Path) -> str:
+    return os.path.relpath(primary, mirror.parent)
+
+
+def is_kb_mirror_link(mirror: Path, destination_root: Path) -> bool:
+    if not mirror.is_symlink():
+        return False
+    try:
+        return os.readlink(mirror) == kb_mirror_target(
+            destination_root / "ai-kb", mirror
+        )
+    except OSError:
+        return False
+
+
+def kb_mirror_tree_linked(src: Path, primary: Path, mirror: Path) -> bool:
+    if mirror.is_symlink() or not mirror.is_dir():
+        return False
+    try:
+        return all(
+            os.path.samefile(primary / rel, mirror / rel)
+            for rel in (path.relative_to(src) for path in iter_payload_files(src))
+        )
+    except OSError:
+        return False
+
+
+def link_kb_mirror_tree(
+    src: Path, primary: Path, mirror: Path, state: InstallState
+) -> bool:
+    """Hardlink every payload KB file from primary into mirror; False if any link fails."""
+    linked: list[tuple[Path, str]] = []
+    try:
+        for src_file in iter_payload_files(src):
+            rel = src_file.relative_to(src)
+            primary_file = primary / rel
+            digest = ledger_recorded_digest(state.ledger, primary_file)
+            if digest is None:
+                raise OSError(f"not installed by this run: {primary_file}")
+            mirror_file = mirror / rel
+            mirror_file.parent.mkdir(parents=True, exist_ok=True)
+            os.link(primary_file, mirror_file)
+            linked.append((mirror_file, digest))
+    except OSError:
+        shutil.rmtree(mirror, ignore_errors=True)
+        return False
+    for mirror_file, digest in linked:
+        record_ledger_file(state.ledger, mirror_file, digest)
+    state.install_modes["hardlink"] = state.install_modes.get("hardlink", 0) + len(linked)
+    return True
+
+
+@profiled_phase("kb-mirror")
+def install_kb_mirror(
+    src: Path,
+    destination_root: Path,
+    mirror: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    """Install the OpenCode KB mirror as a link to the primary `ai-kb/` install.
+
+    Both locations render with the same rules, so the mirror is a relative symlink to
+    `<home>/ai-kb`. Where symlinks are unavailable it becomes a tree of hardlinks to the
+    primary files, and only when that fails too is the KB copied a second time.
+    """
+    primary = destination_root / "ai-kb"
+    target = kb_mirror_target(primary, mirror)
+    if not src.is_dir() or not primary.is_dir() or args.preserve_existing:
+        copy_entry(src, mirror, args, state, stamp, replacements, exts, basenames)
+        return
+    if is_kb_mirror_link(mirror, destination_root) or kb_mirror_tree_linked(
+        src, primary, mirror
+    ):
+        return
+
+    if managed_tree_unchanged(mirror, state.ledger):
+        emit(
+            "replace-managed-dir",
+            f"Replace managed dir: {mirror} -> {target}",
+            path=mirror,
+            target=target,
+        )
+        if not args.dry_run:
+            shutil.rmtree(mirror)
+            forget_stat(state.stat_cache, mirror)
+    elif mirror.exists() or mirror.is_symlink():
+        backup_existing_path(mirror, state, stamp, args.dry_run)
+
+    emit("link", f"Link KB mirror: {mirror} -> {target}", path=mirror, target=target)
+    if args.dry_run:
+        return
+    if state.ledger is not None:
+        prefix = f"{ledger_key(state.ledger, mirror)}/"
+        for key in [key for key in state.ledger.entries if key.startswith(prefix)]:
+            del state.ledger.entries[key]
+    mirror.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.symlink(target, mirror, target_is_directory=True)
+        forget_stat(state.stat_cache, mirror)
+        state.created_files += 1
+        return
+    except OSError as exc:
+        state.notes.append(f"Could not symlink KB mirror ({exc}); using hardlinks.")
+    if link_kb_mirror_tree(src, primary, mirror, state):
+        return
+    state.notes.append("Could not hardlink KB mirror; copying it instead.")
+    copy_entry(src, mirror, args, state, stamp, replacements, exts, basenames)
+
+
+def project_copy_plan(include_machine_config: bool) -> list[tuple[str, str]]:
+    plan = [
+        ("ai-kb", "ai-kb"),
+        (".cursor/commands", ".cursor/commands"),
+        (".cursor/rules", ".cursor/rules"),
+        (".cursor/hooks", ".cursor/hooks"),
+        (".cursor/mcp.json", ".cursor/mcp.json"),
+        (".cursor/hooks.json", ".cursor/hooks.json"),
+        (".config/opencode/AGENTS.md", ".opencode/AGENTS.md"),
+        (".config/opencode/prime-directive.md", ".opencode/prime-directive.md"),
+        (".config/opencode/agent", ".opencode/agents"),
+        (".config/opencode/command", ".opencode/commands"),
+        (".config/opencode/skills", ".opencode/skills"),
+        (".config/opencode/plugins", ".opencode/plugins"),
+        (".config/opencode/runtime", ".opencode/runtime"),
+        (".config/opencode/overlays", ".opencode/overlays"),
+        (".config/opencode/scripts", ".opencode/scripts"),
+        (".config/opencode/memory/global", ".opencode/memory/global"),
+        (".config/opencode/memory/templates/project/.opencode", ".opencode"),
+    ]
+    if include_machine_config:
+        plan.extend(
+            [
+                (".config/opencode/dcp.jsonc", ".opencode/dcp.jsonc"),
+            ]
+        )
+    return plan
+
+
+def iter_payload_files(root: Path) -> list[Path]:
+    files: list[Path] = []
+    paths = root.iter_files() if isinstance(root, ArchivePath) else root.rglob("*")
+    for path in sorted(paths):
+        if not path.is_file():
+            continue
+        if path.name in {".DS_Store"}:
+            continue
+        files.append(path)
+    return files
+
+
+def collect_uninstall_targets(
+    payload: Path,
+    destination_root: Path,
+    plan: list[tuple[str, str]],
+    project_mode: bool,
+) -> tuple[list[Path], set[Path]]:
+    file_targets: set[Path] = set()
+    dir_targets: set[Path] = set()
+
+    for src_rel, dst_rel in plan:
+        src = payload / src_rel
+        dst = destination_root / dst_rel
+
+        if src.is_dir():
+            dir_targets.add(dst)
+            if is_store_link(dst) or is_kb_mirror_link(dst, destination_root):
+                # Remove the link itself, never the store or KB it points at.
+                file_targets.add(dst)
+                continue
+            for src_file in iter_payload_files(src):
+                rel = src_file.relative_to(src)
+                file_targets.add(dst / rel)
+            continue
+
+        # Include explicit file targets even if source is currently missing from payload.
+        file_targets.add(dst)
+        dir_targets.add(dst.parent)
+
+    file_targets.update(bundle_state_targets(destination_root, project_mode))
+
+    # Project installs always ensure/merge repo-root opencode.json.
+    if project_mode:
+        file_targets.add(destination_root / "opencode.json")
+        file_targets.add(destination_root / ".gitignore")
+        dir_targets.add(destination_root)
+
+    return sorted(file_targets), dir_targets
+
+
+def bundle_state_targets(destination_root: Path, project_mode: bool) -> list[Path]:
+    # The install ledger lives next to the managed roots in both modes.
+    targets = [ledger_path(destination_root), fingerprint_path(destination_root)]
+    if project_mode:
+        targets.append(store_current_link(destination_root))
+        targets.append(generations_path(destination_root))
+    return targets
+
+
+def ledger_uninstall_targets(
+    ledger: InstallLedger,
+    payload: Path,
+    destination_root: Path,
+    plan: list[tuple[str, str]],
+    project_mode: bool,
+) -> tuple[list[Path], set[Path]]:
+    """Uninstall targets from the install ledger: exactly the files earlier installs wrote.
+
+    Unlike `collect_uninstall_targets` this also finds files from older bundle versions
+    and never walks the payload tree; the plan only contributes its top-level store and
+    KB-mirror links and the directories whose whole-directory backups can be restored.
+    """
+    links: set[Path] = set()
+    dir_targets: set[Path] = set()
+    for src_rel, dst_rel in plan:
+        dst = destination_root / dst_rel
+        if (payload / src_rel).is_dir():
+            dir_targets.add(dst)
+            if is_store_link(dst) or is_kb_mirror_link(dst, destination_root):
+                links.add(dst)
+        else:
+            dir_targets.add(dst.parent)
+
+    file_targets = set(links)
+    for key in ledger.entries:
+        target = destination_root / key
+        # Never reach through a link into the shared store or the primary KB.
+        if not any(target.is_relative_to(link) for link in links):
+            file_targets.add(target)
+    file_targets.update(bundle_state_targets(destination_root, project_mode))
+    if project_mode:
+        dir_targets.add(destination_root)
+    return sorted(file_targets), dir_targets
+
+
+def ledger_file_modified(ledger: InstallLedger, path: Path) -> bool:
+    """True when path is a ledger file whose content no longer matches its digest."""
+    key = ledger_key(ledger, path)
+    entry = ledger.entries.get(key) if key is not None else None
+    if entry is None or not os.path.lexists(path):
+        return False
+    if ledger_recorded_digest(ledger, path) is not None:
+        return False
+    if path.is_symlink() or not path.is_file():
+        return True
+    try:
+        return file_digest(path) != entry.get("sha256")
+    except OSError:
+        return True
+
+
+def managed_root_targets(destination_root: Path, project_mode: bool) -> list[Path]:
+    if project_mode:
+        roots = [
+            destination_root / "ai-kb",
+            destination_root / ".cursor",
+            destination_root / ".opencode",
+            destination_root / "opencode.json",
+            destination_root / BUNDLE_STATE_DIR,
+        ]
+    else:
+        roots = [
+            destination_root / "ai-kb",
+            destination_root / ".cursor",
+            destination_root / ".config" / "opencode",
+            destination_root / BUNDLE_STATE_DIR,
+        ]
+
+    deduped: list[Path] = []
+    seen: set[Path] = set()
+    for root in roots:
+        if root in seen:
+            continue
+        seen.add(root)
+        deduped.append(root)
+    return deduped
+
+
+def latest_backup_for_target(target: Path, index: BackupIndex) -> Path | None:
+    scan_backup_parent(index, target.parent)
+    best = index.latest[target.parent].get(target.name)
+    if best is None:
+        return None
+    return best[-1]
+
+
+def newest_backup_for_target(
+    target: Path,
+    destination_root: Path,
+    stored: dict[str, StoredBackup],
+    index: BackupIndex,
+) -> Path | StoredBackup | None:
+    """Pick the newer of target's sibling `.bak.*` backup and its backup-store record."""
+    sibling = latest_backup_for_target(target, index)
+    try:
+        stored_backup = stored.get(target.relative_to(destination_root).as_posix())
+    except ValueError:
+        stored_backup = None
+    if stored_backup is None:
+        return sibling
+    if sibling is not None:
+        match = re.search(r"\.bak\.(\d{8}-\d{6})", sibling.name)
+        if match and match.group(1) > stored_backup.stamp:
+            return sibling
+    return stored_backup
+
+
+def delete_path(path: Path) -> str | None:
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    except OSError as exc:
+        return f"Could not remove {path}: {exc}"
+    return None
+
+
+def remove_paths(
+    paths: list[Path], dry_run: bool, state: UninstallState, jobs: int
+) -> None:
+    """Remove paths on `jobs` threads; output and state stay in the given order."""
+    errors = [None] * len(paths) if dry_run else run_jobs(delete_path, paths, jobs)
+    start_progress("Remove", len(paths))
+    for path, error in zip(paths, errors):
+        emit("remove", f"Remove: {path}", file=True, path=path)
+        state.removed_paths.append(path)
+        if error:
+            state.notes.append(error)
+    finish_progress()
+
+
+def remove_path(path: Path, dry_run: bool, state: UninstallState) -> None:
+    emit("remove", f"Remove: {path}", file=True, path=path)
+    state.removed_paths.append(path)
+    if dry_run:
+        return
+
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def restore_backup(
+    target: Path, backup: Path, dry_run: bool, state: UninstallState
+) -> None:
+    emit(
+        "restore-backup",
+        f"Restore backup: {backup} -> {target}",
+        backup=backup,
+        path=target,
+    )
+    state.restored_backups.append((target, backup))
+    if dry_run:
+        return
+
+    if target.exists() or target.is_symlink():
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        else:
+            target.unlink()
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(backup), str(target))
+
+
+def restore_stored_backup(
+    target: Path,
+    backup: StoredBackup,
+    destination_root: Path,
+    dry_run: bool,
+    state: UninstallState,
+) -> None:
+    store_root = backup_store_dir(destination_root)
+    index = store_root / "runs" / f"{backup.run_id}.jsonl"
+    emit(
+        "restore-backup",
+        f"Restore backup: {index} -> {target}",
+        backup=index,
+        path=target,
+    )
+    state.restored_backups.append((target, index))
+    state.restored_from_store.append(backup)
+    if dry_run:
+        return
+
+    if target.exists() or target.is_symlink():
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        else:
+            target.unlink()
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    restore_backup_record(store_root, target, backup.record)
+
+
+def restore_newest_backup(
+    target: Path,
+    backup: Path | StoredBackup,
+    destination_root: Path,
+    dry_run: bool,
+    state: UninstallState,
+) -> None:
+    if isinstance(backup, StoredBackup):
+        restore_stored_backup(target, backup, destination_root, dry_run, state)
+    else:
+        restore_backup(target, backup, dry_run, state)
+
+
+def prune_empty_directories(
+    destination_root: Path,
+    file_targets: list[Path],
+    dir_targets: set[Path],
+    dry_run: bool,
+    state: UninstallState,
+) -> None:
+    candidates: set[Path] = set()
+
+    # Collect each ancestor once: stop climbing at the first one already collected.
+    for start in [*(path.parent for path in file_targets), *dir_targets]:
+        current = start
+        while (
+            current not in candidates
+            and current != destination_root
+            and current != current.parent
+        ):
+            candidates.add(current)
+            current = current.parent
+
+    for directory in sorted(candidates, key=lambda path: len(path.parts), reverse=True):
+        # A missing or non-directory candidate fails scandir; no separate stat needed.
+        try:
+            with os.scandir(directory) as entries:
+                if next(entries, None) is not None:
+                    continue
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except OSError as exc:
+            state.notes.append(f"Could not inspect directory {directory}: {exc}")
+            continue
+        remove_path(directory, dry_run, state)
+
+
+@profiled_phase("uninstall")
+def uninstall_entries(
+    payload: Path,
+    destination_root: Path,
+    plan: list[tuple[str, str]],
+    args: argparse.Namespace,
+    state: UninstallState,
+    project_mode: bool,
+) -> None:
+    ledger = load_install_ledger(destination_root)
+    if ledger.entries:
+        file_targets, dir_targets = ledger_uninstall_targets(
+            ledger, payload, destination_root, plan, project_mode
+        )
+    else:
+        file_targets, dir_targets = collect_uninstall_targets(
+            payload=payload,
+            destination_root=destination_root,
+            plan=plan,
+            project_mode=project_mode,
+        )
+
+    stored = latest_stored_backups(destination_root)
+    restored_dir_targets: set[Path] = set()
+    for directory in sorted(dir_targets):
+        backup = newest_backup_for_target(
+            directory, destination_root, stored, state.backup_index
+        )
+        if backup is None:
+            continue
+        state.planned_paths.append(directory)
+        restore_newest_backup(directory, backup, destination_root, args.dry_run, state)
+        restored_dir_targets.add(directory)
+
+    removals: list[Path] = []
+    for target in file_targets:
+        if any(target.is_relative_to(directory) for directory in restored_dir_targets):
+            continue
+        state.planned_paths.append(target)
+        if ledger_file_modified(ledger, target):
+            emit("keep-modified", f"Keep modified: {target}", path=target)
+            state.modified_paths.append(target)
+            continue
+        backup = newest_backup_for_target(
+            target, destination_root, stored, state.backup_index
+        )
+        if backup is not None:
+            restore_newest_backup(target, backup, destination_root, args.dry_run, state)
+            continue
+
+        if target.exists() or target.is_symlink():
+            removals.append(target)
+            continue
+
+        state.missing_paths.append(target)
+    remove_paths(removals, args.dry_run, state, args.jobs)
+
+    prune_empty_directories(
+        destination_root=destination_root,
+        file_targets=file_targets,
+        dir_targets=dir_targets,
+        dry_run=args.dry_run,
+        state=state,
+    )
+    if not args.dry_run:
+        forget_stored_backups(destination_root, state.restored_from_store)
+
+
+@profiled_phase("uninstall")
+def uninstall_all_roots(
+    destination_root: Path,
+    args: argparse.Namespace,
+    state: UninstallState,
+    project_mode: bool,
+) -> None:
+    roots = managed_root_targets(
+        destination_root=destination_root, project_mode=project_mode
+    )
+    state.notes.append(
+        "Force cleanup enabled: managed roots are removed recursively when no backup exists."
+    )
+
+    for target in roots:
+        state.planned_paths.append(target)
+        backup = latest_backup_for_target(target, state.backup_index)
+        if backup is not None:
+            restore_backup(target, backup, args.dry_run, state)
+            continue
+
+        if target.exists() or target.is_symlink():
+            remove_path(target, args.dry_run, state)
+            continue
+
+        state.missing_paths.append(target)
+
+
+@profiled_phase("migrate")
+def migrate_opencode_compat_dirs(
+    opencode_root: Path,
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+) -> None:
+    """Migrate singular OpenCode subdirs to canonical plural names.
+
+    OpenCode uses plural subdirectories (`agents/`, `commands/`, `plugins/`) as canonical.
+    Singular names (e.g., `agent/`) are supported for backwards compatibility, but when both
+    exist OpenCode may load both which causes duplicate commands/agents/plugins.
+    """
+
+    root_info = cached_stat(state.stat_cache, opencode_root)
+    if root_info is None or not stat.S_ISDIR(root_info.st_mode):
+        return
+    if args.preserve_existing:
+        state.notes.append(
+            f"Skipped OpenCode compat directory migration because preserve-existing is set: {opencode_root}"
+        )
+        return
+
+    compat_pairs = [
+        ("agent", "agents"),
+        ("command", "commands"),
+        ("plugin", "plugins"),
+    ]
+
+    for singular, plural in compat_pairs:
+        singular_dir = opencode_root / singular
+        singular_info = cached_stat(state.stat_cache, singular_dir)
+        if singular_info is None or not stat.S_ISDIR(singular_info.st_mode):
+            continue
+        plural_dir = opencode_root / plural
+        if is_store_link(plural_dir):
+            state.notes.append(
+                f"Skipped OpenCode compat migration into store-linked directory: {plural_dir}"
+            )
+            continue
+
+        if not plural_dir.exists():
+            emit(
+                "migrate",
+                f"Migrate OpenCode dir: {singular_dir} -> {plural_dir}",
+                src=singular_dir,
+                dst=plural_dir,
+            )
+            if args.dry_run:
+                continue
+            plural_dir.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(singular_dir), str(plural_dir))
+            continue
+
+        if not plural_dir.is_dir():
+            state.notes.append(
+                f"Skipped OpenCode compat migration; destination is not a directory: {plural_dir}"
+            )
+            continue
+
+        for src_path in sorted(singular_dir.rglob("*")):
+            if src_path.is_dir():
+                continue
+            rel = src_path.relative_to(singular_dir)
+            dst_path = plural_dir / rel
+
+            if dst_path.exists() or dst_path.is_symlink():
+                if files_equal(src_path, dst_path):
+                    emit(
+                        "migrate-remove-duplicate",
+                        f"Remove duplicate OpenCode compat file: {src_path}",
+                        path=src_path,
+                    )
+                    if args.dry_run:
+                        continue
+                    try:
+                        src_path.unlink()
+                    except Exception as exc:
+                        state.notes.append(
+                            f"Could not remove duplicate OpenCode compat file {src_path}: {exc}"
+                        )
+                    continue
+
+                conflict_path = dst_path.with_name(f"{dst_path.name}.compat.{stamp}")
+                emit(
+                    "migrate-conflict",
+                    f"Preserve OpenCode compat conflict: {src_path} -> {conflict_path}",
+                    src=src_path,
+                    dst=conflict_path,
+                )
+                if args.dry_run:
+                    continue
+                conflict_path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    shutil.move(str(src_path), str(conflict_path))
+                except Exception as exc:
+                    state.notes.append(
+                        f"Could not move OpenCode compat conflict file {src_path}: {exc}"
+                    )
+                continue
+
+            emit(
+                "migrate",
+                f"Move OpenCode compat file: {src_path} -> {dst_path}",
+                src=src_path,
+                dst=dst_path,
+            )
+            if args.dry_run:
+                continue
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                shutil.move(str(src_path), str(dst_path))
+            except Exception as exc:
+                state.notes.append(
+                    f"Could not move OpenCode compat file {src_path}: {exc}"
+                )
+
+        if args.dry_run:
+            emit(
+                "migrate-prune",
+                f"Prune empty OpenCode compat dir: {singular_dir}",
+                path=singular_dir,
+            )
+            continue
+
+        for path in sorted(singular_dir.rglob("*"), reverse=True):
+            if path.is_dir():
+                try:
+                    path.rmdir()
+                except Exception:
+                    pass
+        try:
+            singular_dir.rmdir()
+            emit(
+                "migrate-prune",
+                f"Removed OpenCode compat dir: {singular_dir}",
+                path=singular_dir,
+            )
+        except Exception:
+            state.notes.append(
+                f"OpenCode compat dir not empty; left in place: {singular_dir}"
+            )
+
+
+def global_replacements(source_home: str, target_home: str) -> list[tuple[str, str]]:
+    opencode_kb = f"{target_home}/.config/opencode/ai-kb"
+    return [
+        ("__HOME__/ai-kb", opencode_kb),
+        (f"{source_home}/ai-kb", opencode_kb),
+        ("~/.config/opencode", f"{target_home}/.config/opencode"),
+        ("~/.cursor", f"{target_home}/.cursor"),
+        ("~/ai-kb", opencode_kb),
+        ("__HOME__", target_home),
+        (source_home, target_home),
+    ]
+
+
+def project_replacements(
+    source_home: str, project_root: Path, current_home: Path
+) -> list[tuple[str, str]]:
+    # Keep project installs portable across developer machines:
+    # use repo-relative paths instead of baking absolute `/Users/...` paths into files.
+    project_kb = "ai-kb"
+    project_opencode = ".opencode"
+    project_cursor = ".cursor"
+    return [
+        ("__HOME__/ai-kb", project_kb),
+        ("__HOME__", str(current_home)),
+        (f"{source_home}/.config/opencode/ai-kb", project_kb),
+        ("~/.config/opencode/ai-kb", project_kb),
+        (f"{source_home}/ai-kb", project_kb),
+        ("~/ai-kb", project_kb),
+        (f"{source_home}/.config/opencode", project_opencode),
+        ("~/.config/opencode", project_opencode),
+        (f"{source_home}/.cursor", project_cursor),
+        ("~/.cursor", project_cursor),
+        (source_home, str(current_home)),
+    ]
+
+
+@profiled_phase("copy")
+def install_entries(
+    payload: Path,
+    destination_root: Path,
+    plan: list[tuple[str, str]],
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    project_mode: bool,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    if progress_wanted():
+        total = (
+            len(state.changed_sources)
+            if state.changed_sources is not None
+            else count_payload_files(payload, plan)
+        )
+        start_progress("Install", total)
+    try:
+        install_plan_entries(
+            payload,
+            destination_root,
+            plan,
+            args,
+            state,
+            stamp,
+            project_mode,
+            replacements,
+            exts,
+            basenames,
+        )
+    finally:
+        finish_progress()
+
+
+def count_payload_files(payload: Path, plan: list[tuple[str, str]]) -> int:
+    total = 0
+    for src_rel, _ in plan:
+        src = payload / src_rel
+        if src.is_dir():
+            total += len(iter_payload_files(src))
+        elif src.exists():
+            total += 1
+    return total
+
+
+def install_plan_entries(
+    payload: Path,
+    destination_root: Path,
+    plan: list[tuple[str, str]],
+    args: argparse.Namespace,
+    state: InstallState,
+    stamp: str,
+    project_mode: bool,
+    replacements: list[tuple[str, str]],
+    exts: set[str],
+    basenames: set[str],
+) -> None:
+    for src_rel, dst_rel in plan:
+        src = payload / src_rel
+        dst = destination_root / dst_rel
+        if src_rel == ".cursor/mcp.json":
+            if not src.exists():
+                state.missing_sources.append(src)
+                emit("missing-source", f"Missing source: {src}", path=src)
+                continue
+            merge_cursor_mcp_file(
+                src, dst, args, state, stamp, replacements, exts, basenames
+            )
+            continue
+        if project_mode and src_rel == ".cursor/hooks.json":
+            if not src.exists():
+                state.missing_sources.append(src)
+                emit("missing-source", f"Missing source: {src}", path=src)
+                continue
+            merge_cursor_hooks_file(
+                src, dst, args, state, stamp, replacements, exts, basenames
+            )
             continue
-        dst = rel
-        if rel == ".config/opencode/agent":
-            dst = ".config/opencode/agents"
-        elif rel == ".config/opencode/command":
-            dst = ".config/opencode/commands"
-        plan.append((rel, dst))
-    return plan
+        if src_rel == ".config/opencode/opencode.json":
+            if not src.exists():
+                state.missing_sources.append(src)
+                emit("missing-source", f"Missing source: {src}", path=src)
+                continue
+            merge_opencode_json_file(
+                src,
+                dst,
+                args,
+                state,
+                stamp,
+                replacements,
+                exts,
+                basenames,
+                project_mode,
+            )
+            continue
+        if (
+            project_mode
+            and src_rel == ".config/opencode/memory/templates/project/.opencode"
+        ):
+            scaffold_project_runtime_state(
+                payload,
+                destination_root,
+                args,
+                state,
+                replacements,
+                exts,
+                basenames,
+            )
+            continue
+        if not project_mode and dst_rel == GLOBAL_KB_MIRROR:
+            install_kb_mirror(
+                src,
+                destination_root,
+                dst,
+                args,
+                state,
+                stamp,
+                replacements,
+                exts,
+                basenames,
+            )
+            continue
+        if is_store_link(dst):
+            # Leaving store mode: install a private copy instead of writing into
+            # the shared store through the link.
+            emit("unlink-store-entry", f"Unlink store entry: {dst}", path=dst)
+            if args.dry_run:
+                continue
+            dst.unlink()
+            forget_stat(state.stat_cache, dst)
+        copy_entry(src, dst, args, state, stamp, replacements, exts, basenames)
 
 
-def project_copy_plan(include_machine_config: bool) -> list[tuple[str, str]]:
-    plan = [
-        ("ai-kb", "ai-kb"),
-        (".cursor/commands", ".cursor/commands"),
-        (".cursor/rules", ".cursor/rules"),
-        (".cursor/hooks", ".cursor/hooks"),
-        (".cursor/mcp.json", ".cursor/mcp.json"),
-        (".cursor/hooks.json", ".cursor/hooks.json"),
-        (".config/opencode/AGENTS.md", ".opencode/AGENTS.md"),
-        (".config/opencode/prime-directive.md", ".opencode/prime-directive.md"),
-        (".config/opencode/agent", ".opencode/agents"),
-        (".config/opencode/command", ".opencode/commands"),
-        (".config/opencode/skills", ".opencode/skills"),
-        (".config/opencode/plugins", ".opencode/plugins"),
-        (".config/opencode/runtime", ".opencode/runtime"),
-        (".config/opencode/overlays", ".opencode/overlays"),
-        (".config/opencode/scripts", ".opencode/scripts"),
-        (".config/opencode/memory/global", ".opencode/memory/global"),
-        (".config/opencode/memory/templates/project/.opencode", ".opencode"),
-    ]
-    if include_machine_config:
-        plan.extend(
-            [
-                (".config/opencode/dcp.jsonc", ".opencode/dcp.jsonc"),
-            ]
+def print_summary(
+    state: InstallState,
+    mode: str,
+    target: Path,
+    dry_run: bool,
+    missing_optional: list[str],
+) -> None:
+    record_event(
+        "summary",
+        mode=mode,
+        dry_run=dry_run,
+        created_files=state.created_files,
+        overwritten_files=state.overwritten_files,
+        backups=len(state.backups),
+        skipped_existing=len(state.skipped_existing),
+        text_files_scanned=state.scanned_text_files,
+        files_rewritten=state.rewritten_text_files,
+        install_modes=state.install_modes,
+        missing_sources=len(state.missing_sources),
+        notes=state.notes,
+    )
+    print("Done")
+    print("Mode:", mode)
+    print("Target:", target)
+    print("Dry run:", "yes" if dry_run else "no")
+    print("Created files:", state.created_files)
+    print("Overwritten files:", state.overwritten_files)
+    print("Backups created:", len(state.backups))
+    print("Skipped existing:", len(state.skipped_existing))
+    print("Text files scanned:", state.scanned_text_files)
+    print("Files rewritten:", state.rewritten_text_files)
+    if state.install_modes:
+        print(
+            "Install modes:",
+            ", ".join(
+                f"{mode}={count}" for mode, count in sorted(state.install_modes.items())
+            ),
+        )
+    if state.missing_sources:
+        print("Missing sources:", len(state.missing_sources))
+        for src in state.missing_sources[:10]:
+            print(" -", src)
+    if state.notes:
+        print("Notes:")
+        for note in state.notes:
+            print(" -", note)
+    if missing_optional:
+        print("Optional tools missing:", ", ".join(missing_optional))
+
+
+def print_uninstall_summary(
+    state: UninstallState,
+    mode: str,
+    target: Path,
+    dry_run: bool,
+) -> None:
+    record_event(
+        "summary",
+        mode=mode,
+        dry_run=dry_run,
+        uninstall=True,
+        managed_paths=len(state.planned_paths),
+        removed_paths=len(state.removed_paths),
+        backups_restored=len(state.restored_backups),
+        missing_managed_paths=len(state.missing_paths),
+        modified_paths_kept=len(state.modified_paths),
+        notes=state.notes,
+    )
+    print("Done")
+    print("Mode:", mode)
+    print("Target:", target)
+    print("Dry run:", "yes" if dry_run else "no")
+    print("Managed paths:", len(state.planned_paths))
+    print("Removed paths:", len(state.removed_paths))
+    print("Backups restored:", len(state.restored_backups))
+    print("Missing managed paths:", len(state.missing_paths))
+    if state.modified_paths:
+        print("Modified paths kept:", len(state.modified_paths))
+        for path in state.modified_paths[:10]:
+            print(" -", path)
+    if state.notes:
+        print("Notes:")
+        for note in state.notes:
+            print(" -", note)
+
+
+def profiling_requested(args: argparse.Namespace) -> bool:
+    return bool(args.profile or args.metrics_json)
+
+
+def metrics_report(
+    metrics: InstallMetrics,
+    mode: str,
+    target: Path,
+    exit_code: int,
+    state: InstallState,
+) -> dict[str, object]:
+    return {
+        "mode": mode,
+        "target": str(target),
+        "exit_code": exit_code,
+        "seconds": round(sum(metrics.phases.values()), 6),
+        "phases": {
+            name: round(seconds, 6) for name, seconds in sorted(metrics.phases.items())
+        },
+        "counters": dict(sorted(metrics.counters.items())),
+        "syscalls": dict(metrics.syscalls),
+        "summary": {
+            "created_files": state.created_files,
+            "overwritten_files": state.overwritten_files,
+            "backups": len(state.backups),
+            "up_to_date": state.up_to_date,
+        },
+    }
+
+
+def merge_metric_reports(reports: list[dict[str, object]]) -> dict[str, object]:
+    """Sum the phases, counters, and syscalls of per-target reports."""
+    totals: dict[str, object] = {"targets": len(reports), "seconds": 0.0}
+    for key in ["phases", "counters", "syscalls"]:
+        merged: dict[str, float] = {}
+        for report in reports:
+            for name, value in report[key].items():
+                merged[name] = merged.get(name, 0) + value
+        totals[key] = {
+            name: round(value, 6) if isinstance(value, float) else value
+            for name, value in sorted(merged.items())
+        }
+    totals["seconds"] = round(sum(report["seconds"] for report in reports), 6)
+    return totals
+
+
+def print_profile(totals: dict[str, object]) -> None:
+    phases: dict[str, float] = totals["phases"]
+    seconds = totals["seconds"] or 0.0
+    print("Profile:")
+    width = max([len("total")] + [len(name) for name in phases])
+    for name, value in sorted(phases.items(), key=lambda item: item[1], reverse=True):
+        share = 100 * value / seconds if seconds else 0.0
+        print(f"  {name:<{width}}  {value:>8.3f}s  {share:>5.1f}%")
+    print(f"  {'total':<{width}}  {seconds:>8.3f}s")
+    for name, value in totals["counters"].items():
+        print(f"{name.replace('_', ' ').capitalize()}: {value}")
+    if totals["syscalls"]:
+        print(
+            "File operations:",
+            ", ".join(f"{name}={count}" for name, count in totals["syscalls"].items()),
+        )
+
+
+def finish_profile_output(
+    args: argparse.Namespace, reports: list[dict[str, object]], wall_seconds: float
+) -> None:
+    totals = merge_metric_reports(reports)
+    if args.profile:
+        print_profile(totals)
+    if not args.metrics_json:
+        return
+    path = Path(args.metrics_json).expanduser()
+    payload = {
+        "version": METRICS_VERSION,
+        "wall_seconds": round(wall_seconds, 6),
+        "targets": reports,
+        "totals": totals,
+    }
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(path, payload)
+    except OSError as exc:
+        print(f"Could not write metrics JSON: {exc}", file=sys.stderr)
+        return
+    print("Metrics JSON:", path)
+
+
+@dataclass
+class StagedInstall:
+    """A staging copy of the managed roots that an install writes into before going live.
+
+    `units` are the swappable roots relative to the target: whole top-level roots such
+    as `ai-kb` and `.opencode`, and the individual children of `.cursor/` and
+    `.config/opencode/`, which also hold files the bundle does not manage.
+    `stranded` lists previous roots a failed rollback could not move back; they stay
+    under `<stage>/.replaced/`.
+    """
+
+    live_root: Path
+    stage_root: Path
+    units: list[str]
+    stranded: list[Path] = field(default_factory=list)
+
+
+def staged_unit(dst_rel: str) -> str:
+    """Return the swappable root that holds a target-relative path."""
+    parts = PurePosixPath(dst_rel).parts
+    if parts[0] == ".cursor":
+        return "/".join(parts[:2])
+    if parts[:2] == (".config", "opencode"):
+        return "/".join(parts[:3])
+    return parts[0]
+
+
+def staged_units(
+    destination_root: Path, plan: list[tuple[str, str]], project_mode: bool
+) -> list[str]:
+    units: list[str] = []
+    for _, dst_rel in plan:
+        unit = staged_unit(dst_rel)
+        if unit not in units:
+            units.append(unit)
+    if project_mode:
+        # Written by the runtime scaffold next to `.opencode/`.
+        units.append(".gitignore")
+    else:
+        # Singular OpenCode dirs the compat migration may fold into their plural names.
+        for singular in ("agent", "command", "plugin"):
+            unit = f".config/opencode/{singular}"
+            if unit not in units and os.path.lexists(destination_root / unit):
+                units.append(unit)
+    return units
+
+
+def stage_link_or_copy(src: str, dst: str) -> None:
+    # Installer writes always move the old file aside before writing a new one, so a
+    # staged hardlink never lets a write reach the live file.
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def clone_into_stage(live: Path, staged: Path) -> None:
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    if live.is_symlink():
+        os.symlink(os.readlink(live), staged, target_is_directory=live.is_dir())
+    elif live.is_dir():
+        shutil.copytree(live, staged, symlinks=True, copy_function=stage_link_or_copy)
+    elif live.exists():
+        stage_link_or_copy(str(live), str(staged))
+
+
+def restore_replaced_roots(stage: Path, destination_root: Path) -> None:
+    """Move back roots an interrupted swap left only in `<stage>/.replaced/`.
+
+    A previous root whose live path is missing was moved aside but never replaced, so
+    it goes back into place. One whose live path exists was already swapped out and is
+    discarded with the stage.
+    """
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        for name in sorted(os.listdir(stage / ".replaced" / rel_dir)):
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            old = stage / ".replaced" / rel
+            if rel in STAGED_UNIT_PARENTS or staged_unit(rel) != rel:
+                if old.is_dir() and not old.is_symlink():
+                    pending.append(rel)
+                continue
+            live = destination_root / rel
+            if os.path.lexists(live):
+                continue
+            live.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(old, live)
+            emit(
+                "stage-restore",
+                f"Restore root from interrupted swap: {live}",
+                path=live,
+            )
+
+
+def discard_stale_stages(destination_root: Path) -> None:
+    state_dir = destination_root / BUNDLE_STATE_DIR
+    if not state_dir.is_dir():
+        return
+    for leftover in state_dir.glob(f"{STAGE_DIR_PREFIX}*"):
+        if (leftover / ".replaced").is_dir():
+            try:
+                restore_replaced_roots(leftover, destination_root)
+            except OSError as exc:
+                print(
+                    f"Warning: kept interrupted staging dir {leftover}; could not restore "
+                    f"the roots in {leftover / '.replaced'}: {exc}",
+                    file=sys.stderr,
+                )
+                continue
+        emit(
+            "stage-discard",
+            f"Discard interrupted staging dir: {leftover}",
+            path=leftover,
         )
-    return plan
+        shutil.rmtree(leftover, ignore_errors=True)
 
 
-def iter_payload_files(root: Path) -> list[Path]:
-    files: list[Path] = []
-    for path in sorted(root.rglob("*")):
-        if not path.is_file():
+def prepare_staged_install(
+    destination_root: Path, plan: list[tuple[str, str]], project_mode: bool
+) -> StagedInstall:
+    discard_stale_stages(destination_root)
+    stage_root = (
+        destination_root
+        / BUNDLE_STATE_DIR
+        / f"{STAGE_DIR_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    )
+    stage_root.mkdir(parents=True)
+    staged = StagedInstall(
+        live_root=destination_root,
+        stage_root=stage_root,
+        units=staged_units(destination_root, plan, project_mode),
+    )
+    emit("stage", f"Stage install: {stage_root}", path=stage_root)
+    try:
+        for unit in staged.units:
+            clone_into_stage(destination_root / unit, stage_root / unit)
+    except OSError:
+        shutil.rmtree(stage_root, ignore_errors=True)
+        raise
+    return staged
+
+
+def staged_swap_items(staged: StagedInstall) -> list[str]:
+    """List what must move from stage to target: every unit plus new siblings (backups)."""
+    containers = {""}
+    for unit in staged.units:
+        parent = PurePosixPath(unit).parent
+        while str(parent) != ".":
+            containers.add(parent.as_posix())
+            parent = parent.parent
+
+    items: list[str] = []
+    for container in sorted(containers):
+        stage_dir = staged.stage_root / container if container else staged.stage_root
+        if not stage_dir.is_dir():
             continue
-        if path.name in {".DS_Store"}:
+        for child in sorted(os.listdir(stage_dir)):
+            rel = f"{container}/{child}" if container else child
+            if rel not in containers:
+                items.append(rel)
+    # Units the install removed from the stage (e.g. migrated compat dirs) go too.
+    items.extend(
+        unit
+        for unit in staged.units
+        if unit not in items and os.path.lexists(staged.live_root / unit)
+    )
+    return items
+
+
+def sync_staged_files(paths: list[Path]) -> None:
+    """Flush the staged files and their directories in one batch before any live root moves."""
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
             continue
-        files.append(path)
-    return files
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    for parent in sorted({path.parent for path in paths}):
+        fsync_directory(parent)
 
 
-def collect_uninstall_targets(
-    payload: Path,
+def fsync_directory(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def nearest_existing_dir(path: Path) -> Path:
+    while not path.is_dir() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def swap_staged_install(staged: StagedInstall, state: InstallState) -> int:
+    """Move each staged root into the target by rename; undo every swap if one fails.
+
+    The previous roots go to `<stage>/.replaced/` and are removed with the stage once
+    every swap has succeeded. A root the rollback cannot move back is recorded in
+    `staged.stranded`. Returns the number of swapped paths.
+    """
+    items = staged_swap_items(staged)
+    stage_device = staged.stage_root.stat().st_dev
+    for rel in items:
+        if nearest_existing_dir((staged.live_root / rel).parent).stat().st_dev != stage_device:
+            raise OSError(f"{staged.live_root / rel} is not on the staging filesystem")
+
+    sync_staged_files(
+        [dst for _, dst in state.planned_files if dst.is_relative_to(staged.stage_root)]
+    )
+
+    replaced = staged.stage_root / ".replaced"
+    done: list[tuple[Path, Path, Path | None]] = []
+    try:
+        for rel in items:
+            staged_path = staged.stage_root / rel
+            live_path = staged.live_root / rel
+            old: Path | None = None
+            if rel not in staged.units:
+                # A new sibling such as a backup: never replace a live path of that name.
+                index = 1
+                while os.path.lexists(live_path):
+                    live_path = staged.live_root / f"{rel}.{index}"
+                    index += 1
+            elif os.path.lexists(live_path):
+                old = replaced / rel
+                old.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(live_path, old)
+            done.append((staged_path, live_path, old))
+            if os.path.lexists(staged_path):
+                live_path.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(staged_path, live_path)
+    except OSError:
+        for staged_path, live_path, old in reversed(done):
+            try:
+                if os.path.lexists(live_path) and not os.path.lexists(staged_path):
+                    os.rename(live_path, staged_path)
+                if old is not None:
+                    os.rename(old, live_path)
+            except OSError:
+                if old is not None and os.path.lexists(old):
+                    staged.stranded.append(old)
+        raise
+
+    for parent in sorted({(staged.live_root / rel).parent for rel in items}):
+        fsync_directory(parent)
+    return len(items)
+
+
+@profiled_phase("stage")
+def begin_staged_install(
+    args: argparse.Namespace,
     destination_root: Path,
     plan: list[tuple[str, str]],
+    state: InstallState,
     project_mode: bool,
-) -> tuple[list[Path], set[Path]]:
-    file_targets: set[Path] = set()
-    dir_targets: set[Path] = set()
+) -> StagedInstall | None:
+    """Set up `--staged` and point the ledger at the stage; None means install in place."""
+    if not args.staged or args.dry_run:
+        return None
+    staged = prepare_staged_install(destination_root, plan, project_mode)
+    if state.ledger is not None:
+        state.ledger.root = staged.stage_root
+    if state.backup_store is not None:
+        state.backup_store.target_root = staged.stage_root
+    return staged
 
-    for src_rel, dst_rel in plan:
-        src = payload / src_rel
-        dst = destination_root / dst_rel
 
-        if src.is_dir():
-            dir_targets.add(dst)
-            for src_file in iter_payload_files(src):
-                rel = src_file.relative_to(src)
-                file_targets.add(dst / rel)
-            continue
+@profiled_phase("swap")
+def finish_staged_install(staged: StagedInstall, state: InstallState) -> bool:
+    """Swap the stage into place and point the ledger back at the target."""
+    try:
+        swapped = swap_staged_install(staged, state)
+    except OSError as exc:
+        if staged.stranded:
+            # The stage holds the only copy of these roots; keep it for recovery.
+            print(f"Staged install failed and could not be undone: {exc}", file=sys.stderr)
+            print("Previous roots are kept in:", file=sys.stderr)
+            for old in staged.stranded:
+                print(f" - {old}", file=sys.stderr)
+            return False
+        print(f"Staged install failed; target left unchanged: {exc}", file=sys.stderr)
+        shutil.rmtree(staged.stage_root, ignore_errors=True)
+        return False
+    shutil.rmtree(staged.stage_root, ignore_errors=True)
+    if state.ledger is not None:
+        state.ledger.root = staged.live_root
+    if state.backup_store is not None:
+        state.backup_store.target_root = staged.live_root
+    emit(
+        "stage-swap",
+        f"Swap staged roots: {swapped} -> {staged.live_root}",
+        count=swapped,
+        path=staged.live_root,
+    )
+    state.notes.append(f"Staged install: swapped {swapped} managed roots into place.")
+    return True
 
-        # Include explicit file targets even if source is currently missing from payload.
-        file_targets.add(dst)
-        dir_targets.add(dst.parent)
 
-    # Project installs always ensure/merge repo-root opencode.json.
-    if project_mode:
-        file_targets.add(destination_root / "opencode.json")
-        file_targets.add(destination_root / ".gitignore")
-        dir_targets.add(destination_root)
+@dataclass
+class BundleContext:
+    """The bundle as loaded once per process: payload location, manifest, and tool checks."""
 
-    return sorted(file_targets), dir_targets
+    payload: Path
+    manifest_text: str
+    source_home: str
+    copied_items: list[str]
+    exts: set[str]
+    basenames: set[str]
+    payload_index: PayloadIndex | None
+    missing_optional: list[str] = field(default_factory=list)
 
 
-def managed_root_targets(destination_root: Path, project_mode: bool) -> list[Path]:
-    if project_mode:
-        roots = [
-            destination_root / "ai-kb",
-            destination_root / ".cursor",
-            destination_root / ".opencode",
-            destination_root / "opencode.json",
-        ]
-    else:
-        roots = [
-            destination_root / "ai-kb",
-            destination_root / ".cursor",
-            destination_root / ".config" / "opencode",
-        ]
+@profiled_phase("load-bundle")
+def load_bundle_context(args: argparse.Namespace) -> BundleContext | None:
+    try:
+        return open_bundle_context(args)
+    except (OSError, ValueError) as exc:
+        print(f"Cannot open payload: {exc}", file=sys.stderr)
+        return None
 
-    deduped: list[Path] = []
-    seen: set[Path] = set()
-    for root in roots:
-        if root in seen:
-            continue
-        seen.add(root)
-        deduped.append(root)
-    return deduped
 
+def open_bundle_context(args: argparse.Namespace) -> BundleContext:
+    """Load the payload and manifest named by `args`; raise OSError or ValueError if absent."""
+    bundle_dir = Path(__file__).resolve().parent
+    payload, manifest_path = open_payload(bundle_dir, args.payload)
+    if not payload.exists() or not manifest_path.exists():
+        raise FileNotFoundError("Bundle is missing payload or manifest")
 
-def latest_backup_for_target(target: Path) -> Path | None:
-    pattern = re.compile(
-        rf"^{re.escape(target.name)}\.bak\.(?P<stamp>\d{{8}}-\d{{6}})(?:\.(?P<idx>\d+))?$"
+    manifest_text = manifest_path.read_text(encoding="utf-8")
+    manifest = json.loads(manifest_text)
+    return BundleContext(
+        payload=payload,
+        manifest_text=manifest_text,
+        source_home=manifest["source_home"],
+        copied_items=manifest.get("copied_items", []),
+        exts=set(manifest.get("text_extensions", [])),
+        basenames=set(manifest.get("text_basenames", [])),
+        payload_index=load_payload_index(manifest, payload),
     )
-    candidates: list[tuple[int, str, int, str, Path]] = []
 
-    for path in target.parent.glob(f"{target.name}.bak.*"):
-        if not (path.exists() or path.is_symlink()):
-            continue
-        match = pattern.match(path.name)
-        if match:
-            candidates.append(
-                (
-                    1,
-                    match.group("stamp"),
-                    int(match.group("idx") or 0),
-                    path.name,
-                    path,
-                )
-            )
-            continue
-        candidates.append((0, "", 0, path.name, path))
 
-    if not candidates:
-        return None
-    candidates.sort()
-    return candidates[-1][-1]
+def install_rewrite_rules(
+    context: BundleContext, mode: str, target: Path
+) -> list[tuple[str, str]]:
+    """Path rewrite rules for a target; project rules do not depend on the project path."""
+    if mode == "project":
+        rules = project_replacements(context.source_home, target, Path.home())
+    else:
+        rules = global_replacements(context.source_home, str(target))
+    return dedupe_replacements(rules)
 
 
-def remove_path(path: Path, dry_run: bool, state: UninstallState) -> None:
-    print(f"Remove: {path}")
-    state.removed_paths.append(path)
-    if dry_run:
-        return
+def install_copy_plan(
+    context: BundleContext, args: argparse.Namespace, mode: str
+) -> list[tuple[str, str]]:
+    if mode == "project":
+        return project_copy_plan(args.include_machine_config)
+    return global_copy_plan(context.copied_items)
 
-    if path.is_dir() and not path.is_symlink():
-        shutil.rmtree(path)
-    else:
-        path.unlink()
 
+@profiled_phase("check-tools")
+def check_tools(args: argparse.Namespace) -> list[str]:
+    """Warn about missing required tools and return the missing optional ones."""
+    if args.uninstall:
+        return []
+    required_tools = ["python3", "node", "git"]
+    optional_tools = ["bun", "uv", "ck"]
+    missing_required = [tool for tool in required_tools if shutil.which(tool) is None]
+    missing_optional = [tool for tool in optional_tools if shutil.which(tool) is None]
 
-def restore_backup(
-    target: Path, backup: Path, dry_run: bool, state: UninstallState
+    if args.install_deps:
+        install_missing_deps(missing_required + missing_optional)
+    if missing_required:
+        print("Warning: missing required tools:", ", ".join(missing_required))
+    return missing_optional
+
+
+def start_incremental_install(
+    context: BundleContext,
+    destination_root: Path,
+    base_digest: str,
+    commit: str | None,
+    plan: list[tuple[str, str]],
+    state: InstallState,
 ) -> None:
-    print(f"Restore backup: {backup} -> {target}")
-    state.restored_backups.append((target, backup))
-    if dry_run:
+    """Limit the install to payload files changed since the last install, when possible.
+
+    The destination scan is skipped too: only the changed files are looked up.
+    """
+    assert state.ledger is not None
+    changed = incremental_sources(
+        context.payload, destination_root, base_digest, commit, plan, state.ledger
+    )
+    if changed is None:
         return
+    state.changed_sources = changed
+    count_metric("incremental_files", len(changed))
+    state.notes.append(
+        f"Incremental install: {len(changed)} payload files changed since the last "
+        "install (git)."
+    )
+
+
+def install_project(
+    context: BundleContext,
+    args: argparse.Namespace,
+    project_root: Path,
+    state: InstallState,
+) -> int:
+    mode = "project"
+    stamp = state.stamp or datetime.now().strftime("%Y%m%d-%H%M%S")
+    state.stamp = stamp
+    if not project_root.exists() or not project_root.is_dir():
+        print(f"Project directory does not exist: {project_root}", file=sys.stderr)
+        return 2
+
+    if args.uninstall:
+        uninstall_state = UninstallState()
+        if args.uninstall_all:
+            uninstall_all_roots(
+                destination_root=project_root,
+                args=args,
+                state=uninstall_state,
+                project_mode=True,
+            )
+        else:
+            uninstall_entries(
+                payload=context.payload,
+                destination_root=project_root,
+                plan=project_copy_plan(include_machine_config=True),
+                args=args,
+                state=uninstall_state,
+                project_mode=True,
+            )
+        print_uninstall_summary(uninstall_state, mode, project_root, args.dry_run)
+        return 0
+
+    if args.rollback:
+        return rollback_store_generation(project_root, args.dry_run)
+
+    if args.project_full:
+        state.notes.append(
+            "Project full mode enabled: installing full machine config in project "
+            "for one-click setup."
+        )
+
+    state.ledger = load_install_ledger(project_root)
+    if args.backups == "store":
+        state.backup_store = open_backup_store(project_root, stamp)
+    project_rewrite_rules = install_rewrite_rules(context, "project", project_root)
+    plan = install_copy_plan(context, args, "project")
+    inputs_digest = install_inputs_digest(
+        context.payload, context.manifest_text, plan, project_rewrite_rules, args
+    )
+    if can_skip_install(args) and install_up_to_date(
+        project_root, inputs_digest, plan, state.ledger
+    ):
+        state.up_to_date = True
+        print_up_to_date(mode, project_root)
+        return 0
+    base_digest = install_base_digest(
+        context.manifest_text, plan, project_rewrite_rules, args
+    )
+    commit = None if args.dry_run else payload_commit(context.payload)
+    if can_skip_install(args) and not args.store:
+        start_incremental_install(
+            context, project_root, base_digest, commit, plan, state
+        )
+    copy_plan = plan
+    if args.store:
+        store_dir = (
+            Path(args.store_dir).expanduser().resolve()
+            if args.store_dir
+            else default_store_dir()
+        )
+        if not args.dry_run:
+            store_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            linked = install_store_generation(
+                payload=context.payload,
+                project_root=project_root,
+                plan=plan,
+                store_dir=store_dir,
+                args=args,
+                state=state,
+                stamp=stamp,
+                replacements=project_rewrite_rules,
+                exts=context.exts,
+                basenames=context.basenames,
+            )
+        except OSError as exc:
+            print(f"Store install failed: {exc}", file=sys.stderr)
+            return 2
+        copy_plan = [entry for entry in plan if entry not in linked]
+    try:
+        staged = begin_staged_install(args, project_root, plan, state, project_mode=True)
+    except OSError as exc:
+        print(f"Staged install failed: {exc}", file=sys.stderr)
+        return 2
+    destination = staged.stage_root if staged else project_root
+    if state.changed_sources is None:
+        state.stat_cache = scan_destination(
+            destination, stat_scan_roots(plan, project_mode=True)
+        )
+    try:
+        install_entries(
+            payload=context.payload,
+            destination_root=destination,
+            plan=copy_plan,
+            args=args,
+            state=state,
+            stamp=stamp,
+            project_mode=True,
+            replacements=project_rewrite_rules,
+            exts=context.exts,
+            basenames=context.basenames,
+        )
+
+        migrate_opencode_compat_dirs(
+            opencode_root=destination / ".opencode",
+            args=args,
+            state=state,
+            stamp=stamp,
+        )
+        ensure_hook_executable_bits(
+            destination / ".cursor" / "hooks", args.dry_run, detach_links=staged is not None
+        )
+    except BaseException:
+        if staged:
+            shutil.rmtree(staged.stage_root, ignore_errors=True)
+        raise
+    if staged and not finish_staged_install(staged, state):
+        return 2
+    ensure_project_opencode_json(project_root, args, state, stamp)
+    write_install_ledger(state.ledger, args.dry_run)
+    write_install_fingerprint(
+        project_root, inputs_digest, plan, args.dry_run, base_digest, commit
+    )
+    if not args.dry_run and (args.keep_backups or args.backup_max_bytes is not None):
+        state.notes.extend(
+            prune_backup_store(project_root, args.keep_backups, args.backup_max_bytes)
+        )
+    print_summary(state, mode, project_root, args.dry_run, context.missing_optional)
+    return 0
+
+
+def install_home(
+    context: BundleContext,
+    args: argparse.Namespace,
+    target_home: Path,
+    state: InstallState,
+) -> int:
+    mode = "home"
+    stamp = state.stamp or datetime.now().strftime("%Y%m%d-%H%M%S")
+    state.stamp = stamp
+    plan = install_copy_plan(context, args, "home")
+
+    if args.uninstall:
+        uninstall_state = UninstallState()
+        if args.uninstall_all:
+            uninstall_all_roots(
+                destination_root=target_home,
+                args=args,
+                state=uninstall_state,
+                project_mode=False,
+            )
+        else:
+            uninstall_entries(
+                payload=context.payload,
+                destination_root=target_home,
+                plan=plan,
+                args=args,
+                state=uninstall_state,
+                project_mode=False,
+            )
+        print_uninstall_summary(uninstall_state, mode, target_home, args.dry_run)
+        return 0
+
+    state.ledger = load_install_ledger(target_home)
+    if args.backups == "store":
+        state.backup_store = open_backup_store(target_home, stamp)
+    home_rewrite_rules = install_rewrite_rules(context, "home", target_home)
+    inputs_digest = install_inputs_digest(
+        context.payload, context.manifest_text, plan, home_rewrite_rules, args
+    )
+    if can_skip_install(args) and install_up_to_date(
+        target_home, inputs_digest, plan, state.ledger
+    ):
+        state.up_to_date = True
+        print_up_to_date(mode, target_home)
+        return 0
+    base_digest = install_base_digest(context.manifest_text, plan, home_rewrite_rules, args)
+    commit = None if args.dry_run else payload_commit(context.payload)
+    if can_skip_install(args):
+        start_incremental_install(context, target_home, base_digest, commit, plan, state)
+    try:
+        staged = begin_staged_install(args, target_home, plan, state, project_mode=False)
+    except OSError as exc:
+        print(f"Staged install failed: {exc}", file=sys.stderr)
+        return 2
+    destination = staged.stage_root if staged else target_home
+    if state.changed_sources is None:
+        state.stat_cache = scan_destination(
+            destination, stat_scan_roots(plan, project_mode=False)
+        )
+    try:
+        install_entries(
+            payload=context.payload,
+            destination_root=destination,
+            plan=plan,
+            args=args,
+            state=state,
+            stamp=stamp,
+            project_mode=False,
+            replacements=home_rewrite_rules,
+            exts=context.exts,
+            basenames=context.basenames,
+        )
+
+        migrate_opencode_compat_dirs(
+            opencode_root=destination / ".config" / "opencode",
+            args=args,
+            state=state,
+            stamp=stamp,
+        )
+        ensure_hook_executable_bits(
+            destination / ".cursor" / "hooks", args.dry_run, detach_links=staged is not None
+        )
+    except BaseException:
+        if staged:
+            shutil.rmtree(staged.stage_root, ignore_errors=True)
+        raise
+    if staged and not finish_staged_install(staged, state):
+        return 2
+    write_install_ledger(state.ledger, args.dry_run)
+    write_install_fingerprint(
+        target_home, inputs_digest, plan, args.dry_run, base_digest, commit
+    )
+    if not args.dry_run and (args.keep_backups or args.backup_max_bytes is not None):
+        state.notes.extend(
+            prune_backup_store(target_home, args.keep_backups, args.backup_max_bytes)
+        )
+    print_summary(state, mode, target_home, args.dry_run, context.missing_optional)
+    return 0
 
-    if target.exists() or target.is_symlink():
-        if target.is_dir() and not target.is_symlink():
-            shutil.rmtree(target)
-        else:
-            target.unlink()
 
-    target.parent.mkdir(parents=True, exist_ok=True)
-    shutil.move(str(backup), str(target))
+def read_projects_file(path: Path) -> list[str]:
+    entries: list[str] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            entries.append(line)
+    return entries
 
 
-def prune_empty_directories(
-    destination_root: Path,
-    file_targets: list[Path],
-    dir_targets: set[Path],
-    dry_run: bool,
-    state: UninstallState,
-) -> None:
-    candidates: set[Path] = set()
+def discover_git_repos(root: Path, max_depth: int) -> list[Path]:
+    """Find git work trees under root with a depth-bounded `os.scandir` crawl.
 
-    for path in file_targets:
-        parent = path.parent
-        while parent != destination_root and parent != parent.parent:
-            candidates.add(parent)
-            parent = parent.parent
+    The crawl never follows symlinks, stops descending at the first `.git` it finds, and
+    skips hidden directories and common dependency or build trees.
+    """
+    repos: list[Path] = []
+    pending: list[tuple[str, int]] = [(str(root), 0)]
+    while pending:
+        directory, depth = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                children: list[str] = []
+                is_repo = False
+                for entry in entries:
+                    if entry.name == ".git":
+                        is_repo = True
+                        break
+                    if entry.name.startswith(".") or entry.name in DISCOVER_SKIP_DIRS:
+                        continue
+                    if depth < max_depth and entry.is_dir(follow_symlinks=False):
+                        children.append(entry.path)
+        except OSError:
+            continue
+        if is_repo:
+            repos.append(Path(directory))
+            continue
+        pending.extend((child, depth + 1) for child in children)
+    return sorted(repos)
 
-    for directory in dir_targets:
-        current = directory
-        while current != destination_root and current != current.parent:
-            candidates.add(current)
-            current = current.parent
 
-    for directory in sorted(candidates, key=lambda path: len(path.parts), reverse=True):
-        if not directory.exists() or not directory.is_dir():
-            continue
+def fleet_targets(args: argparse.Namespace) -> list[tuple[str, Path]] | None:
+    """Resolve every requested target as (mode, path), keeping first-seen order."""
+    projects: list[str] = list(args.project_dir or [])
+    if args.projects_from:
         try:
-            next(directory.iterdir())
+            projects.extend(read_projects_file(Path(args.projects_from).expanduser()))
+        except OSError as exc:
+            print(f"Cannot read --projects-from file: {exc}", file=sys.stderr)
+            return None
+    for root in args.discover or []:
+        root_path = Path(root).expanduser().resolve()
+        if not root_path.is_dir():
+            print(f"Discover root does not exist: {root_path}", file=sys.stderr)
+            return None
+        projects.extend(
+            str(repo) for repo in discover_git_repos(root_path, args.discover_depth)
+        )
+
+    targets: list[tuple[str, Path]] = []
+    if projects:
+        targets = [("project", Path(item).expanduser().resolve()) for item in projects]
+    else:
+        homes = args.target_home or [str(Path.home())]
+        targets = [("home", Path(item).expanduser().resolve()) for item in homes]
+
+    deduped: list[tuple[str, Path]] = []
+    seen: set[Path] = set()
+    for mode, path in targets:
+        if path in seen:
             continue
-        except StopIteration:
-            remove_path(directory, dry_run, state)
-        except Exception as exc:
-            state.notes.append(f"Could not inspect directory {directory}: {exc}")
+        seen.add(path)
+        deduped.append((mode, path))
+    return deduped
 
 
-def uninstall_entries(
-    payload: Path,
-    destination_root: Path,
-    plan: list[tuple[str, str]],
+@dataclass
+class InstallResult:
+    """Outcome of one captured install, as returned by `Installer` and fleet workers."""
+
+    mode: str
+    target: Path
+    exit_code: int
+    seconds: float
+    output: str
+    created_files: int = 0
+    overwritten_files: int = 0
+    backups: int = 0
+    up_to_date: bool = False
+    notes: list[str] = field(default_factory=list)
+    metrics: dict[str, object] | None = None
+    events: list[dict[str, object]] = field(default_factory=list)
+
+
+def run_install(
+    context: BundleContext,
     args: argparse.Namespace,
-    state: UninstallState,
-    project_mode: bool,
-) -> None:
-    file_targets, dir_targets = collect_uninstall_targets(
-        payload=payload,
-        destination_root=destination_root,
-        plan=plan,
-        project_mode=project_mode,
+    mode: str,
+    target: Path,
+    collect_events: bool,
+    rendered: dict[Path, RenderedSource] | None = None,
+) -> InstallResult:
+    """Install one target with stdout and stderr captured into the result."""
+    global _OUTPUT
+    state = InstallState(payload_index=context.payload_index, rendered=rendered)
+    output = io.StringIO()
+    events: list[dict[str, object]] = []
+    previous_output = _OUTPUT
+    configure_output(args, events if collect_events else None, target, interactive=False)
+    metrics = start_metrics() if profiling_requested(args) else None
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                if mode == "project":
+                    exit_code = install_project(context, args, target, state)
+                else:
+                    exit_code = install_home(context, args, target, state)
+            except Exception as exc:
+                print(f"Install failed: {exc!r}")
+                exit_code = 1
+    finally:
+        _OUTPUT = previous_output
+    report = None
+    if metrics is not None:
+        report = metrics_report(finish_metrics(metrics), mode, target, exit_code, state)
+    return InstallResult(
+        mode=mode,
+        target=target,
+        exit_code=exit_code,
+        seconds=time.perf_counter() - started,
+        output=output.getvalue(),
+        created_files=state.created_files,
+        overwritten_files=state.overwritten_files,
+        backups=len(state.backups),
+        up_to_date=state.up_to_date,
+        notes=list(state.notes),
+        metrics=report,
+        events=events,
     )
 
-    restored_dir_targets: set[Path] = set()
-    for directory in sorted(dir_targets):
-        backup = latest_backup_for_target(directory)
-        if backup is None:
-            continue
-        state.planned_paths.append(directory)
-        restore_backup(directory, backup, args.dry_run, state)
-        restored_dir_targets.add(directory)
 
-    for target in file_targets:
-        if any(target.is_relative_to(directory) for directory in restored_dir_targets):
-            continue
-        state.planned_paths.append(target)
-        backup = latest_backup_for_target(target)
-        if backup is not None:
-            restore_backup(target, backup, args.dry_run, state)
-            continue
+# Per-worker bundle, loaded once by init_fleet_worker and reused for every target.
+_FLEET_WORKER: tuple[argparse.Namespace, BundleContext] | None = None
 
-        if target.exists() or target.is_symlink():
-            remove_path(target, args.dry_run, state)
-            continue
 
-        state.missing_paths.append(target)
+def init_fleet_worker(args: argparse.Namespace, missing_optional: list[str]) -> None:
+    global _FLEET_WORKER
+    context = load_bundle_context(args)
+    if context is None:
+        raise RuntimeError("could not load bundle in fleet worker")
+    context.missing_optional = missing_optional
+    _FLEET_WORKER = (args, context)
 
-    prune_empty_directories(
-        destination_root=destination_root,
-        file_targets=file_targets,
-        dir_targets=dir_targets,
-        dry_run=args.dry_run,
-        state=state,
-    )
 
+def run_fleet_target(mode: str, target: Path) -> InstallResult:
+    assert _FLEET_WORKER is not None
+    args, context = _FLEET_WORKER
+    return run_install(context, args, mode, target, collect_events=bool(args.events_jsonl))
 
-def uninstall_all_roots(
-    destination_root: Path,
-    args: argparse.Namespace,
-    state: UninstallState,
-    project_mode: bool,
+
+def fleet_result_label(result: InstallResult) -> str:
+    if result.exit_code != 0:
+        return "failed"
+    return "up to date" if result.up_to_date else "installed"
+
+
+def print_fleet_summary(
+    results: list[InstallResult], workers: int, wall_seconds: float, dry_run: bool
 ) -> None:
-    roots = managed_root_targets(
-        destination_root=destination_root, project_mode=project_mode
-    )
-    state.notes.append(
-        "Force cleanup enabled: managed roots are removed recursively when no backup exists."
+    width = max([len("Target")] + [len(str(result.target)) for result in results])
+    print("Done")
+    print("Mode: fleet")
+    print("Dry run:", "yes" if dry_run else "no")
+    print(
+        f"{'Target':<{width}}  {'Mode':<7}  {'Result':<10}  {'Created':>7}  "
+        f"{'Overwritten':>11}  {'Backups':>7}  {'Seconds':>7}"
     )
+    for result in results:
+        print(
+            f"{str(result.target):<{width}}  {result.mode:<7}  "
+            f"{fleet_result_label(result):<10}  {result.created_files:>7}  "
+            f"{result.overwritten_files:>11}  {result.backups:>7}  {result.seconds:>7.2f}"
+        )
+    counts = {label: 0 for label in ["installed", "up to date", "failed"]}
+    for result in results:
+        counts[fleet_result_label(result)] += 1
+    print("Targets:", len(results))
+    print("Installed:", counts["installed"])
+    print("Up to date:", counts["up to date"])
+    print("Failed:", counts["failed"])
+    print("Workers:", workers)
+    print(f"Wall time: {wall_seconds:.2f}s")
+    print(f"Summed target time: {sum(result.seconds for result in results):.2f}s")
+    for result in results:
+        if result.exit_code != 0:
+            print(f"Output for failed target {result.target}:")
+            print(result.output.rstrip())
+
+
+@dataclass(frozen=True)
+class PlannedAction:
+    """One step of a `BundlePlan`; paths are payload- and target-relative POSIX strings.
+
+    `write` actions carry the size and sha256 of the bytes that will be installed.
+    `merge-json`, `scaffold`, and `link-kb-mirror` depend on what the target already
+    holds, so they are resolved when the plan is applied.
+    """
 
-    for target in roots:
-        state.planned_paths.append(target)
-        backup = latest_backup_for_target(target)
-        if backup is not None:
-            restore_backup(target, backup, args.dry_run, state)
-            continue
+    action: str
+    src: str
+    dst: str
+    size: int | None = None
+    sha256: str | None = None
 
-        if target.exists() or target.is_symlink():
-            remove_path(target, args.dry_run, state)
-            continue
 
-        state.missing_paths.append(target)
+@dataclass
+class BundlePlan:
+    """The rendered install for one mode and rewrite-rule set, built without a target.
 
+    Project rewrite rules do not depend on the project path, so one project plan can be
+    applied to any number of projects. A home plan is tied to its home directory.
+    """
 
-def migrate_opencode_compat_dirs(
-    opencode_root: Path,
-    args: argparse.Namespace,
-    state: InstallState,
-    stamp: str,
-) -> None:
-    """Migrate singular OpenCode subdirs to canonical plural names.
+    mode: str
+    inputs_digest: str
+    replacements: list[tuple[str, str]]
+    entries: list[tuple[str, str]]
+    actions: list[PlannedAction]
+    rendered: dict[Path, RenderedSource] = field(default_factory=dict, repr=False)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(action.size or 0 for action in self.actions)
+
+
+def planned_entry_action(src_rel: str, dst_rel: str, project_mode: bool) -> str | None:
+    """Name the apply-time action for copy-plan entries that are not plain copies."""
+    if src_rel == ".cursor/mcp.json" or src_rel == ".config/opencode/opencode.json":
+        return "merge-json"
+    if project_mode and src_rel == ".cursor/hooks.json":
+        return "merge-json"
+    if project_mode and src_rel == PROJECT_TEMPLATE_ENTRY:
+        return "scaffold"
+    if not project_mode and dst_rel == GLOBAL_KB_MIRROR:
+        return "link-kb-mirror"
+    return None
+
+
+def deferred_plan_actions(
+    entries: list[tuple[str, str]], project_mode: bool
+) -> list[PlannedAction]:
+    """List the copy-plan entries that are resolved against the target when applied."""
+    actions: list[PlannedAction] = []
+    for src_rel, dst_rel in entries:
+        special = planned_entry_action(src_rel, dst_rel, project_mode)
+        if special is not None:
+            actions.append(PlannedAction(action=special, src=src_rel, dst=dst_rel))
+    if project_mode:
+        actions.append(PlannedAction(action="merge-json", src="", dst="opencode.json"))
+    return actions
 
-    OpenCode uses plural subdirectories (`agents/`, `commands/`, `plugins/`) as canonical.
-    Singular names (e.g., `agent/`) are supported for backwards compatibility, but when both
-    exist OpenCode may load both which causes duplicate commands/agents/plugins.
-    """
 
-    if not opencode_root.exists() or not opencode_root.is_dir():
-        return
-    if args.preserve_existing:
-        state.notes.append(
-            f"Skipped OpenCode compat directory migration because preserve-existing is set: {opencode_root}"
+def planned_payload_files(
+    context: BundleContext, entries: list[tuple[str, str]], project_mode: bool
+) -> list[tuple[Path, str]]:
+    """List (payload file, target-relative destination) for every plain copy-plan entry."""
+    pending: list[tuple[Path, str]] = []
+    for src_rel, dst_rel in entries:
+        if planned_entry_action(src_rel, dst_rel, project_mode) is not None:
+            continue
+        src = context.payload / src_rel
+        if src.is_dir():
+            for src_file in iter_payload_files(src):
+                rel = src_file.relative_to(src).as_posix()
+                pending.append((src_file, f"{dst_rel}/{rel}"))
+        elif src.exists():
+            pending.append((src, dst_rel))
+    return pending
+
+
+def build_bundle_plan(
+    context: BundleContext, args: argparse.Namespace, mode: str, target: Path
+) -> BundlePlan:
+    """Render every payload file the install would write; the destination is not read."""
+    project_mode = mode == "project"
+    replacements = install_rewrite_rules(context, mode, target)
+    entries = install_copy_plan(context, args, mode)
+    actions = deferred_plan_actions(entries, project_mode)
+    pending = planned_payload_files(context, entries, project_mode)
+    sources = run_jobs(
+        lambda item: render_source(
+            item[0],
+            replacements,
+            context.exts,
+            context.basenames,
+            context.payload_index,
+        ),
+        pending,
+        args.jobs,
+    )
+    rendered: dict[Path, RenderedSource] = {}
+    for (src, dst_rel), source in zip(pending, sources):
+        rendered[src] = source
+        actions.append(
+            PlannedAction(
+                action="write",
+                src=src.relative_to(context.payload).as_posix(),
+                dst=dst_rel,
+                size=len(source.data),
+                sha256=source.digest,
+            )
         )
-        return
+    return BundlePlan(
+        mode=mode,
+        inputs_digest=install_inputs_digest(
+            context.payload, context.manifest_text, entries, replacements, args
+        ),
+        replacements=replacements,
+        entries=entries,
+        actions=actions,
+        rendered=rendered,
+    )
 
-    compat_pairs = [
-        ("agent", "agents"),
-        ("command", "commands"),
-        ("plugin", "plugins"),
-    ]
 
-    for singular, plural in compat_pairs:
-        singular_dir = opencode_root / singular
-        if not singular_dir.exists() or not singular_dir.is_dir():
-            continue
-        plural_dir = opencode_root / plural
+class Installer:
+    """Install the bundle in-process: load the payload once, then plan and apply per target.
 
-        if not plural_dir.exists():
-            print(f"Migrate OpenCode dir: {singular_dir} -> {plural_dir}")
-            if args.dry_run:
-                continue
-            plural_dir.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(singular_dir), str(plural_dir))
-            continue
+        installer = Installer(jobs=4)
+        plan = installer.plan("project")
+        for repo in repos:
+            result = installer.apply(plan, repo)
 
-        if not plural_dir.is_dir():
-            state.notes.append(
-                f"Skipped OpenCode compat migration; destination is not a directory: {plural_dir}"
+    Options are the installer's long flags with dashes as underscores, for example
+    `link_mode="auto"` or `backups="store"`. Output is captured in the returned
+    `InstallResult` (`output`, and `events` as `--events-jsonl` would write them)
+    instead of being printed. Installs share process-wide output and profiling
+    state, so run concurrent installs in separate processes, as fleet mode does.
+    """
+
+    def __init__(self, payload: str | Path | None = None, **options: object) -> None:
+        args = parse_args([])
+        unknown = sorted(set(options) - set(vars(args)) - {"payload"})
+        if unknown:
+            raise TypeError(f"Unknown installer options: {', '.join(unknown)}")
+        for name, value in options.items():
+            setattr(args, name, value)
+        args.payload = str(payload) if payload is not None else None
+        if args.uninstall or args.rollback or args.plan_out or args.apply_plan or args.watch:
+            raise ValueError(
+                "Installer installs only; use the CLI to uninstall, roll back, "
+                "or save and apply plan files."
             )
-            continue
+        error = option_error(args)
+        if error is not None:
+            raise ValueError(error)
+        if args.project_full:
+            args.include_machine_config = True
+            args.preserve_existing = False
+        self.args = args
+        self.context = open_bundle_context(args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.context.missing_optional = check_tools(args)
+
+    def plan(self, mode: str = "project", target: str | Path | None = None) -> BundlePlan:
+        """Render the install for `mode`; home plans are built for `target` (default: HOME)."""
+        if mode not in {"project", "home"}:
+            raise ValueError(f"Unknown install mode: {mode}")
+        if target is None:
+            target = Path.home() if mode == "home" else Path.cwd()
+        return build_bundle_plan(
+            self.context, self.args, mode, Path(target).expanduser().resolve()
+        )
 
-        for src_path in sorted(singular_dir.rglob("*")):
-            if src_path.is_dir():
-                continue
-            rel = src_path.relative_to(singular_dir)
-            dst_path = plural_dir / rel
+    def apply(self, plan: BundlePlan, target: str | Path) -> InstallResult:
+        """Install `plan` into target, reusing its rendered files."""
+        target_path = Path(target).expanduser().resolve()
+        if plan.replacements != install_rewrite_rules(self.context, plan.mode, target_path):
+            raise ValueError(f"Plan rewrite rules do not match {target_path}; plan it separately.")
+        inputs_digest = install_inputs_digest(
+            self.context.payload,
+            self.context.manifest_text,
+            plan.entries,
+            plan.replacements,
+            self.args,
+        )
+        if plan.entries != install_copy_plan(self.context, self.args, plan.mode) or (
+            plan.inputs_digest != inputs_digest
+        ):
+            raise ValueError("Payload or installer options changed since the plan was built.")
+        return run_install(
+            self.context,
+            self.args,
+            plan.mode,
+            target_path,
+            collect_events=True,
+            rendered=plan.rendered,
+        )
 
-            if dst_path.exists() or dst_path.is_symlink():
-                if files_equal(src_path, dst_path):
-                    print(f"Remove duplicate OpenCode compat file: {src_path}")
-                    if args.dry_run:
-                        continue
-                    try:
-                        src_path.unlink()
-                    except Exception as exc:
-                        state.notes.append(
-                            f"Could not remove duplicate OpenCode compat file {src_path}: {exc}"
-                        )
-                    continue
+    def install(self, target: str | Path, mode: str = "project") -> InstallResult:
+        """Install into target without a precomputed plan (files render as they are copied)."""
+        if mode not in {"project", "home"}:
+            raise ValueError(f"Unknown install mode: {mode}")
+        target_path = Path(target).expanduser().resolve()
+        return run_install(self.context, self.args, mode, target_path, collect_events=True)
 
-                conflict_path = dst_path.with_name(f"{dst_path.name}.compat.{stamp}")
-                print(
-                    f"Preserve OpenCode compat conflict: {src_path} -> {conflict_path}"
-                )
-                if args.dry_run:
-                    continue
-                conflict_path.parent.mkdir(parents=True, exist_ok=True)
-                try:
-                    shutil.move(str(src_path), str(conflict_path))
-                except Exception as exc:
-                    state.notes.append(
-                        f"Could not move OpenCode compat conflict file {src_path}: {exc}"
-                    )
-                continue
 
-            print(f"Move OpenCode compat file: {src_path} -> {dst_path}")
-            if args.dry_run:
-                continue
-            dst_path.parent.mkdir(parents=True, exist_ok=True)
-            try:
-                shutil.move(str(src_path), str(dst_path))
-            except Exception as exc:
-                state.notes.append(
-                    f"Could not move OpenCode compat file {src_path}: {exc}"
-                )
+def write_fleet_events(args: argparse.Namespace, results: list[InstallResult]) -> None:
+    """Write each target's buffered events to `--events-jsonl`, in target order."""
+    try:
+        with contextlib.closing(open_events_file(args)) as events:
+            for result in results:
+                for event in result.events:
+                    events.write(json.dumps(event) + "\n")
+    except OSError as exc:
+        print(f"Cannot write --events-jsonl file: {exc}", file=sys.stderr)
 
-        if args.dry_run:
-            print(f"Prune empty OpenCode compat dir: {singular_dir}")
-            continue
 
-        for path in sorted(singular_dir.rglob("*"), reverse=True):
-            if path.is_dir():
-                try:
-                    path.rmdir()
-                except Exception:
-                    pass
-        try:
-            singular_dir.rmdir()
-            print(f"Removed OpenCode compat dir: {singular_dir}")
-        except Exception:
-            state.notes.append(
-                f"OpenCode compat dir not empty; left in place: {singular_dir}"
-            )
+def run_fleet(
+    context: BundleContext,
+    args: argparse.Namespace,
+    targets: list[tuple[str, Path]],
+) -> int:
+    """Install every target on a process pool whose workers each load the bundle once."""
+    if not targets:
+        print("No fleet targets found.", file=sys.stderr)
+        return 2
+    workers = min(args.fleet_jobs or os.cpu_count() or 1, len(targets))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_fleet_worker,
+        initargs=(args, context.missing_optional),
+    ) as pool:
+        futures = [pool.submit(run_fleet_target, mode, target) for mode, target in targets]
+        results = [future.result() for future in futures]
+    wall_seconds = time.perf_counter() - started
+    print_fleet_summary(results, workers, wall_seconds, args.dry_run)
+    if profiling_requested(args):
+        reports = [result.metrics for result in results if result.metrics is not None]
+        finish_profile_output(args, reports, wall_seconds)
+    if args.events_jsonl:
+        write_fleet_events(args, results)
+    return 0 if all(result.exit_code == 0 for result in results) else 2
+
+
+def open_events_file(args: argparse.Namespace) -> TextIO | None:
+    """Open the `--events-jsonl` sink, block-buffered so events cost no per-line write."""
+    if not args.events_jsonl:
+        return None
+    path = Path(args.events_jsonl).expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.open("w", encoding="utf-8", buffering=EVENTS_BUFFER_SIZE)
 
 
-def global_replacements(source_home: str, target_home: str) -> list[tuple[str, str]]:
-    opencode_kb = f"{target_home}/.config/opencode/ai-kb"
-    return [
-        ("__HOME__/ai-kb", opencode_kb),
-        (f"{source_home}/ai-kb", opencode_kb),
-        ("~/.config/opencode", f"{target_home}/.config/opencode"),
-        ("~/.cursor", f"{target_home}/.cursor"),
-        ("~/ai-kb", opencode_kb),
-        ("__HOME__", target_home),
-        (source_home, target_home),
-    ]
+def plan_relative(path: Path | None, root: Path) -> str | None:
+    if path is None:
+        return None
+    try:
+        return path.relative_to(root).as_posix()
+    except ValueError:
+        return str(path)
 
 
-def project_replacements(
-    source_home: str, project_root: Path, current_home: Path
-) -> list[tuple[str, str]]:
-    # Keep project installs portable across developer machines:
-    # use repo-relative paths instead of baking absolute `/Users/...` paths into files.
-    project_kb = "ai-kb"
-    project_opencode = ".opencode"
-    project_cursor = ".cursor"
-    return [
-        ("__HOME__/ai-kb", project_kb),
-        ("__HOME__", str(current_home)),
-        (f"{source_home}/.config/opencode/ai-kb", project_kb),
-        ("~/.config/opencode/ai-kb", project_kb),
-        (f"{source_home}/ai-kb", project_kb),
-        ("~/ai-kb", project_kb),
-        (f"{source_home}/.config/opencode", project_opencode),
-        ("~/.config/opencode", project_opencode),
-        (f"{source_home}/.cursor", project_cursor),
-        ("~/.cursor", project_cursor),
-        (source_home, str(current_home)),
-    ]
+def write_install_plan(
+    path: Path,
+    context: BundleContext,
+    args: argparse.Namespace,
+    mode: str,
+    target: Path,
+    state: InstallState,
+) -> None:
+    """Save the file decisions of a dry run, plus the inputs `--apply-plan` checks."""
+    entries = install_copy_plan(context, args, mode)
+    actions: list[dict[str, object]] = []
+    for record in state.plan_actions or []:
+        actions.append(
+            {
+                **record,
+                "src": plan_relative(record["src"], context.payload),
+                "dst": plan_relative(record["dst"], target),
+                "backup": plan_relative(record["backup"], target),
+            }
+        )
+    for deferred in deferred_plan_actions(entries, mode == "project"):
+        actions.append({**asdict(deferred), "dest_stat": None, "backup": None})
+    write_json_atomic(
+        path,
+        {
+            "version": PLAN_VERSION,
+            "mode": mode,
+            "target": str(target),
+            "stamp": state.stamp,
+            "manifest": text_digest(context.manifest_text),
+            "options": {name: getattr(args, name) for name in PLAN_OPTIONS},
+            "rules": install_rewrite_rules(context, mode, target),
+            "entries": entries,
+            "actions": actions,
+        },
+    )
 
 
-def install_entries(
-    payload: Path,
-    destination_root: Path,
-    plan: list[tuple[str, str]],
+def load_install_plan(path: Path) -> dict[str, object]:
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(raw, dict) or raw.get("version") != PLAN_VERSION:
+        raise ValueError(f"not a version {PLAN_VERSION} install plan")
+    if raw.get("mode") not in {"project", "home"} or not isinstance(raw.get("actions"), list):
+        raise ValueError("install plan has no mode or action list")
+    return raw
+
+
+def apply_plan_options(args: argparse.Namespace, saved: dict[str, object]) -> None:
+    """Take the plan's options, and its target unless one was given on the command line."""
+    for name, value in dict(saved.get("options") or {}).items():
+        if name in PLAN_OPTIONS:
+            setattr(args, name, value)
+    if args.project_dir or args.target_home or args.projects_from or args.discover:
+        return
+    if saved["mode"] == "project":
+        args.project_dir = [saved["target"]]
+    else:
+        args.target_home = [saved["target"]]
+
+
+def verify_install_plan(
+    context: BundleContext,
     args: argparse.Namespace,
+    mode: str,
+    target: Path,
+    saved: dict[str, object],
     state: InstallState,
-    stamp: str,
-    project_mode: bool,
-    replacements: list[tuple[str, str]],
-    exts: set[str],
-    basenames: set[str],
-) -> None:
-    for src_rel, dst_rel in plan:
-        src = payload / src_rel
-        dst = destination_root / dst_rel
-        if src_rel == ".cursor/mcp.json":
-            if not src.exists():
-                state.missing_sources.append(src)
-                print(f"Missing source: {src}")
-                continue
-            merge_cursor_mcp_file(
-                src, dst, args, state, stamp, replacements, exts, basenames
+) -> list[str]:
+    """Check a saved plan against the payload and target; return what no longer matches.
+
+    Every planned file is rendered again and must have its planned digest, every
+    destination must still have its planned fingerprint, and the payload must not hold
+    files the plan does not list. The renders are kept in state so the install does not
+    read the payload a second time.
+    """
+    if saved["mode"] != mode:
+        return [f"the plan is for {saved['mode']} mode, not {mode} mode"]
+    replacements = install_rewrite_rules(context, mode, target)
+    problems: list[str] = []
+    if saved.get("manifest") != text_digest(context.manifest_text):
+        problems.append("manifest.json differs from the one the plan was built with")
+    if saved.get("rules") != [list(rule) for rule in replacements]:
+        problems.append(f"rewrite rules for {target} differ from the plan's")
+    entries = install_copy_plan(context, args, mode)
+    if saved.get("entries") != [list(entry) for entry in entries]:
+        problems.append("the copy plan differs from the plan's")
+    if problems:
+        return problems
+
+    files = [action for action in saved["actions"] if action.get("dest_stat") is not None]
+    planned = {str(action["src"]) for action in files}
+    for src, _ in planned_payload_files(context, entries, mode == "project"):
+        rel = PurePosixPath(src.relative_to(context.payload).as_posix())
+        # A preserved non-directory destination is planned once for its whole source dir.
+        if str(rel) not in planned and not any(str(parent) in planned for parent in rel.parents):
+            problems.append(f"payload file is not in the plan: {src}")
+
+    def check(action: dict[str, object]) -> tuple[str | None, RenderedSource | None]:
+        dst = target / str(action["dst"])
+        try:
+            found = plan_stat_token(os.lstat(dst))
+        except OSError:
+            found = plan_stat_token(None)
+        if found != action["dest_stat"]:
+            planned = action["dest_stat"]
+            return f"destination changed: {dst} (planned {planned}, found {found})", None
+        if not action.get("sha256"):
+            return None, None
+        src = context.payload / str(action["src"])
+        try:
+            source = render_source(
+                src, replacements, context.exts, context.basenames, context.payload_index
             )
+        except OSError:
+            return f"payload file is unreadable: {src}", None
+        if source.digest != action["sha256"]:
+            return f"payload changed: {src}", None
+        return None, source
+
+    state.rendered = {}
+    for action, (problem, source) in zip(files, run_jobs(check, files, args.jobs)):
+        if problem is not None:
+            problems.append(problem)
+        elif source is not None:
+            state.rendered[context.payload / str(action["src"])] = source
+    return list(dict.fromkeys(problems))
+
+
+@dataclass
+class InotifyWatcher:
+    """Linux inotify through ctypes, used by `--watch` to sleep until the payload changes."""
+
+    fd: int
+    libc: ctypes.CDLL
+    watched: set[str] = field(default_factory=set)
+
+
+def open_inotify() -> InotifyWatcher | None:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    return InotifyWatcher(fd=fd, libc=libc) if fd >= 0 else None
+
+
+def inotify_watch_dirs(watcher: InotifyWatcher, dirs: list[str]) -> bool:
+    """Watch every directory not yet watched; False when the kernel refuses one."""
+    for path in dirs:
+        if path in watcher.watched:
             continue
-        if project_mode and src_rel == ".cursor/hooks.json":
-            if not src.exists():
-                state.missing_sources.append(src)
-                print(f"Missing source: {src}")
+        if watcher.libc.inotify_add_watch(watcher.fd, os.fsencode(path), INOTIFY_MASK) < 0:
+            return False
+        watcher.watched.add(path)
+    return True
+
+
+def inotify_wait(watcher: InotifyWatcher, timeout: float | None) -> bool:
+    """Wait up to timeout seconds for events and drain them; True when any arrived."""
+    ready, _, _ = select.select([watcher.fd], [], [], timeout)
+    if not ready:
+        return False
+    while True:
+        try:
+            if not os.read(watcher.fd, 64 * 1024):
+                break
+        except BlockingIOError:
+            break
+    return True
+
+
+@dataclass
+class WatchSession:
+    """What `--watch` keeps between syncs: the loaded bundle, resolved plan, and ledger."""
+
+    context: BundleContext
+    args: argparse.Namespace
+    mode: str
+    target: Path
+    entries: list[tuple[str, str]]
+    replacements: list[tuple[str, str]]
+    ledger: InstallLedger
+    snapshot: dict[str, tuple[int, int]]
+    watcher: InotifyWatcher | None = None
+
+
+def wait_for_payload_changes(session: WatchSession) -> list[str]:
+    """Block until payload files change and edits have settled; return their paths.
+
+    Paths are payload-relative with `/` separators. A burst of writes (an editor saving
+    several files, a `git checkout`) is collected into one sync: after the first change,
+    waiting continues until nothing has changed for `WATCH_DEBOUNCE` seconds.
+    """
+    root = str(session.context.payload)
+    watcher = session.watcher
+    while True:
+        if watcher is not None:
+            inotify_wait(watcher, None)
+            while inotify_wait(watcher, WATCH_DEBOUNCE):
+                pass
+            current, dirs = scan_payload_stats(root)
+            if not inotify_watch_dirs(watcher, dirs):
+                os.close(watcher.fd)
+                session.watcher = watcher = None
+                print("Too many payload directories for inotify; polling instead.", file=sys.stderr)
+        else:
+            time.sleep(WATCH_POLL_INTERVAL)
+            current, _ = scan_payload_stats(root)
+            if current == session.snapshot:
                 continue
-            merge_cursor_hooks_file(
-                src, dst, args, state, stamp, replacements, exts, basenames
-            )
+            while True:
+                time.sleep(WATCH_DEBOUNCE)
+                settled, _ = scan_payload_stats(root)
+                if settled == current:
+                    break
+                current = settled
+        changed = sorted(
+            rel
+            for rel in current.keys() | session.snapshot.keys()
+            if current.get(rel) != session.snapshot.get(rel)
+        )
+        session.snapshot = current
+        if changed:
+            return [rel.replace(os.sep, "/") for rel in changed]
+
+
+def sync_payload_changes(session: WatchSession, changed: list[str]) -> None:
+    """Render and write the destinations of changed payload files.
+
+    Plain files go through the usual plan/compare/write path, so a save that does not
+    change the rendered bytes writes nothing. JSON sources that installs merge into the
+    target (`mcp.json`, project `hooks.json`, global `opencode.json`) are merged again
+    only when they change. Deleted payload files are left installed, as in an install.
+    """
+    context, args, target = session.context, session.args, session.target
+    project_mode = session.mode == "project"
+    started = time.perf_counter()
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    # No manifest index: its placeholder lists describe the payload as it was built.
+    state = InstallState(ledger=session.ledger, skip_managed_backups=True)
+    pairs: list[tuple[Path, Path]] = []
+    mirror_pairs: list[tuple[Path, Path]] = []
+    merges: list[tuple[str, str]] = []
+    mirror = target / GLOBAL_KB_MIRROR
+    mirror_is_link = is_kb_mirror_link(mirror, target)
+    for rel in changed:
+        src = context.payload / rel
+        if not src.is_file():
             continue
-        if src_rel == ".config/opencode/opencode.json":
-            if not src.exists():
-                state.missing_sources.append(src)
-                print(f"Missing source: {src}")
+        for src_rel, dst_rel in session.entries:
+            if rel != src_rel and not rel.startswith(f"{src_rel}/"):
                 continue
-            merge_opencode_json_file(
-                src,
-                dst,
-                args,
-                state,
-                stamp,
-                replacements,
-                exts,
-                basenames,
-                project_mode,
-            )
-            continue
-        if (
-            project_mode
-            and src_rel == ".config/opencode/memory/templates/project/.opencode"
-        ):
-            scaffold_project_runtime_state(
-                payload,
-                destination_root,
-                args,
-                state,
-                replacements,
-                exts,
-                basenames,
-            )
-            continue
-        copy_entry(src, dst, args, state, stamp, replacements, exts, basenames)
+            dst = target / dst_rel / rel[len(src_rel) + 1 :] if rel != src_rel else target / dst_rel
+            action = planned_entry_action(src_rel, dst_rel, project_mode)
+            if action == "merge-json":
+                merges.append((src_rel, dst_rel))
+            elif action == "link-kb-mirror":
+                # A linked mirror already shows the primary KB's new file.
+                if not mirror_is_link:
+                    mirror_pairs.append((src, dst))
+            elif action is None:
+                pairs.append((src, dst))
+    copy_files(pairs, args, state, stamp, session.replacements, context.exts, context.basenames)
+    # After the primary KB, so a hardlinked mirror already holds the new bytes.
+    copy_files(
+        mirror_pairs, args, state, stamp, session.replacements, context.exts, context.basenames
+    )
+    install_plan_entries(
+        context.payload,
+        target,
+        list(dict.fromkeys(merges)),
+        args,
+        state,
+        stamp,
+        project_mode,
+        session.replacements,
+        context.exts,
+        context.basenames,
+    )
+    write_install_ledger(session.ledger, dry_run=False)
+    for note in state.notes:
+        emit("note", f"Note: {note}")
+    record_event(
+        "watch-sync",
+        changed=len(changed),
+        created_files=state.created_files,
+        overwritten_files=state.overwritten_files,
+        backups=len(state.backups),
+    )
+    print(
+        f"Synced {len(changed)} changed payload files: {state.created_files} created, "
+        f"{state.overwritten_files} updated, {len(state.backups)} backups "
+        f"({time.perf_counter() - started:.2f}s)"
+    )
+    flush_output()
 
 
-def print_summary(
-    state: InstallState,
+def watch_install(args: argparse.Namespace, mode: str, target: Path) -> int:
+    """Install once, then sync payload edits into target until interrupted."""
+    context = load_bundle_context(args)
+    if context is None:
+        return 2
+    if isinstance(context.payload, ArchivePath):
+        print("--watch needs a payload directory, not a packed bundle.", file=sys.stderr)
+        return 2
+    context.missing_optional = check_tools(args)
+    state = InstallState(payload_index=context.payload_index)
+    if mode == "project":
+        exit_code = install_project(context, args, target, state)
+    else:
+        exit_code = install_home(context, args, target, state)
+    if exit_code != 0 or state.ledger is None:
+        return exit_code
+    snapshot, dirs = scan_payload_stats(str(context.payload))
+    session = WatchSession(
+        context=context,
+        args=args,
+        mode=mode,
+        target=target,
+        entries=install_copy_plan(context, args, mode),
+        replacements=install_rewrite_rules(context, mode, target),
+        ledger=state.ledger,
+        snapshot=snapshot,
+        watcher=open_inotify(),
+    )
+    if session.watcher is not None and not inotify_watch_dirs(session.watcher, dirs):
+        os.close(session.watcher.fd)
+        session.watcher = None
+    method = "inotify" if session.watcher is not None else "polling"
+    print(f"Watching {context.payload} for changes ({method}); press Ctrl-C to stop.")
+    flush_output()
+    try:
+        while True:
+            sync_payload_changes(session, wait_for_payload_changes(session))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        if session.watcher is not None:
+            os.close(session.watcher.fd)
+    return 0
+
+
+def install_single_target(
+    args: argparse.Namespace,
     mode: str,
     target: Path,
-    dry_run: bool,
-    missing_optional: list[str],
-) -> None:
-    print("Done")
-    print("Mode:", mode)
-    print("Target:", target)
-    print("Dry run:", "yes" if dry_run else "no")
-    print("Created files:", state.created_files)
-    print("Overwritten files:", state.overwritten_files)
-    print("Backups created:", len(state.backups))
-    print("Skipped existing:", len(state.skipped_existing))
-    print("Text files scanned:", state.scanned_text_files)
-    print("Files rewritten:", state.rewritten_text_files)
-    if state.missing_sources:
-        print("Missing sources:", len(state.missing_sources))
-        for src in state.missing_sources[:10]:
-            print(" -", src)
-    if state.notes:
-        print("Notes:")
-        for note in state.notes:
-            print(" -", note)
-    if missing_optional:
-        print("Optional tools missing:", ", ".join(missing_optional))
+    saved_plan: dict[str, object] | None = None,
+) -> int:
+    try:
+        events = open_events_file(args)
+    except OSError as exc:
+        print(f"Cannot open --events-jsonl file: {exc}", file=sys.stderr)
+        return 2
+    configure_output(args, events, target, interactive=sys.stdout.isatty())
+    try:
+        if args.watch:
+            return watch_install(args, mode, target)
+        return install_target_with_metrics(args, mode, target, saved_plan)
+    finally:
+        if events is not None:
+            events.close()
 
 
-def print_uninstall_summary(
-    state: UninstallState,
+def install_target_with_metrics(
+    args: argparse.Namespace,
     mode: str,
     target: Path,
-    dry_run: bool,
-) -> None:
-    print("Done")
-    print("Mode:", mode)
-    print("Target:", target)
-    print("Dry run:", "yes" if dry_run else "no")
-    print("Managed paths:", len(state.planned_paths))
-    print("Removed paths:", len(state.removed_paths))
-    print("Backups restored:", len(state.restored_backups))
-    print("Missing managed paths:", len(state.missing_paths))
-    if state.notes:
-        print("Notes:")
-        for note in state.notes:
-            print(" -", note)
+    saved_plan: dict[str, object] | None = None,
+) -> int:
+    metrics = start_metrics() if profiling_requested(args) else None
+    started = time.perf_counter()
+    context = load_bundle_context(args)
+    if context is None:
+        return 2
+    context.missing_optional = check_tools(args)
+    state = InstallState(payload_index=context.payload_index)
+    if args.plan_out:
+        state.plan_actions = []
+    if saved_plan is not None:
+        problems = verify_install_plan(context, args, mode, target, saved_plan, state)
+        if problems:
+            print(f"Plan {args.apply_plan} does not match {target}:", file=sys.stderr)
+            for problem in problems[:20]:
+                print(f"  {problem}", file=sys.stderr)
+            if len(problems) > 20:
+                print(f"  ... and {len(problems) - 20} more", file=sys.stderr)
+            return 2
+        state.stamp = saved_plan.get("stamp") or None
+    if mode == "project":
+        exit_code = install_project(context, args, target, state)
+    else:
+        exit_code = install_home(context, args, target, state)
+    if exit_code == 0 and args.plan_out:
+        plan_path = Path(args.plan_out).expanduser()
+        try:
+            write_install_plan(plan_path, context, args, mode, target, state)
+        except OSError as exc:
+            print(f"Cannot write --plan-out file: {exc}", file=sys.stderr)
+            return 2
+        print("Plan written:", plan_path)
+    if metrics is not None:
+        report = metrics_report(finish_metrics(metrics), mode, target, exit_code, state)
+        finish_profile_output(args, [report], time.perf_counter() - started)
+    return exit_code
+
+
+def option_error(args: argparse.Namespace) -> str | None:
+    """Return why the non-target options cannot be combined, or None when they can."""
+    if args.uninstall and args.install_deps:
+        return "--install-deps cannot be used with --uninstall."
+    if args.jobs < 1:
+        return "--jobs must be at least 1."
+    if args.fleet_jobs is not None and args.fleet_jobs < 1:
+        return "--fleet-jobs must be at least 1."
+    if (args.keep_backups is not None or args.backup_max_bytes is not None) and (
+        args.backups != "store"
+    ):
+        return "--keep-backups and --backup-max-bytes require --backups store."
+    if (args.keep_backups is not None and args.keep_backups < 1) or (
+        args.backup_max_bytes is not None and args.backup_max_bytes < 0
+    ):
+        return "--keep-backups must be at least 1 and --backup-max-bytes at least 0."
+    if args.staged and (args.store or args.rollback or args.uninstall):
+        return "--staged cannot be used with --store, --rollback or --uninstall."
+    if args.rollback and (args.uninstall or args.store):
+        return "--rollback cannot be used with --uninstall or --store."
+    if args.uninstall_all and not args.uninstall:
+        return "--uninstall-all requires --uninstall."
+    if args.uninstall and args.preserve_existing:
+        return "--preserve-existing cannot be used with --uninstall."
+    if args.plan_out and args.apply_plan:
+        return "--plan-out cannot be used with --apply-plan."
+    if args.watch and (
+        args.uninstall
+        or args.rollback
+        or args.store
+        or args.staged
+        or args.dry_run
+        or args.plan_out
+        or args.apply_plan
+        or profiling_requested(args)
+    ):
+        return (
+            "--watch cannot be used with --uninstall, --rollback, --store, --staged, "
+            "--dry-run, --plan-out, --apply-plan or profiling."
+        )
+    if (args.plan_out or args.apply_plan) and (args.uninstall or args.rollback or args.store):
+        return (
+            "--plan-out and --apply-plan cannot be used with --uninstall, --rollback "
+            "or --store."
+        )
+    return None
 
 
 def main() -> int:
     args = parse_args()
 
-    if args.project_full and not args.project_dir:
+    saved_plan = None
+    if args.apply_plan:
+        try:
+            saved_plan = load_install_plan(Path(args.apply_plan).expanduser())
+        except (OSError, ValueError) as exc:
+            print(f"Cannot read --apply-plan file: {exc}", file=sys.stderr)
+            return 2
+        apply_plan_options(args, saved_plan)
+
+    project_targets = args.project_dir or args.projects_from or args.discover
+    if args.project_full and not project_targets:
         print("--project-full requires --project-dir", file=sys.stderr)
         return 2
 
-    if args.project_dir and args.target_home:
+    if project_targets and args.target_home:
         print(
             "Use either --project-dir or --target-home (not both).",
             file=sys.stderr,
         )
         return 2
 
-    if args.uninstall and args.install_deps:
-        print("--install-deps cannot be used with --uninstall.", file=sys.stderr)
-        return 2
-
-    if args.uninstall_all and not args.uninstall:
-        print("--uninstall-all requires --uninstall.", file=sys.stderr)
+    if (args.store or args.rollback or args.store_dir) and not project_targets:
+        print("--store, --store-dir and --rollback require --project-dir.", file=sys.stderr)
         return 2
 
-    if args.uninstall and args.preserve_existing:
-        print("--preserve-existing cannot be used with --uninstall.", file=sys.stderr)
+    error = option_error(args)
+    if error is not None:
+        print(error, file=sys.stderr)
         return 2
 
     if args.uninstall and args.project_full:
@@ -1997,151 +6595,37 @@ def main() -> int:
             )
             args.preserve_existing = False
 
-    bundle_dir = Path(__file__).resolve().parent
-    payload = bundle_dir / "payload"
-    manifest_path = bundle_dir / "manifest.json"
+    if args.plan_out:
+        args.dry_run = True
 
-    if not payload.exists() or not manifest_path.exists():
-        print("Bundle is missing payload or manifest", file=sys.stderr)
+    targets = fleet_targets(args)
+    if targets is None:
         return 2
-
-    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
-    source_home = manifest["source_home"]
-    copied_items = manifest.get("copied_items", [])
-    exts = set(manifest.get("text_extensions", []))
-    basenames = set(manifest.get("text_basenames", []))
-
-    missing_optional: list[str] = []
-    if not args.uninstall:
-        required_tools = ["python3", "node", "git"]
-        optional_tools = ["bun", "uv", "ck"]
-        missing_required = [
-            tool for tool in required_tools if shutil.which(tool) is None
-        ]
-        missing_optional = [
-            tool for tool in optional_tools if shutil.which(tool) is None
-        ]
-
-        if args.install_deps:
-            install_missing_deps(missing_required + missing_optional)
-        if missing_required:
-            print("Warning: missing required tools:", ", ".join(missing_required))
-
-    state = InstallState()
-    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-
-    if args.project_dir:
-        mode = "project"
-        project_root = Path(args.project_dir).expanduser().resolve()
-        if not project_root.exists() or not project_root.is_dir():
-            print(f"Project directory does not exist: {project_root}", file=sys.stderr)
-            return 2
-
-        if args.uninstall:
-            uninstall_state = UninstallState()
-            if args.uninstall_all:
-                uninstall_all_roots(
-                    destination_root=project_root,
-                    args=args,
-                    state=uninstall_state,
-                    project_mode=True,
-                )
-            else:
-                uninstall_entries(
-                    payload=payload,
-                    destination_root=project_root,
-                    plan=project_copy_plan(include_machine_config=True),
-                    args=args,
-                    state=uninstall_state,
-                    project_mode=True,
-                )
-            print_uninstall_summary(uninstall_state, mode, project_root, args.dry_run)
-            return 0
-
-        if args.project_full:
-            state.notes.append(
-                "Project full mode enabled: installing full machine config in project "
-                "for one-click setup."
-            )
-
-        project_rewrite_rules = dedupe_replacements(
-            project_replacements(source_home, project_root, Path.home())
-        )
-        plan = project_copy_plan(args.include_machine_config)
-        install_entries(
-            payload=payload,
-            destination_root=project_root,
-            plan=plan,
-            args=args,
-            state=state,
-            stamp=stamp,
-            project_mode=True,
-            replacements=project_rewrite_rules,
-            exts=exts,
-            basenames=basenames,
-        )
-
-        migrate_opencode_compat_dirs(
-            opencode_root=project_root / ".opencode",
-            args=args,
-            state=state,
-            stamp=stamp,
-        )
-        ensure_project_opencode_json(project_root, args, state, stamp)
-        ensure_hook_executable_bits(project_root / ".cursor" / "hooks", args.dry_run)
-        print_summary(state, mode, project_root, args.dry_run, missing_optional)
-        return 0
-
-    mode = "home"
-    target_home = Path(args.target_home or Path.home()).expanduser().resolve()
-    plan = global_copy_plan(copied_items)
-
-    if args.uninstall:
-        uninstall_state = UninstallState()
-        if args.uninstall_all:
-            uninstall_all_roots(
-                destination_root=target_home,
-                args=args,
-                state=uninstall_state,
-                project_mode=False,
-            )
-        else:
-            uninstall_entries(
-                payload=payload,
-                destination_root=target_home,
-                plan=plan,
-                args=args,
-                state=uninstall_state,
-                project_mode=False,
+    if len(targets) > 1 or args.projects_from or args.discover:
+        if args.profile_dump or args.plan_out or args.apply_plan or args.watch:
+            print(
+                "--profile-dump, --plan-out, --apply-plan and --watch require a single "
+                "target.",
+                file=sys.stderr,
             )
-        print_uninstall_summary(uninstall_state, mode, target_home, args.dry_run)
-        return 0
-
-    home_rewrite_rules = dedupe_replacements(
-        global_replacements(source_home, str(target_home))
-    )
-    install_entries(
-        payload=payload,
-        destination_root=target_home,
-        plan=plan,
-        args=args,
-        state=state,
-        stamp=stamp,
-        project_mode=False,
-        replacements=home_rewrite_rules,
-        exts=exts,
-        basenames=basenames,
-    )
+            return 2
+        context = load_bundle_context(args)
+        if context is None:
+            return 2
+        context.missing_optional = check_tools(args)
+        return run_fleet(context, args, targets)
 
-    migrate_opencode_compat_dirs(
-        opencode_root=target_home / ".config" / "opencode",
-        args=args,
-        state=state,
-        stamp=stamp,
-    )
-    ensure_hook_executable_bits(target_home / ".cursor" / "hooks", args.dry_run)
-    print_summary(state, mode, target_home, args.dry_run, missing_optional)
-    return 0
+    profiler = cProfile.Profile() if args.profile_dump else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return install_single_target(args, *targets[0], saved_plan)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            dump_path = Path(args.profile_dump).expanduser()
+            profiler.dump_stats(dump_path)
+            print("cProfile dump:", dump_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Pack payload/ and manifest.json into a single-file bundle for `install_bundle.py --payload`.
+
+Members are stored uncompressed in payload order, so the installer can read them in
+place through an mmap:
+
+    python3 scripts/pack_payload.py -o ai-config-bundle.zip
+    python3 scripts/pack_payload.py --format tar -o ai-config-bundle.tar
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tarfile
+import zipfile
+from pathlib import Path
+
+BUNDLE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BUNDLE_DIR))
+
+import install_bundle  # noqa: E402
+
+
+def bundle_members() -> list[tuple[Path, str]]:
+    payload = BUNDLE_DIR / "payload"
+    members = [(BUNDLE_DIR / "manifest.json", "manifest.json")]
+    for path in install_bundle.iter_payload_files(payload):
+        members.append((path, f"payload/{path.relative_to(payload).as_posix()}"))
+    return members
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", required=True, help="Archive to write.")
+    parser.add_argument(
+        "--format",
+        choices=["zip", "tar"],
+        default=None,
+        help="Archive format. Default: taken from the output suffix, else zip.",
+    )
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    archive_format = args.format or ("tar" if output.suffix == ".tar" else "zip")
+    members = bundle_members()
+    if archive_format == "zip":
+        with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+            for path, name in members:
+                archive.write(path, name)
+    else:
+        with tarfile.open(output, "w", format=tarfile.PAX_FORMAT) as archive:
+            for path, name in members:
+                archive.add(path, name, recursive=False)
+    print(f"Wrote {output} ({len(members)} members, {archive_format})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -23,6 +23,8 @@ paths: list[Path] = [root / "install_bundle.py"]
 
 hooks_dir = root / "payload" / ".cursor" / "hooks"
 paths.extend(sorted(hooks_dir.glob("*.py")))
+paths.extend(sorted((root / "benchmarks").glob("*.py")))
+paths.extend(sorted((root / "scripts").glob("*.py")))
 
 missing = [str(p) for p in paths if not p.exists()]
 if missing:
@@ -60,6 +62,9 @@ if bad:
 print("OK: payload is source-only")
 PY
 
+echo "Assert manifest files table matches payload"
+python3 scripts/update_manifest.py --check
+
 echo "Smoke test installer (dry-run)"
 tmp_root="$(mktemp -d 2>/dev/null || mktemp -d -t ai-config-bundle)"
 trap 'rm -rf "$tmp_root"' EXIT
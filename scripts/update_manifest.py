@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Regenerate the per-file `files` table in manifest.json from payload/.
+
+Each entry records a payload file's size, sha256, whether the installer treats it as
+UTF-8 text, and which rewrite placeholders it contains. Run after changing payload/:
+
+    python3 scripts/update_manifest.py
+    python3 scripts/update_manifest.py --check   # exit 1 when the table is stale
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+BUNDLE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BUNDLE_DIR))
+
+import install_bundle  # noqa: E402
+
+
+def build_files_table(manifest: dict, payload: Path) -> list[dict[str, object]]:
+    exts = set(manifest.get("text_extensions", []))
+    basenames = set(manifest.get("text_basenames", []))
+    tokens = install_bundle.placeholder_tokens(manifest["source_home"])
+    files: list[dict[str, object]] = []
+    for path in install_bundle.iter_payload_files(payload):
+        entry = {"path": path.relative_to(payload).as_posix()}
+        entry.update(
+            install_bundle.describe_payload_file(
+                path, path.read_bytes(), exts, basenames, tokens
+            )
+        )
+        files.append(entry)
+    return files
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Do not write; exit 1 if manifest.json is out of date.",
+    )
+    args = parser.parse_args()
+
+    manifest_path = BUNDLE_DIR / "manifest.json"
+    current = manifest_path.read_text(encoding="utf-8")
+    manifest = json.loads(current)
+    manifest["placeholder_tokens"] = install_bundle.placeholder_tokens(
+        manifest["source_home"]
+    )
+    manifest["files"] = build_files_table(manifest, BUNDLE_DIR / "payload")
+    updated = json.dumps(manifest, indent=2) + "\n"
+
+    if updated == current:
+        print("manifest.json is up to date")
+        return 0
+    if args.check:
+        print(
+            "manifest.json files table is stale; run python3 scripts/update_manifest.py",
+            file=sys.stderr,
+        )
+        return 1
+    manifest_path.write_text(updated, encoding="utf-8")
+    print(f"Updated {manifest_path} ({len(manifest['files'])} files)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,743 @@
+import assert from "node:assert/strict"
+import { createHash } from "node:crypto"
+import { chmod, cp, link, lstat, mkdir, mkdtemp, readdir, readFile, readlink, rename, rm, stat, writeFile } from "node:fs/promises"
+import os from "node:os"
+import { join } from "node:path"
+import { spawn } from "node:child_process"
+import test from "node:test"
+import { fileURLToPath } from "node:url"
+
+const REPO_ROOT = fileURLToPath(new URL("..", import.meta.url))
+const PYTHON = process.platform === "win32" ? "python" : "python3"
+
+function run(command, args, cwd = REPO_ROOT) {
+  return new Promise((resolve, reject) => {
+    const child = spawn(command, args, { cwd })
+    let stdout = ""
+    let stderr = ""
+    child.stdout.on("data", (chunk) => {
+      stdout += chunk
+    })
+    child.stderr.on("data", (chunk) => {
+      stderr += chunk
+    })
+    child.on("error", reject)
+    child.on("close", (code) => {
+      if (code === 0) {
+        resolve({ stdout, stderr })
+        return
+      }
+      reject(new Error(`${command} ${args.join(" ")} failed (${code})\n${stdout}\n${stderr}`))
+    })
+  })
+}
+
+function summaryValue(stdout, label) {
+  const match = stdout.match(new RegExp(`^${label}: (.*)$`, "m"))
+  assert.ok(match, `expected summary line "${label}" in output`)
+  return match[1]
+}
+
+async function withTempProject(prefix, callback) {
+  const tempRoot = await mkdtemp(join(os.tmpdir(), prefix))
+  const projectDir = join(tempRoot, "project")
+  try {
+    await mkdir(projectDir, { recursive: true })
+    await callback(projectDir, tempRoot)
+  } finally {
+    await rm(tempRoot, { recursive: true, force: true })
+  }
+}
+
+test("project install records a content ledger and reinstalls without backups", async () => {
+  await withTempProject("bundle-ledger-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+
+    const ledger = JSON.parse(await readFile(join(projectDir, ".ai-bundle/ledger.json"), "utf8"))
+    assert.equal(ledger.version, 1)
+    const entry = ledger.files["ai-kb/rules/tdd.md"]
+    assert.ok(entry, "expected ledger entry for ai-kb/rules/tdd.md")
+    const installed = await readFile(join(projectDir, "ai-kb/rules/tdd.md"))
+    assert.equal(entry.sha256, createHash("sha256").update(installed).digest("hex"))
+    assert.equal(entry.size, installed.length)
+
+    const gitignore = await readFile(join(projectDir, ".gitignore"), "utf8")
+    assert.match(gitignore, /^\.ai-bundle\/$/m)
+
+    const reinstall = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--force"])
+    assert.equal(summaryValue(reinstall.stdout, "Backups created"), "0")
+    assert.equal(summaryValue(reinstall.stdout, "Overwritten files"), "0")
+
+    await writeFile(join(projectDir, "ai-kb/rules/tdd.md"), "locally edited\n")
+    const afterEdit = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    assert.equal(summaryValue(afterEdit.stdout, "Backups created"), "1")
+    assert.deepEqual(await readFile(join(projectDir, "ai-kb/rules/tdd.md")), installed)
+  })
+})
+
+test("parallel install matches sequential output and file contents", async () => {
+  await withTempProject("bundle-jobs-", async (sequentialDir, tempRoot) => {
+    const parallelDir = join(tempRoot, "parallel")
+    await mkdir(parallelDir, { recursive: true })
+
+    const sequential = await run(PYTHON, ["install_bundle.py", "--project-dir", sequentialDir])
+    const parallel = await run(PYTHON, ["install_bundle.py", "--project-dir", parallelDir, "--jobs", "4"])
+
+    assert.equal(
+      parallel.stdout.replaceAll(parallelDir, "<project>"),
+      sequential.stdout.replaceAll(sequentialDir, "<project>"),
+    )
+    for (const relativePath of ["ai-kb/rules/tdd.md", ".opencode/agents/supervisor.md", ".cursor/mcp.json"]) {
+      assert.deepEqual(
+        await readFile(join(parallelDir, relativePath)),
+        await readFile(join(sequentialDir, relativePath)),
+        `${relativePath} should match between sequential and parallel installs`,
+      )
+    }
+  })
+})
+
+test("path rewriting is a single leftmost-longest pass", async () => {
+  const script = [
+    "import json, install_bundle as ib",
+    "rules = ib.dedupe_replacements([('~/ai-kb', 'ai-kb'), ('~/', '/home/u/'), ('ai-kb', 'KB'), ('__HOME__', '~/ai-kb')])",
+    "print(json.dumps(ib.apply_replacements('__HOME__ ~/ai-kb/x ~/y ai-kb', rules)))",
+  ].join("\n")
+  const { stdout } = await run(PYTHON, ["-c", script])
+  assert.equal(JSON.parse(stdout), "~/ai-kb ai-kb/x /home/u/y KB")
+})
+
+test("hardlink mode shares unrewritten payload files and falls back for rewritten ones", async () => {
+  await withTempProject("bundle-link-", async (projectDir) => {
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--link-mode", "hardlink"])
+    assert.match(summaryValue(stdout, "Install modes"), /^copy=\d+, hardlink=\d+$/)
+
+    const ledger = JSON.parse(await readFile(join(projectDir, ".ai-bundle/ledger.json"), "utf8"))
+    const linked = await stat(join(REPO_ROOT, "payload/ai-kb/rules/tdd.md"))
+    const installed = await stat(join(projectDir, "ai-kb/rules/tdd.md"))
+    if (process.platform !== "win32") {
+      assert.equal(installed.ino, linked.ino)
+    }
+    const bytes = await readFile(join(projectDir, "ai-kb/rules/tdd.md"))
+    assert.equal(ledger.files["ai-kb/rules/tdd.md"].sha256, createHash("sha256").update(bytes).digest("hex"))
+
+    const reinstall = await run(PYTHON, [
+      "install_bundle.py",
+      "--project-dir",
+      projectDir,
+      "--link-mode",
+      "hardlink",
+      "--force",
+    ])
+    assert.equal(summaryValue(reinstall.stdout, "Backups created"), "0")
+  })
+})
+
+test("store mode links projects to a shared generation and rolls back", { skip: process.platform === "win32" }, async () => {
+  await withTempProject("bundle-store-", async (projectDir, tempRoot) => {
+    const storeDir = join(tempRoot, "store")
+    const otherProject = join(tempRoot, "other")
+    await mkdir(otherProject, { recursive: true })
+    const bundleCopy = join(tempRoot, "bundle")
+    await cp(REPO_ROOT, bundleCopy, {
+      recursive: true,
+      filter: (source) => !/[\\/](\.git|node_modules)$/.test(source),
+    })
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--store", "--store-dir", storeDir])
+    await run(PYTHON, ["install_bundle.py", "--project-dir", otherProject, "--store", "--store-dir", storeDir])
+    const firstGeneration = await readlink(join(projectDir, ".ai-bundle/current"))
+    assert.equal(await readlink(join(otherProject, ".ai-bundle/current")), firstGeneration)
+    assert.equal((await readdir(storeDir)).length, 1)
+    assert.equal(await readlink(join(projectDir, "ai-kb")), join(".ai-bundle", "current", "ai-kb"))
+    const original = await readFile(join(projectDir, "ai-kb/rules/tdd.md"), "utf8")
+
+    await writeFile(join(bundleCopy, "payload/ai-kb/rules/tdd.md"), "next bundle version\n")
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--store", "--store-dir", storeDir], bundleCopy)
+    assert.notEqual(await readlink(join(projectDir, ".ai-bundle/current")), firstGeneration)
+    assert.equal(await readFile(join(projectDir, "ai-kb/rules/tdd.md"), "utf8"), "next bundle version\n")
+
+    const rollback = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--rollback"])
+    assert.equal(summaryValue(rollback.stdout, "Store generation"), firstGeneration.split(/[\\/]/).pop())
+    assert.equal(await readFile(join(projectDir, "ai-kb/rules/tdd.md"), "utf8"), original)
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", otherProject, "--uninstall"])
+    assert.equal(await readFile(join(firstGeneration, "ai-kb/rules/tdd.md"), "utf8"), original)
+  })
+})
+
+test("global install links the OpenCode KB mirror to the primary KB", { skip: process.platform === "win32" }, async () => {
+  await withTempProject("bundle-kb-mirror-", async (homeDir) => {
+    const mirror = join(homeDir, ".config/opencode/ai-kb")
+    await run(PYTHON, ["install_bundle.py", "--target-home", homeDir])
+    assert.equal(await readlink(mirror), join("..", "..", "ai-kb"))
+    assert.deepEqual(
+      await readFile(join(mirror, "rules/tdd.md")),
+      await readFile(join(homeDir, "ai-kb/rules/tdd.md")),
+    )
+    const ledger = JSON.parse(await readFile(join(homeDir, ".ai-bundle/ledger.json"), "utf8"))
+    assert.ok(!Object.keys(ledger.files).some((key) => key.startsWith(".config/opencode/ai-kb/")))
+
+    const reinstall = await run(PYTHON, ["install_bundle.py", "--target-home", homeDir])
+    assert.doesNotMatch(reinstall.stdout, /Link KB mirror/)
+
+    await run(PYTHON, ["install_bundle.py", "--target-home", homeDir, "--uninstall"])
+    await assert.rejects(lstat(mirror), { code: "ENOENT" })
+  })
+})
+
+test("manifest files table skips rewriting only while entries match the payload", async () => {
+  await withTempProject("bundle-manifest-files-", async (projectDir, tempRoot) => {
+    const manifest = JSON.parse(await readFile(join(REPO_ROOT, "manifest.json"), "utf8"))
+    const entry = manifest.files.find((item) => item.path === "ai-kb/rules/tdd.md")
+    assert.deepEqual(entry.placeholders, [])
+    assert.equal(entry.text, true)
+
+    const bundleCopy = join(tempRoot, "bundle")
+    await cp(REPO_ROOT, bundleCopy, {
+      recursive: true,
+      filter: (source) => !/[\\/](\.git|node_modules)$/.test(source),
+    })
+    const payloadFile = join(bundleCopy, "payload/ai-kb/rules/tdd.md")
+    await writeFile(payloadFile, `${await readFile(payloadFile, "utf8")}See ~/ai-kb/rules/INDEX.md\n`)
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir], bundleCopy)
+    const installed = await readFile(join(projectDir, "ai-kb/rules/tdd.md"), "utf8")
+    assert.match(installed, /See ai-kb\/rules\/INDEX\.md\n$/)
+  })
+})
+
+async function snapshotTree(root) {
+  const files = {}
+  for (const entry of await readdir(root, { recursive: true, withFileTypes: true })) {
+    if (!entry.isFile()) continue
+    const path = join(entry.parentPath ?? entry.path, entry.name)
+    const relativePath = path.slice(root.length + 1).replaceAll("\\", "/")
+    if (relativePath === ".ai-bundle/ledger.json" || relativePath === ".ai-bundle/fingerprint.json") continue
+    files[relativePath] = createHash("sha256").update(await readFile(path)).digest("hex")
+  }
+  return files
+}
+
+test("packed zip and tar payloads install byte-identical trees", async () => {
+  await withTempProject("bundle-packed-", async (projectDir, tempRoot) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const expected = await snapshotTree(projectDir)
+
+    for (const archive of ["bundle.zip", "bundle.tar"]) {
+      const archivePath = join(tempRoot, archive)
+      await run(PYTHON, ["scripts/pack_payload.py", "-o", archivePath])
+      await rm(projectDir, { recursive: true, force: true })
+      await mkdir(projectDir, { recursive: true })
+      await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--payload", archivePath])
+      assert.deepEqual(await snapshotTree(projectDir), expected, `${archive} install should match payload/`)
+    }
+  })
+})
+
+test("unchanged reinstall exits early from the fingerprint", async () => {
+  await withTempProject("bundle-fingerprint-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const noop = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    assert.match(summaryValue(noop.stdout, "Up to date"), /^yes/)
+    assert.doesNotMatch(noop.stdout, /Install dir:/)
+
+    const changedFlags = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--link-mode", "auto"])
+    assert.equal(summaryValue(changedFlags.stdout, "Backups created"), "0")
+
+    await rm(join(projectDir, ".cursor/mcp.json"))
+    const repaired = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--link-mode", "auto"])
+    assert.equal(summaryValue(repaired.stdout, "Created files"), "1")
+
+    const forced = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--link-mode", "auto", "--force"])
+    assert.equal(summaryValue(forced.stdout, "Created files"), "0")
+  })
+})
+
+test("fleet mode installs discovered and listed projects and prints one row per target", async () => {
+  await withTempProject("bundle-fleet-", async (listedProject, tempRoot) => {
+    const workspace = join(tempRoot, "workspace")
+    for (const repo of ["alpha", "group/beta", "node_modules/ignored"]) {
+      await mkdir(join(workspace, repo, ".git"), { recursive: true })
+    }
+    const listFile = join(tempRoot, "projects.txt")
+    await writeFile(listFile, `# fleet\n${listedProject}\n`)
+
+    const args = ["install_bundle.py", "--projects-from", listFile, "--discover", workspace, "--fleet-jobs", "2"]
+    const { stdout } = await run(PYTHON, args)
+    assert.equal(summaryValue(stdout, "Mode"), "fleet")
+    assert.equal(summaryValue(stdout, "Targets"), "3")
+    assert.equal(summaryValue(stdout, "Installed"), "3")
+    assert.equal(summaryValue(stdout, "Failed"), "0")
+    assert.doesNotMatch(stdout, /node_modules/)
+    for (const project of [listedProject, join(workspace, "alpha"), join(workspace, "group/beta")]) {
+      await stat(join(project, "ai-kb/rules/tdd.md"))
+    }
+
+    const again = await run(PYTHON, args)
+    assert.equal(summaryValue(again.stdout, "Up to date"), "3")
+  })
+})
+
+test("staged install swaps roots into place and matches an in-place install", async () => {
+  await withTempProject("bundle-staged-", async (projectDir) => {
+    const withoutBackups = (tree) => Object.fromEntries(Object.entries(tree).filter(([path]) => !path.includes(".bak.")))
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    await writeFile(join(projectDir, ".cursor/rules/user.mdc"), "user rule\n")
+    await writeFile(join(projectDir, ".cursor/rules/ai-kb.mdc"), "local edit\n")
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--force"])
+    const expected = withoutBackups(await snapshotTree(projectDir))
+
+    await writeFile(join(projectDir, ".cursor/rules/ai-kb.mdc"), "local edit\n")
+    const staged = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--force", "--staged"])
+    assert.equal(summaryValue(staged.stdout, "Backups created"), "1")
+    assert.match(staged.stdout, /Staged install: swapped \d+ managed roots into place/)
+    assert.deepEqual(await readdir(join(projectDir, ".ai-bundle")), ["fingerprint.json", "ledger.json"])
+    assert.deepEqual(withoutBackups(await snapshotTree(projectDir)), expected)
+
+    const noop = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    assert.match(summaryValue(noop.stdout, "Up to date"), /^yes/)
+  })
+})
+
+test("backup store keeps identical backups once and uninstall restores from it", async () => {
+  await withTempProject("bundle-backup-store-", async (projectDir) => {
+    const rulePath = join(projectDir, ".cursor/rules/ai-kb.mdc")
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    for (let round = 0; round < 2; round += 1) {
+      await writeFile(rulePath, "local edit\n")
+      const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--backups", "store", "--force"])
+      assert.equal(summaryValue(stdout, "Backups created"), "1")
+    }
+
+    const backupsDir = join(projectDir, ".ai-bundle/backups")
+    assert.equal((await readdir(join(backupsDir, "runs"))).length, 2)
+    const objectDirs = await readdir(join(backupsDir, "objects"))
+    assert.equal(objectDirs.length, 1)
+    assert.deepEqual(await readdir(join(projectDir, ".cursor/rules")), ["ai-kb.mdc"])
+
+    await writeFile(rulePath, "newer edit\n")
+    const pruned = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--backups", "store", "--force", "--keep-backups", "1"])
+    assert.match(pruned.stdout, /Backup retention: dropped 2 runs/)
+    assert.equal((await readdir(join(backupsDir, "runs"))).length, 1)
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--uninstall"])
+    assert.equal(await readFile(rulePath, "utf8"), "newer edit\n")
+  })
+})
+
+test("uninstall restores the newest sibling backup among many", async () => {
+  await withTempProject("bundle-backup-index-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const rulesDir = join(projectDir, ".cursor/rules")
+    for (let index = 0; index < 200; index += 1) {
+      const stamp = `2025${String((index % 12) + 1).padStart(2, "0")}01-000000`
+      await writeFile(join(rulesDir, `ai-kb.mdc.bak.${stamp}.${index}`), `backup ${index}\n`)
+    }
+    await writeFile(join(rulesDir, "ai-kb.mdc.bak.manual"), "manual\n")
+    await writeFile(join(rulesDir, "ai-kb.mdc.bak.20251201-000000.1000"), "newest\n")
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--uninstall"])
+    assert.equal(await readFile(join(rulesDir, "ai-kb.mdc"), "utf8"), "newest\n")
+  })
+})
+
+test("uninstall follows the ledger, removes retired files, and keeps modified ones", async () => {
+  await withTempProject("bundle-ledger-uninstall-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const ledgerFile = join(projectDir, ".ai-bundle/ledger.json")
+    const ledger = JSON.parse(await readFile(ledgerFile, "utf8"))
+    const retired = join(projectDir, "ai-kb/rules/retired.md")
+    await writeFile(retired, "retired rule\n")
+    // A stale mtime makes uninstall fall back to comparing the file's digest.
+    ledger.files["ai-kb/rules/retired.md"] = {
+      sha256: createHash("sha256").update("retired rule\n").digest("hex"),
+      size: 13,
+      mtime_ns: 0,
+    }
+    await writeFile(ledgerFile, JSON.stringify(ledger))
+    await writeFile(join(projectDir, "ai-kb/rules/tdd.md"), "my notes\n")
+
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--uninstall", "--jobs", "4"])
+    assert.equal(summaryValue(stdout, "Modified paths kept"), "1")
+    assert.deepEqual(await readdir(join(projectDir, "ai-kb/rules")), ["tdd.md"])
+    assert.equal(await readFile(join(projectDir, "ai-kb/rules/tdd.md"), "utf8"), "my notes\n")
+    await assert.rejects(stat(join(projectDir, ".cursor")))
+  })
+})
+
+test("reinstall over a reshaped destination matches a fresh install", async () => {
+  await withTempProject("bundle-stat-cache-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const expected = await snapshotTree(projectDir)
+
+    // The destination scan must notice a managed dir turned into a file and a removed subtree.
+    await rm(join(projectDir, ".cursor/rules"), { recursive: true })
+    await writeFile(join(projectDir, ".cursor/rules"), "not a directory\n")
+    await rm(join(projectDir, "ai-kb/rules"), { recursive: true })
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--force", "--jobs", "4"])
+    assert.equal(summaryValue(stdout, "Backups created"), "1")
+
+    const reinstalled = await snapshotTree(projectDir)
+    const backups = Object.keys(reinstalled).filter((path) => path.startsWith(".cursor/rules.bak."))
+    assert.equal(backups.length, 1)
+    delete reinstalled[backups[0]]
+    assert.deepEqual(reinstalled, expected)
+  })
+})
+
+test("profile mode reports phases and writes per-target metrics JSON", async () => {
+  await withTempProject("bundle-profile-", async (projectDir, tempRoot) => {
+    const metricsPath = join(tempRoot, "metrics.json")
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--profile", "--metrics-json", metricsPath])
+    assert.match(stdout, /^Profile:$/m)
+    assert.match(stdout, /^ {2}copy\s+\d+\.\d{3}s/m)
+
+    const metrics = JSON.parse(await readFile(metricsPath, "utf8"))
+    assert.equal(metrics.version, 1)
+    assert.equal(metrics.targets.length, 1)
+    const [target] = metrics.targets
+    assert.equal(target.mode, "project")
+    assert.equal(target.exit_code, 0)
+    assert.ok(target.phases.copy > 0)
+    assert.ok(target.counters.payload_bytes_read > 0)
+    assert.ok(target.counters.bytes_written > 0)
+    assert.ok(target.syscalls.open > 0)
+    assert.equal(target.summary.created_files, Number(summaryValue(stdout, "Created files")))
+    assert.deepEqual(metrics.totals.counters, target.counters)
+  })
+})
+
+test("quiet mode prints only the summary and events JSONL records every action", async () => {
+  await withTempProject("bundle-events-", async (projectDir, tempRoot) => {
+    const eventsPath = join(tempRoot, "events.jsonl")
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "-q", "--events-jsonl", eventsPath])
+    assert.doesNotMatch(stdout, /^Install file:/m)
+    assert.match(stdout, /^Done$/m)
+
+    const events = (await readFile(eventsPath, "utf8")).trim().split("\n").map((line) => JSON.parse(line))
+    const installed = events.filter((event) => event.event === "install-file")
+    assert.ok(installed.length > 0)
+    const target = summaryValue(stdout, "Target")
+    assert.ok(installed.every((event) => event.target === target && event.dst.startsWith(target)))
+    const summary = events.at(-1)
+    assert.equal(summary.event, "summary")
+    assert.equal(summary.created_files, Number(summaryValue(stdout, "Created files")))
+
+    const verbose = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--force", "-v"])
+    assert.match(verbose.stdout, /^Unchanged: /m)
+  })
+})
+
+test("in-process API applies one plan to several projects like the CLI", async () => {
+  await withTempProject("bundle-api-", async (projectDir, tempRoot) => {
+    const cliDir = join(tempRoot, "cli")
+    const otherDir = join(tempRoot, "other")
+    await mkdir(cliDir)
+    await mkdir(otherDir)
+    await run(PYTHON, ["install_bundle.py", "--project-dir", cliDir])
+
+    const script = [
+      "import json, sys",
+      "from install_bundle import Installer",
+      "installer = Installer()",
+      "plan = installer.plan('project')",
+      "results = [installer.apply(plan, target) for target in sys.argv[1:]]",
+      "results.append(installer.apply(plan, sys.argv[1]))",
+      "print(json.dumps([[r.exit_code, r.created_files, r.up_to_date, r.events[-1]['event']] for r in results]))",
+    ].join("\n")
+    const { stdout } = await run(PYTHON, ["-c", script, projectDir, otherDir])
+    const [first, second, again] = JSON.parse(stdout)
+    assert.equal(first[0], 0)
+    assert.ok(first[1] > 0)
+    assert.deepEqual(second, first)
+    assert.equal(again[2], true)
+    assert.equal(first[3], "summary")
+
+    const withoutState = async (dir) => {
+      const tree = await snapshotTree(dir)
+      for (const path of Object.keys(tree)) {
+        if (path.startsWith(".ai-bundle/") || path === "opencode.json") {
+          delete tree[path]
+        }
+      }
+      return tree
+    }
+    assert.deepEqual(await withoutState(projectDir), await withoutState(cliDir))
+  })
+})
+
+test("saved plans apply with planned backups and refuse a changed destination", async () => {
+  await withTempProject("bundle-plan-", async (projectDir, tempRoot) => {
+    const planPath = join(tempRoot, "plan.json")
+    await mkdir(join(projectDir, "ai-kb/rules"), { recursive: true })
+    await writeFile(join(projectDir, "ai-kb/rules/INDEX.md"), "local\n")
+    const mirrorDir = join(tempRoot, "mirror")
+    const driftDir = join(tempRoot, "drift")
+    await cp(projectDir, mirrorDir, { recursive: true })
+    await cp(projectDir, driftDir, { recursive: true })
+    await writeFile(join(driftDir, "ai-kb/rules/INDEX.md"), "changed!\n")
+
+    const planned = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--plan-out", planPath])
+    assert.equal(summaryValue(planned.stdout, "Dry run"), "yes")
+    assert.equal((await readdir(projectDir)).sort().join(","), "ai-kb")
+    const plan = JSON.parse(await readFile(planPath, "utf8"))
+    const replaced = plan.actions.filter((action) => action.action === "replace")
+    assert.deepEqual(replaced.map((action) => [action.dst, action.dest_stat]), [["ai-kb/rules/INDEX.md", "file:6"]])
+    assert.ok(plan.actions.filter((action) => action.action === "create").every((action) => action.sha256 && action.dest_stat === "missing"))
+
+    const applied = await run(PYTHON, ["install_bundle.py", "--apply-plan", planPath])
+    assert.equal(summaryValue(applied.stdout, "Backups created"), "1")
+    await stat(join(projectDir, replaced[0].backup))
+
+    // The same plan applies to an identical project, but not to one whose destination changed.
+    await run(PYTHON, ["install_bundle.py", "--apply-plan", planPath, "--project-dir", mirrorDir])
+    assert.equal(Object.keys(await snapshotTree(mirrorDir)).length, Object.keys(await snapshotTree(projectDir)).length)
+    await assert.rejects(
+      run(PYTHON, ["install_bundle.py", "--apply-plan", planPath, "--project-dir", driftDir]),
+      /destination changed: .*INDEX\.md \(planned file:6, found file:9\)/,
+    )
+    assert.deepEqual(await readdir(driftDir), ["ai-kb"])
+  })
+})
+
+test("reinstall from a git checkout copies only payload files changed since the installed commit", async () => {
+  await withTempProject("bundle-git-", async (projectDir, tempRoot) => {
+    const bundleDir = join(tempRoot, "bundle")
+    for (const item of ["install_bundle.py", "manifest.json", "payload", "ai-kb"]) {
+      await cp(join(REPO_ROOT, item), join(bundleDir, item), { recursive: true })
+    }
+    const git = (...args) => run("git", ["-c", "user.name=test", "-c", "user.email=test@example.com", "-c", "commit.gpgsign=false", ...args], bundleDir)
+    await git("init", "-q")
+    await git("add", "-A")
+    await git("commit", "-q", "-m", "base")
+    const installer = join(bundleDir, "install_bundle.py")
+    await run(PYTHON, [installer, "--project-dir", projectDir])
+
+    await writeFile(join(bundleDir, "payload/ai-kb/rules/zz-added.md"), "added rule\n")
+    await git("add", "-A")
+    await git("commit", "-q", "-m", "add a rule")
+    const { stdout } = await run(PYTHON, [installer, "--project-dir", projectDir, "--profile"])
+    assert.match(stdout, /Incremental install: 1 payload files changed/)
+    assert.equal(summaryValue(stdout, "Created files"), "1")
+    assert.equal(summaryValue(stdout, "Payload files read"), "1")
+
+    // An uncommitted change falls back to a full pass.
+    await writeFile(join(bundleDir, "payload/ai-kb/rules/zz-added.md"), "edited rule\n")
+    const dirty = await run(PYTHON, [installer, "--project-dir", projectDir, "--profile"])
+    assert.doesNotMatch(dirty.stdout, /Incremental install/)
+    assert.ok(Number(summaryValue(dirty.stdout, "Payload files read")) > 1)
+  })
+})
+
+test("watch mode syncs an edited payload file without a backup", async () => {
+  await withTempProject("bundle-watch-", async (projectDir, tempRoot) => {
+    const payloadDir = join(tempRoot, "payload")
+    await cp(join(REPO_ROOT, "payload"), payloadDir, { recursive: true })
+    const child = spawn(PYTHON, ["install_bundle.py", "--payload", payloadDir, "--project-dir", projectDir, "--watch", "-q"], { cwd: REPO_ROOT })
+    let stdout = ""
+    child.stdout.on("data", (chunk) => {
+      stdout += chunk
+    })
+    const closed = new Promise((resolve) => child.on("close", resolve))
+    const waitFor = async (check) => {
+      for (let attempt = 0; attempt < 200; attempt += 1) {
+        if (await check()) return
+        await new Promise((resolve) => setTimeout(resolve, 50))
+      }
+      assert.fail(`timed out waiting; output so far:\n${stdout}`)
+    }
+    try {
+      await waitFor(() => stdout.includes("Watching "))
+      const source = join(payloadDir, "ai-kb/rules/INDEX.md")
+      await writeFile(source, `${await readFile(source, "utf8")}\nwatch edit\n`)
+      const installed = join(projectDir, "ai-kb/rules/INDEX.md")
+      await waitFor(async () => (await readFile(installed, "utf8")).includes("watch edit"))
+      await waitFor(() => stdout.includes("Synced 1 changed payload files"))
+      assert.match(stdout, /0 created, 1 updated, 0 backups/)
+      const backups = (await readdir(join(projectDir, "ai-kb/rules"))).filter((name) => name.includes(".bak."))
+      assert.deepEqual(backups, [])
+    } finally {
+      child.kill("SIGINT")
+      await closed
+    }
+  })
+})
+
+test("opencode.json defaults are parsed once per process and not shared between merges", async () => {
+  await withTempProject("bundle-defaults-", async (projectDir, tempRoot) => {
+    const cliDir = join(tempRoot, "cli")
+    const otherDir = join(tempRoot, "other")
+    await mkdir(cliDir)
+    await mkdir(otherDir)
+    await run(PYTHON, ["install_bundle.py", "--project-dir", cliDir])
+
+    const script = [
+      "import json, sys",
+      "import install_bundle",
+      "installer = install_bundle.Installer()",
+      "plan = installer.plan('project')",
+      "codes = [installer.apply(plan, target).exit_code for target in sys.argv[1:]]",
+      "merged = []",
+      "for _ in range(2):",
+      "    config = {'agent': {'orchestrator': {'model': 'custom'}}, 'default_agent': 'orchestrator'}",
+      "    install_bundle.merge_runtime_opencode_config(config, '~/.config/opencode')",
+      "    merged.append(json.loads(json.dumps(config)))",
+      "    config['agent']['build']['prompt'] = 'edited'",
+      "    config['compaction']['auto'] = False",
+      "    config['mcp']['ck']['command'].append('edited')",
+      "misses = install_bundle.parse_primary_agent_specs.cache_info().misses",
+      "print(json.dumps([codes, misses, merged]))",
+    ].join("\n")
+    const { stdout } = await run(PYTHON, ["-c", script, projectDir, otherDir])
+    const [codes, misses, [first, second]] = JSON.parse(stdout)
+    assert.deepEqual(codes, [0, 0])
+    assert.equal(misses, 1)
+    assert.deepEqual(second, first)
+    assert.equal(first.default_agent, "plan")
+    assert.ok(first.agent.plan.prompt)
+    assert.equal(first.agent.orchestrator, undefined)
+
+    // Plugin URIs are absolute per project; everything else must match the CLI install.
+    const readConfig = async (dir) => {
+      const { plugin, ...config } = JSON.parse(await readFile(join(dir, "opencode.json"), "utf8"))
+      return config
+    }
+    const cliConfig = await readConfig(cliDir)
+    assert.deepEqual(await readConfig(projectDir), cliConfig)
+    assert.deepEqual(await readConfig(otherDir), cliConfig)
+  })
+})
+
+test("a same-size payload edit is rendered even though the manifest entry is stale", async () => {
+  await withTempProject("bundle-stale-index-", async (projectDir, tempRoot) => {
+    const payloadDir = join(tempRoot, "payload")
+    await cp(join(REPO_ROOT, "payload"), payloadDir, { recursive: true })
+    const agentPath = join(payloadDir, ".config/opencode/agent/evidence-curator.md")
+    const original = await readFile(agentPath, "utf8")
+    const edited = original.replace("the summary", "~/ai-kbmary")
+    assert.notEqual(edited, original)
+    assert.equal(Buffer.byteLength(edited), Buffer.byteLength(original))
+    await writeFile(agentPath, edited)
+
+    await run(PYTHON, ["install_bundle.py", "--payload", payloadDir, "--project-dir", projectDir])
+    const installed = await readFile(join(projectDir, ".opencode/agents/evidence-curator.md"), "utf8")
+    assert.ok(!installed.includes("~/ai-kb"))
+    assert.notEqual(installed, original)
+  })
+})
+
+test("a long-lived Installer picks up edited agent docs", async () => {
+  await withTempProject("bundle-agent-docs-", async (projectDir, tempRoot) => {
+    const docsDir = join(tempRoot, "agents")
+    const otherDir = join(tempRoot, "other")
+    await cp(join(REPO_ROOT, "ai-kb/agents"), docsDir, { recursive: true })
+    await mkdir(otherDir)
+
+    const script = [
+      "import sys",
+      "from pathlib import Path",
+      "import install_bundle",
+      "install_bundle.PRIMARY_AGENT_DOCS_ROOT = Path(sys.argv[1])",
+      "installer = install_bundle.Installer()",
+      "installer.install(sys.argv[2])",
+      "doc = Path(sys.argv[1]) / 'build.md'",
+      "doc.write_text(doc.read_text(encoding='utf-8') + '\\nEdited build prompt.\\n', encoding='utf-8')",
+      "installer.install(sys.argv[3])",
+    ].join("\n")
+    await run(PYTHON, ["-c", script, docsDir, projectDir, otherDir])
+
+    const buildPrompt = async (dir) =>
+      JSON.parse(await readFile(join(dir, "opencode.json"), "utf8")).agent.build.prompt
+    assert.ok(!(await buildPrompt(projectDir)).includes("Edited build prompt."))
+    assert.ok((await buildPrompt(otherDir)).endsWith("Edited build prompt."))
+  })
+})
+
+test("saved plans refuse payload files added after planning", async () => {
+  await withTempProject("bundle-plan-extra-", async (projectDir, tempRoot) => {
+    const payloadDir = join(tempRoot, "payload")
+    const planPath = join(tempRoot, "plan.json")
+    await cp(join(REPO_ROOT, "payload"), payloadDir, { recursive: true })
+    await run(PYTHON, ["install_bundle.py", "--payload", payloadDir, "--project-dir", projectDir, "--plan-out", planPath])
+    await writeFile(join(payloadDir, "ai-kb/rules/zz-unplanned.md"), "not reviewed\n")
+
+    await assert.rejects(
+      run(PYTHON, ["install_bundle.py", "--payload", payloadDir, "--apply-plan", planPath]),
+      /payload file is not in the plan: .*zz-unplanned\.md/,
+    )
+    assert.deepEqual(await readdir(projectDir), [])
+
+    await rm(join(payloadDir, "ai-kb/rules/zz-unplanned.md"))
+    await run(PYTHON, ["install_bundle.py", "--payload", payloadDir, "--apply-plan", planPath])
+    await stat(join(projectDir, "ai-kb/rules/INDEX.md"))
+  })
+})
+
+test("a staged swap whose rollback fails keeps the previous roots in the stage", async () => {
+  await withTempProject("bundle-staged-rollback-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const script = [
+      "import os, sys",
+      "import install_bundle",
+      "real_rename = os.rename",
+      "swaps = []",
+      "def flaky_rename(src, dst):",
+      "    src, dst = str(src), str(dst)",
+      "    if os.sep + '.replaced' + os.sep in src:",
+      "        raise OSError('rollback refused')",
+      "    if os.sep + 'stage-' in src and os.sep + 'stage-' not in dst:",
+      "        swaps.append(src)",
+      "        if len(swaps) == 2:",
+      "            raise OSError('swap refused')",
+      "    real_rename(src, dst)",
+      "os.rename = flaky_rename",
+      "sys.argv = ['install_bundle.py', '--project-dir', sys.argv[1], '--force', '--staged', '-q']",
+      "code = install_bundle.main()",
+      "os.rename = real_rename",
+      "print('exit', code)",
+    ].join("\n")
+    const { stdout, stderr } = await run(PYTHON, ["-c", script, projectDir])
+    assert.match(stdout, /^exit 2$/m)
+    assert.match(stderr, /Staged install failed and could not be undone: swap refused/)
+    const kept = [...stderr.matchAll(/^ - (.*[\\/]\.replaced[\\/].*)$/gm)].map((match) => match[1])
+    assert.ok(kept.length > 0)
+    for (const path of kept) {
+      await stat(path)
+    }
+  })
+})
+
+test("a staged run restores roots an interrupted swap left in the old stage", async () => {
+  await withTempProject("bundle-staged-interrupted-", async (projectDir) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    await writeFile(join(projectDir, ".opencode/user-notes.md"), "mine\n")
+    await writeFile(join(projectDir, ".cursor/rules/user.mdc"), "user rule\n")
+
+    // A run killed between moving the live roots aside and moving the staged ones in.
+    const replaced = join(projectDir, ".ai-bundle/stage-20260101-000000-1/.replaced")
+    await mkdir(join(replaced, ".cursor"), { recursive: true })
+    await rename(join(projectDir, ".opencode"), join(replaced, ".opencode"))
+    await rename(join(projectDir, ".cursor/rules"), join(replaced, ".cursor/rules"))
+
+    const { stdout } = await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--staged", "--force", "-v"])
+    assert.match(stdout, /Restore root from interrupted swap: .*\.opencode/)
+    assert.equal(await readFile(join(projectDir, ".opencode/user-notes.md"), "utf8"), "mine\n")
+    assert.equal(await readFile(join(projectDir, ".cursor/rules/user.mdc"), "utf8"), "user rule\n")
+    assert.deepEqual(await readdir(join(projectDir, ".ai-bundle")), ["fingerprint.json", "ledger.json"])
+  })
+})
+
+test("a staged run sets hook modes on its own copy, not on the live inode", { skip: process.platform === "win32" }, async () => {
+  await withTempProject("bundle-staged-chmod-", async (projectDir, tempRoot) => {
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir])
+    const hookPath = join(projectDir, ".cursor/hooks/kb-post-turn-analyzer.py")
+    const otherLink = join(tempRoot, "hook-link.py")
+    await chmod(hookPath, 0o644)
+    await link(hookPath, otherLink)
+
+    await run(PYTHON, ["install_bundle.py", "--project-dir", projectDir, "--staged", "--force"])
+    assert.equal((await stat(otherLink)).mode & 0o777, 0o644)
+    assert.ok((await stat(hookPath)).mode & 0o100)
+  })
+})